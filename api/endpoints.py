@@ -1,2 +1,315 @@
+"""
+HTTP бота.
+
+/metrics и /health поднимаются внутри процесса бота (start_http_server).
+Read-only API для дашбордов — отдельный процесс со своим пулом соединений,
+чтобы опрос статистики не нагружал event loop бота:
+
+    python -m api.endpoints
+
+    GET /api/servers/{server_id}/leaderboard?scope=points|streak|week|month&limit=&cursor=
+    GET /api/servers/{server_id}/users/{user_id}
+    GET /api/servers/{server_id}/users/{user_id}/activity?limit=&cursor=
+
+Ответы кэшируются на API_CACHE_TTL секунд, отдают ETag и Last-Modified и
+отвечают 304 на If-None-Match / If-Modified-Since.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import signal
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+
+from aiohttp import web
+
+from database import queries
+from database.db import open_pool, close_pool
+from utils import metrics
+from utils.leaderboard import SCOPES, period_start
+
+logger = logging.getLogger("PlayPal")
+
+# /metrics и профили участников не должны быть публичными по умолчанию;
+# слушать все интерфейсы (0.0.0.0) — только явно, например за reverse proxy
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", "10"))  # сек
+API_CACHE_SIZE = int(os.getenv("API_CACHE_SIZE", "10000"))  # ответов в памяти
+API_PAGE_LIMIT = int(os.getenv("API_PAGE_LIMIT", "50"))  # размер страницы по умолчанию
+API_PAGE_LIMIT_MAX = int(os.getenv("API_PAGE_LIMIT_MAX", "200"))
+
+API_CACHE = metrics.counter("playpal_api_cache", "Ответы API: из кэша, из базы, 304", ("result",))
+
+
 def example_api():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+# --------------------------------------
+# HTTP: /metrics для Prometheus и /health
+# --------------------------------------
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=metrics.REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    return web.json_response(example_api())
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/health", health_handler)
+    return app
+
+
+async def start_http_server(host: str, port: int) -> web.AppRunner:
+    """Поднимает HTTP-сервер в том же event loop, что и бот. Остановка — await runner.cleanup()."""
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"HTTP-метрики доступны на http://{host}:{port}/metrics")
+    return runner
+
+
+# --------------------------------------
+# Кэш ответов API
+# --------------------------------------
+class _CachedResponse:
+    __slots__ = ("body", "etag", "last_modified", "expires_at")
+
+    def __init__(self, body: bytes, ttl: float):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        # точность Last-Modified — секунда
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.expires_at = time.monotonic() + ttl
+
+
+class ResponseCache:
+    """
+    Готовые тела ответов по пути и параметрам запроса с TTL (LRU до max_size).
+    Одновременные промахи по одному ключу ждут один запрос в базу.
+    Если тело после перечитывания не изменилось, ETag и Last-Modified остаются прежними.
+    """
+
+    def __init__(self, ttl: float = API_CACHE_TTL, max_size: int = API_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()  # ключ -> _CachedResponse
+        self._locks = {}  # ключ -> [asyncio.Lock, сколько корутин его держат или ждут]
+
+    async def get(self, key: str, produce) -> _CachedResponse:
+        """produce() — корутина, возвращающая данные для JSON."""
+        item = self._items.get(key)
+        if item is not None and item.expires_at > time.monotonic():
+            self._items.move_to_end(key)
+            API_CACHE.inc(1, "hit")
+            return item
+        # замок живёт, пока его кто-то ждёт: иначе следующий промах создал бы новый и пошёл в базу параллельно
+        waiting = self._locks.get(key)
+        if waiting is None:
+            waiting = self._locks[key] = [asyncio.Lock(), 0]
+        waiting[1] += 1
+        try:
+            async with waiting[0]:
+                item = self._items.get(key)
+                if item is not None and item.expires_at > time.monotonic():
+                    API_CACHE.inc(1, "hit")
+                    return item
+                API_CACHE.inc(1, "miss")
+                body = json.dumps(await produce(), ensure_ascii=False, separators=(",", ":")).encode()
+                if item is not None and item.body == body:
+                    item.expires_at = time.monotonic() + self.ttl
+                else:
+                    item = _CachedResponse(body, self.ttl)
+                self._items[key] = item
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+                return item
+        finally:
+            waiting[1] -= 1
+            if not waiting[1]:
+                del self._locks[key]
+
+
+api_cache = ResponseCache()
+
+
+def _not_modified(request: web.Request, item: _CachedResponse) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return item.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and item.last_modified <= if_modified_since
+
+
+async def _cached_json(request: web.Request, produce) -> web.Response:
+    item = await api_cache.get(request.path_qs, produce)
+    headers = {
+        "ETag": item.etag,
+        "Last-Modified": item.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        "Cache-Control": f"public, max-age={int(API_CACHE_TTL)}",
+    }
+    if _not_modified(request, item):
+        API_CACHE.inc(1, "not_modified")
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=item.body, content_type="application/json", headers=headers)
+
+
+# --------------------------------------
+# Разбор параметров
+# --------------------------------------
+def _int_param(request: web.Request, name: str) -> int:
+    try:
+        return int(request.match_info[name])
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} должен быть числом")
+
+
+def _limit(request: web.Request) -> int:
+    try:
+        limit = int(request.query.get("limit", API_PAGE_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit должен быть числом")
+    return max(1, min(limit, API_PAGE_LIMIT_MAX))
+
+
+def _encode_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(request: web.Request):
+    cursor = request.query.get("cursor")
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise web.HTTPBadRequest(text="Неверный cursor")
+
+
+# --------------------------------------
+# API: рейтинги, профили, история
+# --------------------------------------
+async def leaderboard_handler(request: web.Request) -> web.Response:
+    server_id = _int_param(request, "server_id")
+    scope = request.query.get("scope", "points")
+    if scope not in SCOPES:
+        raise web.HTTPBadRequest(text=f"scope: одно из {', '.join(SCOPES)}")
+    limit = _limit(request)
+    after = _decode_cursor(request)
+    if after is not None and not (
+        isinstance(after, list) and len(after) == 2 and all(isinstance(v, (int, float)) for v in after)
+    ):
+        raise web.HTTPBadRequest(text="Неверный cursor")
+
+    async def produce():
+        start = period_start(scope, await queries.fetch_server_day(server_id) or date.today())
+        rows = await queries.fetch_leaderboard_page(server_id, scope, start, after, limit)
+        return {
+            "server_id": str(server_id),
+            "scope": scope,
+            "period_start": start.isoformat() if start else None,
+            "items": [
+                {"user_id": str(user_id), "streak": streak, "points": round(points, 2)}
+                for user_id, streak, points, _ in rows
+            ],
+            "next_cursor": _encode_cursor([rows[-1][3], rows[-1][0]]) if len(rows) == limit else None,
+        }
+
+    return await _cached_json(request, produce)
+
+
+async def user_handler(request: web.Request) -> web.Response:
+    server_id = _int_param(request, "server_id")
+    user_id = _int_param(request, "user_id")
+
+    async def produce():
+        row = await queries.fetch_user_stats(user_id, server_id)
+        if row is None:
+            raise web.HTTPNotFound(text="Пользователь не найден")
+        points, level, streak, xp, messages, voice_minutes, last_activity = row
+        return {
+            "server_id": str(server_id),
+            "user_id": str(user_id),
+            "points": round(points, 2),
+            "level": level,
+            "streak": streak,
+            "xp": round(xp, 2),
+            "messages": messages,
+            "voice_minutes": voice_minutes,
+            "last_activity_date": last_activity.isoformat() if last_activity else None,
+        }
+
+    return await _cached_json(request, produce)
+
+
+async def activity_handler(request: web.Request) -> web.Response:
+    server_id = _int_param(request, "server_id")
+    user_id = _int_param(request, "user_id")
+    limit = _limit(request)
+    cursor = _decode_cursor(request)
+    try:
+        before = date.fromisoformat(cursor) if cursor is not None else None
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="Неверный cursor")
+
+    async def produce():
+        rows = await queries.fetch_activity_history(user_id, server_id, before, limit)
+        return {
+            "server_id": str(server_id),
+            "user_id": str(user_id),
+            "items": [
+                {"date": day.isoformat(), "messages": messages, "voice_minutes": voice_minutes,
+                 "points": round(points, 2), "xp": round(xp, 2)}
+                for day, messages, voice_minutes, points, xp in rows
+            ],
+            "next_cursor": _encode_cursor(rows[-1][0].isoformat()) if len(rows) == limit else None,
+        }
+
+    return await _cached_json(request, produce)
+
+
+def create_api_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/health", health_handler)
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/api/servers/{server_id}/leaderboard", leaderboard_handler)
+    app.router.add_get("/api/servers/{server_id}/users/{user_id}", user_handler)
+    app.router.add_get("/api/servers/{server_id}/users/{user_id}/activity", activity_handler)
+    return app
+
+
+async def run_api(host: str = API_HOST, port: int = API_PORT):
+    await open_pool()
+    runner = web.AppRunner(create_api_app(), access_log=None)
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"API доступно на http://{host}:{port}/api")
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except NotImplementedError:  # Windows
+                pass
+        await stopping.wait()
+    finally:
+        await runner.cleanup()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | api | %(levelname)s | %(message)s")
+    asyncio.run(run_api())
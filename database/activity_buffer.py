@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import socket
+
+from database import queries
+from utils import metrics
+from utils.journal import CAN_LOCK, Journal
+
+logger = logging.getLogger("PlayPal")
+
+# Как часто применять журнал к базе, сек. 0 = сразу после каждого события (write-through)
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+# write-through: как часто повторять применение, если база была недоступна, сек
+ACTIVITY_RETRY_INTERVAL = float(os.getenv("ACTIVITY_RETRY_INTERVAL", "5"))
+# Применять раньше, если накопилось столько событий
+ACTIVITY_FLUSH_MAX_EVENTS = int(os.getenv("ACTIVITY_FLUSH_MAX_EVENTS", "500"))
+# Сколько записей журнала применять одной транзакцией (догон после недоступности базы)
+ACTIVITY_REPLAY_BATCH = int(os.getenv("ACTIVITY_REPLAY_BATCH", "50000"))
+# Каталог журналов; у каждого процесса свой подкаталог ACTIVITY_JOURNAL_ID.
+# Подкаталоги, которые не держит ни один живой процесс (хост переименован, шарды
+# переразбиты), применяются и удаляются процессом, работающим с тем же каталогом
+ACTIVITY_JOURNAL_DIR = os.getenv("ACTIVITY_JOURNAL_DIR", "journal")
+# Имя журнала в journal_offsets: по умолчанию хост + шарды процесса
+ACTIVITY_JOURNAL_ID = os.getenv("ACTIVITY_JOURNAL_ID") or (
+    f"{socket.gethostname()}-{os.getenv('SHARD_IDS') or 'all'}".replace(",", "_")
+)
+
+
+class ActivityBuffer:
+    """
+    Начисления через локальный журнал (utils/journal.py).
+    add() только дописывает событие в журнал — база для этого не нужна, поэтому при её
+    недоступности события продолжают приниматься и копятся на диске.
+    flush() читает журнал с позиции из journal_offsets, суммирует события по
+    (user_id, server_id, date) и применяет их одним вызовом credit_activity в той же
+    транзакции, что и сдвиг позиции: после падения ничего не теряется и не начисляется дважды.
+    Журналы с другим id из того же каталога, брошенные прошлыми запусками, применяет adopt_orphans().
+    """
+
+    def __init__(self, daily_max_points: float, currency_ratio: float,
+                 flush_interval: float = ACTIVITY_FLUSH_INTERVAL,
+                 max_events: int = ACTIVITY_FLUSH_MAX_EVENTS,
+                 replay_batch: int = ACTIVITY_REPLAY_BATCH,
+                 journal_dir: str = ACTIVITY_JOURNAL_DIR,
+                 journal_id: str = ACTIVITY_JOURNAL_ID):
+        self.daily_max_points = daily_max_points
+        self.currency_ratio = currency_ratio
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.replay_batch = replay_batch
+        self.journal_dir = journal_dir
+        self.journal_id = journal_id
+        self.journal = Journal(os.path.join(journal_dir, journal_id))
+        self._position = (0, 0)  # до этой позиции журнал уже в базе
+        self._events = 0
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._listeners = []
+        # статистика
+        self.flushed_events = 0
+        self.flushed_rows = 0
+
+    @property
+    def pending_events(self) -> int:
+        """События этого запуска, ещё не применённые к базе (оставшееся с прошлого запуска не считается)."""
+        return self._events
+
+    def add_listener(self, callback):
+        """callback(credited) вызывается после каждого успешного сброса с результатом credit_activity."""
+        self._listeners.append(callback)
+
+    async def start(self):
+        self._position = await queries.fetch_journal_position(self.journal_id)
+        # новый сегмент всегда после применённой позиции, даже если каталог журнала очистили
+        self.journal.open(min_segment=self._position[0] + 1)
+        self.journal.start()
+        # в write-through фоновая задача только повторяет неудавшиеся сбросы и подбирает брошенные журналы
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="activity-buffer")
+        # то, что осталось в журнале с прошлого запуска
+        self._wake.set()
+
+    async def stop(self):
+        """Останавливает фоновый сброс и применяет весь журнал; если база недоступна, он дождётся следующего запуска."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        finally:
+            await self.journal.close()
+            self.journal.release(self._position)
+            self.journal.unlock()
+
+    async def add(self, user_id: int, server_id: int, day: str, msg_inc: int = 0, voice_minutes_inc: int = 0,
+                  activity_points: float = 0.0, xp: float = 0.0):
+        self.journal.append((user_id, server_id, day, msg_inc, voice_minutes_inc, activity_points, xp))
+        self._events += 1
+
+        if self.flush_interval <= 0:
+            try:
+                await self.flush()
+            except Exception as e:
+                # событие уже в журнале — его применит фоновая задача, когда база ответит
+                logger.warning(f"Журнал активности не применён, повторим через {ACTIVITY_RETRY_INTERVAL:g} с: {e}")
+        elif self._events >= self.max_events:
+            self._wake.set()
+
+    async def flush(self):
+        """
+        Применяет журнал до конца пачками по replay_batch записей.
+        Возвращает строки credit_activity (user_id, server_id, currency, balance, streak, xp, ...) всех пачек.
+        """
+        credited = []
+        async with self._lock:
+            await self.journal.sync()
+            async for count, end, batch in self._replay(self.journal, self.journal_id, self._position):
+                credited.extend(batch)
+                self._events = max(0, self._events - count)
+                self._position = end
+        return credited
+
+    async def adopt_orphans(self) -> int:
+        """
+        Применяет и удаляет журналы из journal_dir, которые не открыты ни одним живым процессом:
+        каталоги прошлых ACTIVITY_JOURNAL_ID после переименования хоста или смены шардов.
+        Возвращает число применённых записей.
+        """
+        if not CAN_LOCK:
+            return 0
+        applied = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            path = os.path.join(self.journal_dir, name)
+            if name == self.journal_id or not os.path.isdir(path):
+                continue
+            orphan = Journal(path)
+            if not orphan.lock():
+                continue
+            try:
+                position = await queries.fetch_journal_position(name)
+                async for count, end, _ in self._replay(orphan, name, position):
+                    applied += count
+                    position = end
+                orphan.release(position)
+                if orphan.remove_if_empty():
+                    logger.info(f"Брошенный журнал {name} применён и удалён")
+            finally:
+                orphan.unlock()
+        return applied
+
+    async def _replay(self, journal: Journal, journal_id: str, position: tuple[int, int]):
+        """
+        Применяет journal с позиции position пачками; для каждой применённой пачки отдаёт
+        (число записей, новая позиция, строки credit_activity).
+        """
+        while True:
+            records, end = await journal.read(position, self.replay_batch)
+            if end == position:
+                return
+            batch = await self._apply(journal_id, position, records, end)
+            if batch is None:
+                # позицию сдвинул другой процесс с тем же журналом
+                logger.warning(f"Позиция журнала {journal_id} изменилась в базе, перечитываем")
+                position = await queries.fetch_journal_position(journal_id)
+                yield 0, position, []
+                continue
+            self.flushed_events += len(records)
+            position = end
+            journal.release(end)
+            # каждая пачка уже в базе — слушатели узнают о ней, даже если следующая не применится
+            self._notify(batch)
+            yield len(records), end, batch
+            if len(records) < self.replay_batch:
+                return
+
+    def _notify(self, credited):
+        for callback in self._listeners:
+            try:
+                callback(credited)
+            except Exception:
+                logger.exception("Ошибка в обработчике сброса буфера активности")
+
+    async def _apply(self, journal_id: str, start, records, end):
+        totals = {}  # (user_id, server_id, date) -> [messages, voice_minutes, points, xp]
+        for user_id, server_id, day, *values in records:
+            entry = totals.get((user_id, server_id, day))
+            if entry is None:
+                totals[(user_id, server_id, day)] = values
+            else:
+                for i, value in enumerate(values):
+                    entry[i] += value
+        rows = [(user_id, server_id, day, *values) for (user_id, server_id, day), values in totals.items()]
+        credited = await queries.credit_journal_batch(
+            journal_id, start, end, rows, self.daily_max_points, self.currency_ratio,
+        )
+        if credited is not None:
+            self.flushed_rows += len(rows)
+        return credited
+
+    async def _run(self):
+        interval = self.flush_interval if self.flush_interval > 0 else ACTIVITY_RETRY_INTERVAL
+        orphans_done = False
+        while True:
+            # не wait_for: в 3.11 он теряет отмену, если событие сработало в тот же момент, и stop() зависает
+            waiter = asyncio.ensure_future(self._wake.wait())
+            try:
+                await asyncio.wait((waiter,), timeout=interval)
+            finally:
+                waiter.cancel()
+            self._wake.clear()
+            try:
+                with metrics.track("task", "activity_flush"):
+                    await self.flush()
+            except Exception:
+                logger.exception("Не удалось применить журнал активности, повторим позже")
+            if not orphans_done:
+                try:
+                    with metrics.track("task", "activity_adopt_orphans"):
+                        await self.adopt_orphans()
+                    orphans_done = True
+                except Exception:
+                    logger.exception("Не удалось применить брошенные журналы активности, повторим позже")
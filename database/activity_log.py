@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import date, datetime, timedelta
+
+from database.db import connection
+from utils import metrics
+
+logger = logging.getLogger("PlayPal")
+
+# Сколько дней хранить activity_logs; старые партиции удаляются целиком. 0 = хранить всё
+ACTIVITY_LOG_RETENTION_DAYS = int(os.getenv("ACTIVITY_LOG_RETENTION_DAYS", "30"))
+# На сколько дней вперёд заранее создавать партиции
+ACTIVITY_LOG_PREMAKE_DAYS = int(os.getenv("ACTIVITY_LOG_PREMAKE_DAYS", "3"))
+# Максимальная длина context; 0 = context не сохраняется
+ACTIVITY_LOG_CONTEXT_MAX = int(os.getenv("ACTIVITY_LOG_CONTEXT_MAX", "200"))
+# Доля событий, которая попадает в лог (1.0 = все)
+ACTIVITY_LOG_SAMPLE_RATE = float(os.getenv("ACTIVITY_LOG_SAMPLE_RATE", "1.0"))
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "1000"))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "2"))
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "100000"))
+ACTIVITY_LOG_MAINTENANCE_INTERVAL = float(os.getenv("ACTIVITY_LOG_MAINTENANCE_INTERVAL", "3600"))
+
+# Ключ advisory lock, чтобы обслуживание партиций не запускали несколько процессов сразу
+_MAINTENANCE_LOCK_KEY = 0x706C_6C6F67  # "pllog"
+
+
+def _partition_name(day: date) -> str:
+    return f"activity_logs_p{day:%Y%m%d}"
+
+
+# --------------------------------------
+# Обслуживание партиций
+# --------------------------------------
+async def _step(conn, what: str, step, *args) -> bool:
+    """
+    Выполняет step(cur, *args) отдельной транзакцией.
+    Ошибка откатывает только этот шаг и пишется в лог — остальные шаги обслуживания выполняются.
+    """
+    try:
+        await step(conn.cursor(), *args)
+        await conn.commit()
+        return True
+    except Exception:
+        await conn.rollback()
+        logger.exception(f"Обслуживание activity_logs: не удалось {what}")
+        return False
+
+
+async def _create_partition(cur, day: date):
+    name = _partition_name(day)
+    await cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    if (await cur.fetchone())[0]:
+        return
+    # CREATE TABLE ... PARTITION OF падает, если DEFAULT-партиция уже содержит строки этого дня,
+    # поэтому таблица создаётся отдельно, строки дня переносятся в неё и только потом она подключается
+    start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+    await cur.execute(f"CREATE TABLE {name} (LIKE activity_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    await cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM activity_logs_default
+            WHERE created_at >= %s AND created_at < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    if cur.rowcount:
+        logger.info(f"Перенесено строк из activity_logs_default в {name}: {cur.rowcount}")
+    await cur.execute(f"ALTER TABLE activity_logs ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+async def _migrate_legacy(cur, first_day: date | None):
+    await cur.execute("""
+        INSERT INTO activity_logs(user_id, server_id, type, context, value, created_at)
+        SELECT user_id, server_id, type, context, value, created_at
+        FROM activity_logs_legacy
+        WHERE %s::date IS NULL OR created_at >= %s::date
+    """, (first_day, first_day))
+    logger.info(f"Перенесено строк из activity_logs_legacy: {cur.rowcount}")
+    await cur.execute("DROP TABLE activity_logs_legacy")
+
+
+async def _drop_expired(cur, cutoff_day: date):
+    await cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'activity_logs'::regclass
+          AND c.relname ~ '^activity_logs_p[0-9]{8}$'
+          AND c.relname < %s
+    """, (_partition_name(cutoff_day),))
+    for (name,) in await cur.fetchall():
+        await cur.execute(f"DROP TABLE {name}")
+        logger.info(f"Удалена партиция {name}")
+    await cur.execute("DELETE FROM activity_logs_default WHERE created_at < %s", (cutoff_day,))
+
+
+async def maintain_partitions(today: date | None = None):
+    """
+    Создаёт дневные партиции activity_logs на ACTIVITY_LOG_PREMAKE_DAYS вперёд (и на дни,
+    строки которых успели попасть в DEFAULT-партицию), удаляет партиции старше
+    ACTIVITY_LOG_RETENTION_DAYS и переносит данные из старой непартиционированной таблицы.
+    Каждый шаг — своя транзакция: сбой одного не откатывает остальные.
+    """
+    today = today or date.today()
+    cutoff_day = today - timedelta(days=ACTIVITY_LOG_RETENTION_DAYS) if ACTIVITY_LOG_RETENTION_DAYS > 0 else None
+    async with connection() as conn:
+        cur = conn.cursor()
+        # сессионная блокировка переживает commit между шагами
+        await cur.execute("SELECT pg_try_advisory_lock(%s)", (_MAINTENANCE_LOCK_KEY,))
+        locked = (await cur.fetchone())[0]
+        await conn.commit()
+        if not locked:
+            return
+        try:
+            await cur.execute("""
+                SELECT to_regclass('activity_logs_legacy') IS NOT NULL,
+                       (SELECT min(created_at)::date FROM activity_logs_default)
+            """)
+            has_legacy, default_first = await cur.fetchone()
+            await conn.commit()
+
+            first_day = today
+            if has_legacy and cutoff_day is not None:
+                first_day = cutoff_day
+            if default_first is not None:
+                first_day = min(first_day, max(default_first, cutoff_day or default_first))
+
+            day = first_day
+            while day <= today + timedelta(days=ACTIVITY_LOG_PREMAKE_DAYS):
+                await _step(conn, f"создать партицию {_partition_name(day)}", _create_partition, day)
+                day += timedelta(days=1)
+
+            if has_legacy:
+                await _step(conn, "перенести activity_logs_legacy", _migrate_legacy, cutoff_day)
+
+            if cutoff_day is not None:
+                await _step(conn, "удалить старые партиции", _drop_expired, cutoff_day)
+        finally:
+            await cur.execute("SELECT pg_advisory_unlock(%s)", (_MAINTENANCE_LOCK_KEY,))
+            await conn.commit()
+
+
+# --------------------------------------
+# Асинхронная запись логов
+# --------------------------------------
+class ActivityLogWriter:
+    """
+    Очередь логов активности с пакетной записью через COPY.
+    submit() не ждёт базу: при переполнении очереди событие отбрасывается и считается в dropped.
+    """
+
+    def __init__(self, batch_size: int = ACTIVITY_LOG_BATCH_SIZE,
+                 flush_interval: float = ACTIVITY_LOG_FLUSH_INTERVAL,
+                 queue_size: int = ACTIVITY_LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task: asyncio.Task | None = None
+        self._maintenance_task: asyncio.Task | None = None
+        # статистика
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, user_id: int, server_id: int, action: str, context: str | None, value: float):
+        if ACTIVITY_LOG_SAMPLE_RATE < 1.0 and random.random() >= ACTIVITY_LOG_SAMPLE_RATE:
+            self.sampled_out += 1
+            return
+        if not ACTIVITY_LOG_CONTEXT_MAX:
+            context = None
+        elif context and len(context) > ACTIVITY_LOG_CONTEXT_MAX:
+            context = context[:ACTIVITY_LOG_CONTEXT_MAX]
+        try:
+            self._queue.put_nowait((user_id, server_id, action, context, value, datetime.now()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._run(), name="activity-log-writer")
+        if self._maintenance_task is None:
+            self._maintenance_task = loop.create_task(self._maintain(), name="activity-log-maintenance")
+
+    async def stop(self):
+        """Останавливает фоновые задачи и дописывает оставшуюся очередь."""
+        for task in (self._task, self._maintenance_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._maintenance_task = None
+        while not self._queue.empty():
+            await self._write(self._drain())
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        return rows
+
+    async def _write(self, rows):
+        if not rows:
+            return
+        async with connection() as conn:
+            cur = conn.cursor()
+            async with cur.copy(
+                "COPY activity_logs (user_id, server_id, type, context, value, created_at) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    await copy.write_row(row)
+        self.written += len(rows)
+
+    async def _run(self):
+        while True:
+            # ждём первое событие, потом добираем пачку
+            first = await self._queue.get()
+            await asyncio.sleep(self.flush_interval if self._queue.qsize() < self.batch_size else 0)
+            rows = [first] + self._drain()
+            try:
+                with metrics.track("task", "activity_log_write"):
+                    await self._write(rows)
+            except Exception:
+                self.dropped += len(rows)
+                logger.exception(f"Не удалось записать {len(rows)} логов активности")
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(ACTIVITY_LOG_MAINTENANCE_INTERVAL)
+            try:
+                with metrics.track("task", "maintain_partitions"):
+                    await maintain_partitions()
+            except Exception:
+                logger.exception("Ошибка обслуживания партиций activity_logs")
+
+
+activity_log_writer = ActivityLogWriter()
@@ -0,0 +1,57 @@
+import logging
+import os
+from datetime import date, timedelta
+
+from database.db import connection
+
+logger = logging.getLogger("PlayPal")
+
+# Сколько последних недель и месяцев хранить в user_activity_periods (включая текущий); 0 = хранить всё
+ACTIVITY_PERIODS_KEEP_WEEKS = int(os.getenv("ACTIVITY_PERIODS_KEEP_WEEKS", "12"))
+ACTIVITY_PERIODS_KEEP_MONTHS = int(os.getenv("ACTIVITY_PERIODS_KEEP_MONTHS", "12"))
+ACTIVITY_PERIODS_COMPACT_INTERVAL = float(os.getenv("ACTIVITY_PERIODS_COMPACT_INTERVAL", "3600"))  # сек
+
+# Ключ advisory lock, чтобы чистку не запускали несколько процессов сразу
+_COMPACT_LOCK_KEY = 0x706C_706572  # "plper"
+
+
+def _months_back(day: date, months: int) -> date:
+    """Первое число месяца, отстоящего от day на months назад."""
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+# --------------------------------------
+# Чистка недельных и месячных итогов
+# --------------------------------------
+async def compact_periods(today: date | None = None) -> int:
+    """
+    Удаляет из user_activity_periods периоды старше ACTIVITY_PERIODS_KEEP_WEEKS недель
+    и ACTIVITY_PERIODS_KEEP_MONTHS месяцев (по индексу (period, period_start)).
+    Итоги пишутся в credit_activity вместе с дневными строками, поэтому пересчитывать их не нужно —
+    таблица только не должна расти вместе с историей. Возвращает число удалённых строк.
+    """
+    today = today or date.today()
+    deleted = 0
+    async with connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (_COMPACT_LOCK_KEY,))
+        if not (await cur.fetchone())[0]:
+            return 0
+
+        if ACTIVITY_PERIODS_KEEP_WEEKS > 0:
+            week_cutoff = today - timedelta(days=today.weekday(), weeks=ACTIVITY_PERIODS_KEEP_WEEKS - 1)
+            await cur.execute("""
+                DELETE FROM user_activity_periods
+                WHERE period = 'week' AND period_start < %s
+            """, (week_cutoff,))
+            deleted += cur.rowcount
+        if ACTIVITY_PERIODS_KEEP_MONTHS > 0:
+            await cur.execute("""
+                DELETE FROM user_activity_periods
+                WHERE period = 'month' AND period_start < %s
+            """, (_months_back(today, ACTIVITY_PERIODS_KEEP_MONTHS - 1),))
+            deleted += cur.rowcount
+    if deleted:
+        logger.info(f"Удалено строк из user_activity_periods: {deleted}")
+    return deleted
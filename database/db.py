@@ -1,136 +1,232 @@
+import logging
 import os
-import psycopg
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from psycopg import AsyncConnection, AsyncCursor
+from psycopg_pool import AsyncConnectionPool
 from dotenv import load_dotenv
 
+from utils import metrics
+
 load_dotenv()
 
+logger = logging.getLogger("PlayPal")
+
+# Настройки пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # сколько ждать свободное соединение, сек
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")  # для локальной базы (бенчмарки) — "disable"
+# Ни один запрос не должен держать обработчик дольше этого времени, мс
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+_pool: AsyncConnectionPool | None = None
+
+
+# --------------------------------------
+# Учёт запросов
+# --------------------------------------
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+
+    def reset(self):
+        self.count = 0
+        self.total_seconds = 0.0
+
+
+query_stats = QueryStats()
+
+
+def _record(seconds: float):
+    query_stats.record(seconds)
+    # в метриках время запроса привязывается к текущему обработчику
+    metrics.observe_query(seconds)
+
+
+class InstrumentedCursor(AsyncCursor):
+    """Курсор пула: каждый execute/executemany/COPY попадает в query_stats и метрики."""
+
+    async def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            _record(time.perf_counter() - started)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            _record(time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def copy(self, statement, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+        finally:
+            _record(time.perf_counter() - started)
+
+
 def _get_dsn() -> str:
     dsn = os.getenv("DATABASE_URL")
     if not dsn or not dsn.strip():
         raise RuntimeError("DATABASE_URL не задан")
     return dsn
 
-def init_db():
-    conn = psycopg.connect(_get_dsn(), autocommit=False, sslmode="require")
-    try:
-        with conn.cursor() as cur:
-            # Таблица серверов
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS servers (
-                    server_id BIGINT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-
-            # Пользователи
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT,
-                    server_id BIGINT REFERENCES servers(server_id) ON DELETE CASCADE,
-                    join_date TIMESTAMP DEFAULT NOW(),
-                    warns INTEGER DEFAULT 0,
-                    level INTEGER DEFAULT 1,
-                    xp REAL DEFAULT 0,
-                    streak INTEGER DEFAULT 0,
-                    points REAL DEFAULT 0,
-                    PRIMARY KEY(user_id, server_id)
-                )
-            """)
-
-            # Ежедневная активность
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_daily (
-                    user_id BIGINT,
-                    server_id BIGINT,
-                    date DATE NOT NULL,
-                    messages INTEGER DEFAULT 0,
-                    voice_minutes INTEGER DEFAULT 0,
-                    points REAL DEFAULT 0,
-                    PRIMARY KEY(user_id, server_id, date),
-                    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Общая активность (итоги)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity_totals (
-                    user_id BIGINT,
-                    server_id BIGINT,
-                    messages INTEGER DEFAULT 0,
-                    voice_minutes INTEGER DEFAULT 0,
-                    points REAL DEFAULT 0,
-                    streak INTEGER DEFAULT 0,
-                    last_activity_date DATE,
-                    PRIMARY KEY(user_id, server_id),
-                    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Логи активности
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS activity_logs (
-                    log_id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
-                    server_id BIGINT,
-                    type TEXT,
-                    context TEXT,
-                    value REAL,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Варны/муты/баны
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_warnings (
-                    warning_id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
-                    server_id BIGINT,
-                    reason TEXT,
-                    moderator BIGINT,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Ачивки
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS achievements (
-                    achievement_id SERIAL PRIMARY KEY,
-                    name TEXT,
-                    description TEXT,
-                    xp_reward REAL DEFAULT 0
-                )
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_achievements (
-                    user_id BIGINT,
-                    server_id BIGINT,
-                    achievement_id INT REFERENCES achievements(achievement_id) ON DELETE CASCADE,
-                    date_unlocked TIMESTAMP DEFAULT NOW(),
-                    PRIMARY KEY(user_id, server_id, achievement_id),
-                    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
-                )
-            """)
-
-            # Роли сервера
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS server_roles (
-                    server_id BIGINT REFERENCES servers(server_id) ON DELETE CASCADE,
-                    role_id BIGINT,
-                    required_points REAL DEFAULT 0,
-                    required_level INTEGER DEFAULT 0,
-                    PRIMARY KEY(server_id, role_id)
-                )
-            """)
-
-            conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
-
-def get_connection():
-    return psycopg.connect(_get_dsn(), autocommit=False, sslmode="require")
\ No newline at end of file
+# --------------------------------------
+# Пул соединений
+# --------------------------------------
+async def open_pool() -> AsyncConnectionPool:
+    global _pool
+    if _pool is not None:
+        return _pool
+    _pool = AsyncConnectionPool(
+        conninfo=_get_dsn(),
+        kwargs={
+            "sslmode": DB_SSLMODE,
+            "autocommit": False,
+            "cursor_factory": InstrumentedCursor,
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+        },
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check=AsyncConnectionPool.check_connection,
+        name="playpal",
+        open=False,
+    )
+    await _pool.open(wait=True)
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+@asynccontextmanager
+async def connection():
+    """
+    Соединение из общего пула.
+    При выходе без ошибки транзакция коммитится, при исключении — откатывается.
+    Если свободного соединения нет дольше DB_POOL_TIMEOUT, бросается PoolTimeout.
+    """
+    if _pool is None:
+        raise RuntimeError("Пул соединений не открыт (open_pool)")
+    async with _pool.connection() as conn:
+        yield conn
+
+# --------------------------------------
+# Короткие хелперы для одиночных запросов
+# --------------------------------------
+async def execute(query: str, params=None):
+    async with connection() as conn:
+        await conn.execute(query, params)
+
+async def executemany(query: str, params_seq):
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(query, params_seq)
+
+async def fetchone(query: str, params=None):
+    async with connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchone()
+
+async def fetchall(query: str, params=None):
+    async with connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
+
+async def connect_listener() -> AsyncConnection:
+    """Отдельное autocommit-соединение вне пула для LISTEN: оно держится всё время работы."""
+    return await AsyncConnection.connect(_get_dsn(), autocommit=True, sslmode=DB_SSLMODE)
+
+def pool_stats() -> dict:
+    """Метрики пула: размер, свободные соединения, ожидающие запросы, время ожидания и т.д."""
+    if _pool is None:
+        return {}
+    return _pool.get_stats()
+
+# --------------------------------------
+# Схема: версионированные миграции (database/migrations/NNNN_name.sql)
+# --------------------------------------
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# Ключ advisory lock: миграции применяет только одна реплика за раз
+_MIGRATION_LOCK_KEY = 0x706C_6D6967  # "plmig"
+
+
+def load_migrations():
+    """Список (version, name, sql), отсортированный по версии."""
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        version, _, name = path.stem.partition("_")
+        migrations.append((int(version), name, path.read_text(encoding="utf-8")))
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("Повторяющиеся номера миграций")
+    return migrations
+
+
+async def _current_version(cur) -> int:
+    await cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not (await cur.fetchone())[0]:
+        return 0
+    await cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return (await cur.fetchone())[0]
+
+
+async def migrate(dry_run: bool = False):
+    """
+    Применяет недостающие миграции по порядку в одной транзакции.
+    Если схема актуальна, никакого DDL не выполняется.
+    Возвращает список (version, name) применённых (или, при dry_run, ожидающих) миграций.
+    """
+    migrations = load_migrations()
+    latest = migrations[-1][0] if migrations else 0
+    async with connection() as conn:
+        cur = conn.cursor()
+        if await _current_version(cur) >= latest:
+            return []
+
+        # DDL и ожидание чужой миграции не должны упираться в DB_STATEMENT_TIMEOUT_MS
+        await cur.execute("SET LOCAL statement_timeout = 0")
+        await cur.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_KEY,))
+        await cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        # пока ждали блокировку, другая реплика могла всё применить
+        current = await _current_version(cur)
+        pending = [m for m in migrations if m[0] > current]
+        if dry_run:
+            await conn.rollback()
+            return [(version, name) for version, name, _ in pending]
+
+        for version, name, sql in pending:
+            await cur.execute(sql)
+            await cur.execute("INSERT INTO schema_version(version, name) VALUES (%s, %s)", (version, name))
+            logger.info(f"Применена миграция {version:04d}_{name}")
+        return [(version, name) for version, name, _ in pending]
+
+
+async def init_db():
+    await migrate()
@@ -0,0 +1,144 @@
+"""
+Выгрузка истории сервера в сжатые CSV/JSONL-файлы.
+
+    python -m database.export --server 123 --kind logs --from 2026-01-01 --to 2026-01-31
+    python -m database.export --server 123 --kind daily --format jsonl --out ./export --chunk-mb 100
+
+Строки читаются серверным курсором пачками и дописываются в gzip в отдельном потоке,
+поэтому память не зависит от объёма выгрузки, а event loop не блокируется.
+Файл режется на части, как только сжатый размер доходит до chunk_bytes.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+from contextlib import aclosing
+from datetime import date, timedelta
+
+from database import queries
+from database.db import open_pool, close_pool
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "5000"))  # строк за один FETCH
+EXPORT_FORMATS = ("csv", "jsonl")
+# Сколько выгрузок может идти одновременно из бота (каждая держит соединение из пула)
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "1"))
+# /export: сколько файлов можно приложить и запас до лимита вложения сервера на последнюю пачку части
+EXPORT_MAX_FILES = int(os.getenv("EXPORT_MAX_FILES", "20"))
+EXPORT_PART_MARGIN = int(os.getenv("EXPORT_PART_MARGIN", str(1024 * 1024)))
+
+
+class ExportTooLarge(Exception):
+    """Выгрузка не помещается в max_parts частей."""
+
+
+class _ChunkWriter:
+    """Пишет строки в name.partNNN.<fmt>.gz, начиная новую часть после chunk_bytes сжатых байт. Вызывается из потока."""
+
+    def __init__(self, directory: str, name: str, fmt: str, columns, chunk_bytes: int, max_parts: int | None):
+        self.directory = directory
+        self.name = name
+        self.fmt = fmt
+        self.columns = columns
+        self.chunk_bytes = chunk_bytes
+        self.max_parts = max_parts
+        self.paths = []
+        self.rows = 0
+        self._raw = None
+        self._gzip = None
+        self._text = None
+
+    def _open(self):
+        if self.max_parts is not None and len(self.paths) >= self.max_parts:
+            raise ExportTooLarge(f"Выгрузка больше {self.max_parts} частей")
+        path = os.path.join(self.directory, f"{self.name}.part{len(self.paths) + 1:03d}.{self.fmt}.gz")
+        self.paths.append(path)
+        self._raw = open(path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8", newline="")
+        if self.fmt == "csv":
+            # заголовок в каждой части, чтобы любую можно было открыть отдельно
+            csv.writer(self._text).writerow(self.columns)
+
+    def _close_part(self):
+        if self._text is not None:
+            self._text.close()
+            self._raw.close()
+            self._raw = self._gzip = self._text = None
+
+    def write(self, rows):
+        if self._text is None:
+            self._open()
+        if self.fmt == "csv":
+            csv.writer(self._text).writerows(rows)
+        else:
+            self._text.writelines(
+                json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str) + "\n" for row in rows
+            )
+        self.rows += len(rows)
+        # сжатый размер виден только после сброса буферов текста и gzip
+        self._text.flush()
+        if self._raw.tell() >= self.chunk_bytes:
+            self._close_part()
+
+    def close(self):
+        if not self.paths:
+            # пустая выгрузка — одна часть с заголовком
+            self._open()
+        self._close_part()
+
+
+async def export_activity(server_id: int, kind: str, start: date, end: date, fmt: str, directory: str,
+                          chunk_bytes: int, max_parts: int | None = None) -> tuple[list[str], int]:
+    """
+    Выгружает EXPORT_SOURCES[kind] сервера за дни [start, end] (включительно) в каталог directory.
+    Возвращает (пути частей, число строк). Если частей больше max_parts — ExportTooLarge.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    columns, _ = queries.EXPORT_SOURCES[kind]
+    writer = _ChunkWriter(directory, f"{kind}_{server_id}_{start:%Y%m%d}_{end:%Y%m%d}", fmt, columns,
+                          chunk_bytes, max_parts)
+    try:
+        # aclosing: при ошибке курсор закрывается и соединение сразу возвращается в пул
+        async with aclosing(queries.stream_activity(kind, server_id, start, end + timedelta(days=1), EXPORT_FETCH_SIZE)) as batches:
+            async for rows in batches:
+                # сжатие и запись на диск — в потоке, пока loop обслуживает остальных
+                await asyncio.to_thread(writer.write, rows)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return writer.paths, writer.rows
+
+
+async def run(args):
+    os.makedirs(args.out, exist_ok=True)
+    await open_pool()
+    try:
+        paths, rows = await export_activity(
+            args.server, args.kind, args.start, args.end, args.format, args.out, args.chunk_mb * 1024 * 1024,
+        )
+    finally:
+        await close_pool()
+    print(f"Выгружено строк: {rows}")
+    for path in paths:
+        print(f"  {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка истории активности сервера PlayPal")
+    parser.add_argument("--server", type=int, required=True, help="ID сервера")
+    parser.add_argument("--kind", choices=sorted(queries.EXPORT_SOURCES), default="daily",
+                        help="daily — дневные итоги, logs — лог событий")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, required=True, help="первый день, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, default=date.today(), help="последний день включительно")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--out", default="export", help="каталог для файлов")
+    parser.add_argument("--chunk-mb", type=int, default=100, help="размер одной сжатой части, МБ")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Ручной запуск миграций схемы.
+
+    python -m database.migrate            # применить недостающие
+    python -m database.migrate --dry-run  # только показать, что будет применено
+"""
+import argparse
+import asyncio
+
+from database.db import open_pool, close_pool, migrate
+
+
+async def run(dry_run: bool):
+    await open_pool()
+    try:
+        migrations = await migrate(dry_run=dry_run)
+    finally:
+        await close_pool()
+    if not migrations:
+        print("Схема актуальна")
+        return
+    title = "Будут применены" if dry_run else "Применены"
+    print(f"{title}:")
+    for version, name in migrations:
+        print(f"  {version:04d}_{name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы PlayPal")
+    parser.add_argument("--dry-run", action="store_true", help="ничего не менять, только показать план")
+    args = parser.parse_args()
+    asyncio.run(run(args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
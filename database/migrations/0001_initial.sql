@@ -0,0 +1,219 @@
+-- Базовая схема. Идемпотентна, чтобы её можно было применить и к базе,
+-- созданной ещё старым init_db до появления миграций.
+
+-- Таблица серверов
+CREATE TABLE IF NOT EXISTS servers (
+    server_id BIGINT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Пользователи
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGINT,
+    server_id BIGINT REFERENCES servers(server_id) ON DELETE CASCADE,
+    join_date TIMESTAMP DEFAULT NOW(),
+    warns INTEGER DEFAULT 0,
+    level INTEGER DEFAULT 1,
+    xp REAL DEFAULT 0,
+    streak INTEGER DEFAULT 0,
+    points REAL DEFAULT 0,
+    PRIMARY KEY(user_id, server_id)
+);
+
+-- Ежедневная активность
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    user_id BIGINT,
+    server_id BIGINT,
+    date DATE NOT NULL,
+    messages INTEGER DEFAULT 0,
+    voice_minutes INTEGER DEFAULT 0,
+    points REAL DEFAULT 0,
+    PRIMARY KEY(user_id, server_id, date),
+    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
+);
+
+-- Общая активность (итоги)
+CREATE TABLE IF NOT EXISTS user_activity_totals (
+    user_id BIGINT,
+    server_id BIGINT,
+    messages INTEGER DEFAULT 0,
+    voice_minutes INTEGER DEFAULT 0,
+    points REAL DEFAULT 0,
+    streak INTEGER DEFAULT 0,
+    last_activity_date DATE,
+    PRIMARY KEY(user_id, server_id),
+    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
+);
+
+-- Логи активности: партиционированы по дням (created_at),
+-- партиции создаёт и удаляет database.activity_log.maintain_partitions.
+-- Старая непартиционированная таблица переименовывается и переносится туда же.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'activity_logs' AND relkind = 'r') THEN
+        ALTER TABLE activity_logs RENAME TO activity_logs_legacy;
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS activity_logs (
+    log_id BIGSERIAL,
+    user_id BIGINT,
+    server_id BIGINT,
+    type TEXT,
+    context TEXT,
+    value REAL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY(log_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Страховка на случай, если партиция на нужный день не успела создаться
+CREATE TABLE IF NOT EXISTS activity_logs_default
+PARTITION OF activity_logs DEFAULT;
+
+-- Варны/муты/баны
+CREATE TABLE IF NOT EXISTS user_warnings (
+    warning_id SERIAL PRIMARY KEY,
+    user_id BIGINT,
+    server_id BIGINT,
+    reason TEXT,
+    moderator BIGINT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
+);
+
+-- Ачивки
+CREATE TABLE IF NOT EXISTS achievements (
+    achievement_id SERIAL PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    xp_reward REAL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_achievements (
+    user_id BIGINT,
+    server_id BIGINT,
+    achievement_id INT REFERENCES achievements(achievement_id) ON DELETE CASCADE,
+    date_unlocked TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(user_id, server_id, achievement_id),
+    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
+);
+
+-- Роли сервера
+CREATE TABLE IF NOT EXISTS server_roles (
+    server_id BIGINT REFERENCES servers(server_id) ON DELETE CASCADE,
+    role_id BIGINT,
+    required_points REAL DEFAULT 0,
+    required_level INTEGER DEFAULT 0,
+    PRIMARY KEY(server_id, role_id)
+);
+
+-- Открытые голосовые сессии (чтобы пережить перезапуск бота)
+CREATE TABLE IF NOT EXISTS voice_sessions (
+    user_id BIGINT,
+    server_id BIGINT,
+    channel_id BIGINT,
+    started_at TIMESTAMPTZ NOT NULL,
+    last_credited_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY(user_id, server_id)
+);
+
+-- Индексы под лидерборды
+CREATE INDEX IF NOT EXISTS users_server_points_idx
+ON users(server_id, points DESC);
+
+CREATE INDEX IF NOT EXISTS user_activity_totals_server_streak_idx
+ON user_activity_totals(server_id, streak DESC);
+
+-- Начисление активности одним запросом: totals + daily + валюта в пределах
+-- дневного лимита + стрик. Принимает пачку строк (массивы одинаковой длины),
+-- ключи (user_id, server_id, date) внутри пачки уникальны.
+CREATE OR REPLACE FUNCTION credit_activity(
+    p_user_ids BIGINT[],
+    p_server_ids BIGINT[],
+    p_dates DATE[],
+    p_messages INTEGER[],
+    p_voice_minutes INTEGER[],
+    p_points REAL[],
+    p_xp REAL[],
+    p_daily_max REAL,
+    p_currency_ratio REAL
+)
+RETURNS TABLE(user_id BIGINT, server_id BIGINT, currency REAL, balance REAL, streak INTEGER)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_server_ids, p_dates, p_messages, p_voice_minutes, p_points, p_xp)
+            AS t(user_id, server_id, date, messages, voice_minutes, points, xp)
+    ),
+    -- totals; в EXCLUDED.streak приходит длина серии дней внутри пачки
+    totals AS (
+        INSERT INTO user_activity_totals AS t
+            (user_id, server_id, messages, voice_minutes, points, xp, streak, last_activity_date)
+        SELECT i.user_id, i.server_id, SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp),
+               MAX(i.date) - MIN(i.date) + 1, MAX(i.date)
+        FROM input i
+        GROUP BY i.server_id, i.user_id
+        ORDER BY i.server_id, i.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            messages = t.messages + EXCLUDED.messages,
+            voice_minutes = t.voice_minutes + EXCLUDED.voice_minutes,
+            points = t.points + EXCLUDED.points,
+            xp = t.xp + EXCLUDED.xp,
+            streak = CASE
+                -- первая активность
+                WHEN t.last_activity_date IS NULL THEN EXCLUDED.streak
+                -- этот день уже засчитан
+                WHEN EXCLUDED.last_activity_date <= t.last_activity_date THEN GREATEST(t.streak, 1)
+                -- серия продолжается со вчерашнего дня
+                WHEN EXCLUDED.last_activity_date - EXCLUDED.streak <= t.last_activity_date
+                    THEN t.streak + (EXCLUDED.last_activity_date - t.last_activity_date)
+                -- был пропуск
+                ELSE EXCLUDED.streak
+            END,
+            last_activity_date = GREATEST(t.last_activity_date, EXCLUDED.last_activity_date)
+        RETURNING t.user_id, t.server_id, t.streak
+    ),
+    -- daily; RETURNING отдаёт дневной итог уже с учётом пачки
+    daily AS (
+        INSERT INTO user_activity_daily AS d
+            (user_id, server_id, date, messages, voice_minutes, points, xp)
+        SELECT i.user_id, i.server_id, i.date, i.messages, i.voice_minutes, i.points, i.xp
+        FROM input i
+        ORDER BY i.server_id, i.user_id, i.date
+        ON CONFLICT(user_id, server_id, date) DO UPDATE SET
+            messages = d.messages + EXCLUDED.messages,
+            voice_minutes = d.voice_minutes + EXCLUDED.voice_minutes,
+            points = d.points + EXCLUDED.points,
+            xp = d.xp + EXCLUDED.xp
+        RETURNING d.user_id, d.server_id, d.date, d.points
+    ),
+    -- валюта: не больше, чем осталось до дневного лимита до этой пачки
+    currency AS (
+        SELECT d.user_id, d.server_id,
+               (SUM(GREATEST(0, LEAST(i.points, p_daily_max - (d.points - i.points))))
+                   * p_currency_ratio)::REAL AS amount
+        FROM daily d
+        JOIN input i USING (user_id, server_id, date)
+        GROUP BY d.user_id, d.server_id
+    ),
+    -- пользователь создаётся здесь же, если его ещё нет
+    balance AS (
+        INSERT INTO users AS u (user_id, server_id, join_date, points)
+        SELECT c.user_id, c.server_id, NOW(), c.amount
+        FROM currency c
+        ORDER BY c.server_id, c.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            points = u.points + EXCLUDED.points
+        RETURNING u.user_id, u.server_id, u.points
+    )
+    SELECT b.user_id, b.server_id, c.amount, b.points, tt.streak
+    FROM balance b
+    JOIN currency c USING (user_id, server_id)
+    JOIN totals tt USING (user_id, server_id);
+END;
+$$;
@@ -0,0 +1,3 @@
+-- Код давно пишет xp в totals/daily, а DDL этих колонок не создавал
+ALTER TABLE user_activity_totals ADD COLUMN IF NOT EXISTS xp REAL DEFAULT 0;
+ALTER TABLE user_activity_daily ADD COLUMN IF NOT EXISTS xp REAL DEFAULT 0;
@@ -0,0 +1,13 @@
+-- Индексы под горячие запросы
+
+-- дневная активность сервера за период (окна, роллап, экспорт)
+CREATE INDEX IF NOT EXISTS user_activity_daily_server_date_idx
+ON user_activity_daily(server_id, date);
+
+-- логи сервера за период; создаётся на всех партициях
+CREATE INDEX IF NOT EXISTS activity_logs_server_created_idx
+ON activity_logs(server_id, created_at);
+
+-- голосовые сессии восстанавливаются по server_id
+CREATE INDEX IF NOT EXISTS voice_sessions_server_idx
+ON voice_sessions(server_id);
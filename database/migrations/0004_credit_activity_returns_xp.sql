@@ -0,0 +1,93 @@
+-- credit_activity дополнительно возвращает итоговый xp: кэш профилей обновляется
+-- из результатов начисления без отдельного чтения. Набор колонок результата меняется,
+-- поэтому функция пересоздаётся.
+DROP FUNCTION IF EXISTS credit_activity(BIGINT[], BIGINT[], DATE[], INTEGER[], INTEGER[], REAL[], REAL[], REAL, REAL);
+
+CREATE FUNCTION credit_activity(
+    p_user_ids BIGINT[],
+    p_server_ids BIGINT[],
+    p_dates DATE[],
+    p_messages INTEGER[],
+    p_voice_minutes INTEGER[],
+    p_points REAL[],
+    p_xp REAL[],
+    p_daily_max REAL,
+    p_currency_ratio REAL
+)
+RETURNS TABLE(user_id BIGINT, server_id BIGINT, currency REAL, balance REAL, streak INTEGER, xp REAL)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_server_ids, p_dates, p_messages, p_voice_minutes, p_points, p_xp)
+            AS t(user_id, server_id, date, messages, voice_minutes, points, xp)
+    ),
+    -- totals; в EXCLUDED.streak приходит длина серии дней внутри пачки
+    totals AS (
+        INSERT INTO user_activity_totals AS t
+            (user_id, server_id, messages, voice_minutes, points, xp, streak, last_activity_date)
+        SELECT i.user_id, i.server_id, SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp),
+               MAX(i.date) - MIN(i.date) + 1, MAX(i.date)
+        FROM input i
+        GROUP BY i.server_id, i.user_id
+        ORDER BY i.server_id, i.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            messages = t.messages + EXCLUDED.messages,
+            voice_minutes = t.voice_minutes + EXCLUDED.voice_minutes,
+            points = t.points + EXCLUDED.points,
+            xp = t.xp + EXCLUDED.xp,
+            streak = CASE
+                -- первая активность
+                WHEN t.last_activity_date IS NULL THEN EXCLUDED.streak
+                -- этот день уже засчитан
+                WHEN EXCLUDED.last_activity_date <= t.last_activity_date THEN GREATEST(t.streak, 1)
+                -- серия продолжается со вчерашнего дня
+                WHEN EXCLUDED.last_activity_date - EXCLUDED.streak <= t.last_activity_date
+                    THEN t.streak + (EXCLUDED.last_activity_date - t.last_activity_date)
+                -- был пропуск
+                ELSE EXCLUDED.streak
+            END,
+            last_activity_date = GREATEST(t.last_activity_date, EXCLUDED.last_activity_date)
+        RETURNING t.user_id, t.server_id, t.streak, t.xp
+    ),
+    -- daily; RETURNING отдаёт дневной итог уже с учётом пачки
+    daily AS (
+        INSERT INTO user_activity_daily AS d
+            (user_id, server_id, date, messages, voice_minutes, points, xp)
+        SELECT i.user_id, i.server_id, i.date, i.messages, i.voice_minutes, i.points, i.xp
+        FROM input i
+        ORDER BY i.server_id, i.user_id, i.date
+        ON CONFLICT(user_id, server_id, date) DO UPDATE SET
+            messages = d.messages + EXCLUDED.messages,
+            voice_minutes = d.voice_minutes + EXCLUDED.voice_minutes,
+            points = d.points + EXCLUDED.points,
+            xp = d.xp + EXCLUDED.xp
+        RETURNING d.user_id, d.server_id, d.date, d.points
+    ),
+    -- валюта: не больше, чем осталось до дневного лимита до этой пачки
+    currency AS (
+        SELECT d.user_id, d.server_id,
+               (SUM(GREATEST(0, LEAST(i.points, p_daily_max - (d.points - i.points))))
+                   * p_currency_ratio)::REAL AS amount
+        FROM daily d
+        JOIN input i USING (user_id, server_id, date)
+        GROUP BY d.user_id, d.server_id
+    ),
+    -- пользователь создаётся здесь же, если его ещё нет
+    balance AS (
+        INSERT INTO users AS u (user_id, server_id, join_date, points)
+        SELECT c.user_id, c.server_id, NOW(), c.amount
+        FROM currency c
+        ORDER BY c.server_id, c.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            points = u.points + EXCLUDED.points
+        RETURNING u.user_id, u.server_id, u.points
+    )
+    SELECT b.user_id, b.server_id, c.amount, b.points, tt.streak, tt.xp
+    FROM balance b
+    JOIN currency c USING (user_id, server_id)
+    JOIN totals tt USING (user_id, server_id);
+END;
+$$;
@@ -0,0 +1,118 @@
+-- Правила ачивок: ачивка выдаётся, когда метрика пользователя достигает порога
+ALTER TABLE achievements ADD COLUMN IF NOT EXISTS metric TEXT;
+ALTER TABLE achievements ADD COLUMN IF NOT EXISTS threshold REAL;
+DO $$
+BEGIN
+    ALTER TABLE achievements ADD CONSTRAINT achievements_metric_check
+        CHECK (metric IN ('messages', 'voice_minutes', 'streak', 'points', 'xp'));
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+-- Стартовый набор, только если ачивок ещё нет
+INSERT INTO achievements (name, description, xp_reward, metric, threshold)
+SELECT name, description, xp_reward, metric, threshold
+FROM (VALUES
+    ('Первое слово', 'Написать первое сообщение', 10, 'messages', 1),
+    ('Болтун', 'Написать 1000 сообщений', 100, 'messages', 1000),
+    ('На связи', 'Провести в голосе 60 минут', 20, 'voice_minutes', 60),
+    ('Голос сервера', 'Провести в голосе 1000 минут', 150, 'voice_minutes', 1000),
+    ('Неделя подряд', 'Быть активным 7 дней подряд', 50, 'streak', 7),
+    ('Месяц подряд', 'Быть активным 30 дней подряд', 200, 'streak', 30)
+) AS v(name, description, xp_reward, metric, threshold)
+WHERE NOT EXISTS (SELECT 1 FROM achievements);
+
+-- credit_activity дополнительно возвращает итоговые messages и voice_minutes,
+-- чтобы правила ачивок проверялись по результатам начисления без отдельного чтения
+DROP FUNCTION IF EXISTS credit_activity(BIGINT[], BIGINT[], DATE[], INTEGER[], INTEGER[], REAL[], REAL[], REAL, REAL);
+
+CREATE FUNCTION credit_activity(
+    p_user_ids BIGINT[],
+    p_server_ids BIGINT[],
+    p_dates DATE[],
+    p_messages INTEGER[],
+    p_voice_minutes INTEGER[],
+    p_points REAL[],
+    p_xp REAL[],
+    p_daily_max REAL,
+    p_currency_ratio REAL
+)
+RETURNS TABLE(
+    user_id BIGINT, server_id BIGINT, currency REAL, balance REAL, streak INTEGER, xp REAL,
+    messages INTEGER, voice_minutes INTEGER
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_server_ids, p_dates, p_messages, p_voice_minutes, p_points, p_xp)
+            AS t(user_id, server_id, date, messages, voice_minutes, points, xp)
+    ),
+    -- totals; в EXCLUDED.streak приходит длина серии дней внутри пачки
+    totals AS (
+        INSERT INTO user_activity_totals AS t
+            (user_id, server_id, messages, voice_minutes, points, xp, streak, last_activity_date)
+        SELECT i.user_id, i.server_id, SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp),
+               MAX(i.date) - MIN(i.date) + 1, MAX(i.date)
+        FROM input i
+        GROUP BY i.server_id, i.user_id
+        ORDER BY i.server_id, i.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            messages = t.messages + EXCLUDED.messages,
+            voice_minutes = t.voice_minutes + EXCLUDED.voice_minutes,
+            points = t.points + EXCLUDED.points,
+            xp = t.xp + EXCLUDED.xp,
+            streak = CASE
+                -- первая активность
+                WHEN t.last_activity_date IS NULL THEN EXCLUDED.streak
+                -- этот день уже засчитан
+                WHEN EXCLUDED.last_activity_date <= t.last_activity_date THEN GREATEST(t.streak, 1)
+                -- серия продолжается со вчерашнего дня
+                WHEN EXCLUDED.last_activity_date - EXCLUDED.streak <= t.last_activity_date
+                    THEN t.streak + (EXCLUDED.last_activity_date - t.last_activity_date)
+                -- был пропуск
+                ELSE EXCLUDED.streak
+            END,
+            last_activity_date = GREATEST(t.last_activity_date, EXCLUDED.last_activity_date)
+        RETURNING t.user_id, t.server_id, t.streak, t.xp, t.messages, t.voice_minutes
+    ),
+    -- daily; RETURNING отдаёт дневной итог уже с учётом пачки
+    daily AS (
+        INSERT INTO user_activity_daily AS d
+            (user_id, server_id, date, messages, voice_minutes, points, xp)
+        SELECT i.user_id, i.server_id, i.date, i.messages, i.voice_minutes, i.points, i.xp
+        FROM input i
+        ORDER BY i.server_id, i.user_id, i.date
+        ON CONFLICT(user_id, server_id, date) DO UPDATE SET
+            messages = d.messages + EXCLUDED.messages,
+            voice_minutes = d.voice_minutes + EXCLUDED.voice_minutes,
+            points = d.points + EXCLUDED.points,
+            xp = d.xp + EXCLUDED.xp
+        RETURNING d.user_id, d.server_id, d.date, d.points
+    ),
+    -- валюта: не больше, чем осталось до дневного лимита до этой пачки
+    currency AS (
+        SELECT d.user_id, d.server_id,
+               (SUM(GREATEST(0, LEAST(i.points, p_daily_max - (d.points - i.points))))
+                   * p_currency_ratio)::REAL AS amount
+        FROM daily d
+        JOIN input i USING (user_id, server_id, date)
+        GROUP BY d.user_id, d.server_id
+    ),
+    -- пользователь создаётся здесь же, если его ещё нет
+    balance AS (
+        INSERT INTO users AS u (user_id, server_id, join_date, points)
+        SELECT c.user_id, c.server_id, NOW(), c.amount
+        FROM currency c
+        ORDER BY c.server_id, c.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            points = u.points + EXCLUDED.points
+        RETURNING u.user_id, u.server_id, u.points
+    )
+    SELECT b.user_id, b.server_id, c.amount, b.points, tt.streak, tt.xp, tt.messages, tt.voice_minutes
+    FROM balance b
+    JOIN currency c USING (user_id, server_id)
+    JOIN totals tt USING (user_id, server_id);
+END;
+$$;
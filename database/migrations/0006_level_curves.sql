@@ -0,0 +1,9 @@
+-- Кривая уровней сервера: для уровня L (L >= 2) нужно round(base * (L - 1) ^ exponent) XP.
+-- Если строки нет, используется кривая по умолчанию из LEVEL_CURVE_* в окружении.
+CREATE TABLE IF NOT EXISTS server_level_curves (
+    server_id BIGINT PRIMARY KEY REFERENCES servers(server_id) ON DELETE CASCADE,
+    base REAL NOT NULL CHECK (base > 0),
+    exponent REAL NOT NULL CHECK (exponent > 0),
+    max_level INTEGER NOT NULL CHECK (max_level >= 1),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,128 @@
+-- Настройки начисления по серверам. NULL = значение по умолчанию из окружения бота.
+CREATE TABLE IF NOT EXISTS server_settings (
+    server_id BIGINT PRIMARY KEY REFERENCES servers(server_id) ON DELETE CASCADE,
+    msg_points REAL CHECK (msg_points >= 0),
+    voice_points_per_min REAL CHECK (voice_points_per_min >= 0),
+    xp_per_msg REAL CHECK (xp_per_msg >= 0),
+    xp_per_voice_min REAL CHECK (xp_per_voice_min >= 0),
+    daily_max_points REAL CHECK (daily_max_points >= 0),
+    currency_ratio REAL CHECK (currency_ratio >= 0),
+    -- антиспам
+    msg_cooldown REAL CHECK (msg_cooldown >= 0),
+    min_msg_length INTEGER CHECK (min_msg_length >= 0),
+    max_msgs_per_minute INTEGER CHECK (max_msgs_per_minute >= 0),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Каждое изменение рассылается процессам бота через NOTIFY server_settings, '<server_id>'
+CREATE OR REPLACE FUNCTION notify_server_settings() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('server_settings', OLD.server_id::text);
+    ELSE
+        PERFORM pg_notify('server_settings', NEW.server_id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS server_settings_notify ON server_settings;
+CREATE TRIGGER server_settings_notify
+    AFTER INSERT OR UPDATE OR DELETE ON server_settings
+    FOR EACH ROW EXECUTE FUNCTION notify_server_settings();
+
+-- Дневной лимит и курс валюты берутся из server_settings
+CREATE OR REPLACE FUNCTION credit_activity(
+    p_user_ids BIGINT[],
+    p_server_ids BIGINT[],
+    p_dates DATE[],
+    p_messages INTEGER[],
+    p_voice_minutes INTEGER[],
+    p_points REAL[],
+    p_xp REAL[],
+    p_daily_max REAL,
+    p_currency_ratio REAL
+)
+RETURNS TABLE(
+    user_id BIGINT, server_id BIGINT, currency REAL, balance REAL, streak INTEGER, xp REAL,
+    messages INTEGER, voice_minutes INTEGER
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_server_ids, p_dates, p_messages, p_voice_minutes, p_points, p_xp)
+            AS t(user_id, server_id, date, messages, voice_minutes, points, xp)
+    ),
+    -- totals; в EXCLUDED.streak приходит длина серии дней внутри пачки
+    totals AS (
+        INSERT INTO user_activity_totals AS t
+            (user_id, server_id, messages, voice_minutes, points, xp, streak, last_activity_date)
+        SELECT i.user_id, i.server_id, SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp),
+               MAX(i.date) - MIN(i.date) + 1, MAX(i.date)
+        FROM input i
+        GROUP BY i.server_id, i.user_id
+        ORDER BY i.server_id, i.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            messages = t.messages + EXCLUDED.messages,
+            voice_minutes = t.voice_minutes + EXCLUDED.voice_minutes,
+            points = t.points + EXCLUDED.points,
+            xp = t.xp + EXCLUDED.xp,
+            streak = CASE
+                -- первая активность
+                WHEN t.last_activity_date IS NULL THEN EXCLUDED.streak
+                -- этот день уже засчитан
+                WHEN EXCLUDED.last_activity_date <= t.last_activity_date THEN GREATEST(t.streak, 1)
+                -- серия продолжается со вчерашнего дня
+                WHEN EXCLUDED.last_activity_date - EXCLUDED.streak <= t.last_activity_date
+                    THEN t.streak + (EXCLUDED.last_activity_date - t.last_activity_date)
+                -- был пропуск
+                ELSE EXCLUDED.streak
+            END,
+            last_activity_date = GREATEST(t.last_activity_date, EXCLUDED.last_activity_date)
+        RETURNING t.user_id, t.server_id, t.streak, t.xp, t.messages, t.voice_minutes
+    ),
+    -- daily; RETURNING отдаёт дневной итог уже с учётом пачки
+    daily AS (
+        INSERT INTO user_activity_daily AS d
+            (user_id, server_id, date, messages, voice_minutes, points, xp)
+        SELECT i.user_id, i.server_id, i.date, i.messages, i.voice_minutes, i.points, i.xp
+        FROM input i
+        ORDER BY i.server_id, i.user_id, i.date
+        ON CONFLICT(user_id, server_id, date) DO UPDATE SET
+            messages = d.messages + EXCLUDED.messages,
+            voice_minutes = d.voice_minutes + EXCLUDED.voice_minutes,
+            points = d.points + EXCLUDED.points,
+            xp = d.xp + EXCLUDED.xp
+        RETURNING d.user_id, d.server_id, d.date, d.points
+    ),
+    -- валюта: не больше, чем осталось до дневного лимита до этой пачки;
+    -- лимит и курс сервера из server_settings, иначе значения по умолчанию из аргументов
+    currency AS (
+        SELECT d.user_id, d.server_id,
+               (SUM(GREATEST(0, LEAST(i.points, COALESCE(s.daily_max_points, p_daily_max) - (d.points - i.points))))
+                   * COALESCE(s.currency_ratio, p_currency_ratio))::REAL AS amount
+        FROM daily d
+        JOIN input i USING (user_id, server_id, date)
+        LEFT JOIN server_settings s ON s.server_id = d.server_id
+        GROUP BY d.user_id, d.server_id, s.daily_max_points, s.currency_ratio
+    ),
+    -- пользователь создаётся здесь же, если его ещё нет
+    balance AS (
+        INSERT INTO users AS u (user_id, server_id, join_date, points)
+        SELECT c.user_id, c.server_id, NOW(), c.amount
+        FROM currency c
+        ORDER BY c.server_id, c.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            points = u.points + EXCLUDED.points
+        RETURNING u.user_id, u.server_id, u.points
+    )
+    SELECT b.user_id, b.server_id, c.amount, b.points, tt.streak, tt.xp, tt.messages, tt.voice_minutes
+    FROM balance b
+    JOIN currency c USING (user_id, server_id)
+    JOIN totals tt USING (user_id, server_id);
+END;
+$$;
@@ -0,0 +1,158 @@
+-- Недельные и месячные итоги активности: лидерборды за период читают одну строку
+-- на участника, а не суммируют user_activity_daily за весь период.
+-- Обновляются в credit_activity вместе с дневными строками; старые периоды
+-- удаляет database.activity_periods.compact_periods.
+CREATE TABLE IF NOT EXISTS user_activity_periods (
+    server_id BIGINT,
+    period TEXT NOT NULL CHECK (period IN ('week', 'month')),
+    period_start DATE NOT NULL,
+    user_id BIGINT,
+    messages INTEGER DEFAULT 0,
+    voice_minutes INTEGER DEFAULT 0,
+    points REAL DEFAULT 0,
+    xp REAL DEFAULT 0,
+    PRIMARY KEY(server_id, period, period_start, user_id),
+    FOREIGN KEY(user_id, server_id) REFERENCES users(user_id, server_id) ON DELETE CASCADE
+);
+
+-- для удаления старых периодов по всем серверам сразу
+CREATE INDEX IF NOT EXISTS user_activity_periods_period_start_idx
+ON user_activity_periods(period, period_start);
+
+-- Итоги по уже накопленной истории
+INSERT INTO user_activity_periods (server_id, period, period_start, user_id, messages, voice_minutes, points, xp)
+SELECT d.server_id, k.period, date_trunc(k.period, d.date::timestamp)::date, d.user_id,
+       SUM(d.messages), SUM(d.voice_minutes), SUM(d.points), SUM(COALESCE(d.xp, 0))
+FROM user_activity_daily d
+CROSS JOIN (VALUES ('week'), ('month')) AS k(period)
+GROUP BY d.server_id, k.period, date_trunc(k.period, d.date::timestamp), d.user_id
+ON CONFLICT DO NOTHING;
+
+-- credit_activity дополнительно обновляет user_activity_periods и возвращает
+-- день начисления и итоги его недели и месяца для кэша лидербордов
+DROP FUNCTION IF EXISTS credit_activity(BIGINT[], BIGINT[], DATE[], INTEGER[], INTEGER[], REAL[], REAL[], REAL, REAL);
+
+CREATE FUNCTION credit_activity(
+    p_user_ids BIGINT[],
+    p_server_ids BIGINT[],
+    p_dates DATE[],
+    p_messages INTEGER[],
+    p_voice_minutes INTEGER[],
+    p_points REAL[],
+    p_xp REAL[],
+    p_daily_max REAL,
+    p_currency_ratio REAL
+)
+RETURNS TABLE(
+    user_id BIGINT, server_id BIGINT, currency REAL, balance REAL, streak INTEGER, xp REAL,
+    messages INTEGER, voice_minutes INTEGER, activity_date DATE, week_points REAL, month_points REAL
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT *
+        FROM unnest(p_user_ids, p_server_ids, p_dates, p_messages, p_voice_minutes, p_points, p_xp)
+            AS t(user_id, server_id, date, messages, voice_minutes, points, xp)
+    ),
+    -- totals; в EXCLUDED.streak приходит длина серии дней внутри пачки
+    totals AS (
+        INSERT INTO user_activity_totals AS t
+            (user_id, server_id, messages, voice_minutes, points, xp, streak, last_activity_date)
+        SELECT i.user_id, i.server_id, SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp),
+               MAX(i.date) - MIN(i.date) + 1, MAX(i.date)
+        FROM input i
+        GROUP BY i.server_id, i.user_id
+        ORDER BY i.server_id, i.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            messages = t.messages + EXCLUDED.messages,
+            voice_minutes = t.voice_minutes + EXCLUDED.voice_minutes,
+            points = t.points + EXCLUDED.points,
+            xp = t.xp + EXCLUDED.xp,
+            streak = CASE
+                -- первая активность
+                WHEN t.last_activity_date IS NULL THEN EXCLUDED.streak
+                -- этот день уже засчитан
+                WHEN EXCLUDED.last_activity_date <= t.last_activity_date THEN GREATEST(t.streak, 1)
+                -- серия продолжается со вчерашнего дня
+                WHEN EXCLUDED.last_activity_date - EXCLUDED.streak <= t.last_activity_date
+                    THEN t.streak + (EXCLUDED.last_activity_date - t.last_activity_date)
+                -- был пропуск
+                ELSE EXCLUDED.streak
+            END,
+            last_activity_date = GREATEST(t.last_activity_date, EXCLUDED.last_activity_date)
+        RETURNING t.user_id, t.server_id, t.streak, t.xp, t.messages, t.voice_minutes
+    ),
+    -- daily; RETURNING отдаёт дневной итог уже с учётом пачки
+    daily AS (
+        INSERT INTO user_activity_daily AS d
+            (user_id, server_id, date, messages, voice_minutes, points, xp)
+        SELECT i.user_id, i.server_id, i.date, i.messages, i.voice_minutes, i.points, i.xp
+        FROM input i
+        ORDER BY i.server_id, i.user_id, i.date
+        ON CONFLICT(user_id, server_id, date) DO UPDATE SET
+            messages = d.messages + EXCLUDED.messages,
+            voice_minutes = d.voice_minutes + EXCLUDED.voice_minutes,
+            points = d.points + EXCLUDED.points,
+            xp = d.xp + EXCLUDED.xp
+        RETURNING d.user_id, d.server_id, d.date, d.points
+    ),
+    -- валюта: не больше, чем осталось до дневного лимита до этой пачки;
+    -- лимит и курс сервера из server_settings, иначе значения по умолчанию из аргументов
+    currency AS (
+        SELECT d.user_id, d.server_id,
+               (SUM(GREATEST(0, LEAST(i.points, COALESCE(s.daily_max_points, p_daily_max) - (d.points - i.points))))
+                   * COALESCE(s.currency_ratio, p_currency_ratio))::REAL AS amount
+        FROM daily d
+        JOIN input i USING (user_id, server_id, date)
+        LEFT JOIN server_settings s ON s.server_id = d.server_id
+        GROUP BY d.user_id, d.server_id, s.daily_max_points, s.currency_ratio
+    ),
+    -- пользователь создаётся здесь же, если его ещё нет
+    balance AS (
+        INSERT INTO users AS u (user_id, server_id, join_date, points)
+        SELECT c.user_id, c.server_id, NOW(), c.amount
+        FROM currency c
+        ORDER BY c.server_id, c.user_id
+        ON CONFLICT(user_id, server_id) DO UPDATE SET
+            points = u.points + EXCLUDED.points
+        RETURNING u.user_id, u.server_id, u.points
+    ),
+    -- недельные и месячные итоги; неделя ISO (с понедельника)
+    periods AS (
+        INSERT INTO user_activity_periods AS p
+            (server_id, period, period_start, user_id, messages, voice_minutes, points, xp)
+        SELECT i.server_id, k.period, date_trunc(k.period, i.date::timestamp)::date, i.user_id,
+               SUM(i.messages), SUM(i.voice_minutes), SUM(i.points), SUM(i.xp)
+        FROM input i
+        CROSS JOIN (VALUES ('week'), ('month')) AS k(period)
+        GROUP BY i.server_id, k.period, date_trunc(k.period, i.date::timestamp), i.user_id
+        ORDER BY i.server_id, k.period, date_trunc(k.period, i.date::timestamp), i.user_id
+        ON CONFLICT(server_id, period, period_start, user_id) DO UPDATE SET
+            messages = p.messages + EXCLUDED.messages,
+            voice_minutes = p.voice_minutes + EXCLUDED.voice_minutes,
+            points = p.points + EXCLUDED.points,
+            xp = p.xp + EXCLUDED.xp
+        RETURNING p.server_id, p.period, p.period_start, p.user_id, p.points
+    ),
+    -- итоги периодов отдаются за последний день пачки у пользователя
+    latest AS (
+        SELECT i.user_id, i.server_id, MAX(i.date) AS date
+        FROM input i
+        GROUP BY i.user_id, i.server_id
+    )
+    SELECT b.user_id, b.server_id, c.amount, b.points, tt.streak, tt.xp, tt.messages, tt.voice_minutes,
+           l.date, pw.points, pm.points
+    FROM balance b
+    JOIN currency c USING (user_id, server_id)
+    JOIN totals tt USING (user_id, server_id)
+    JOIN latest l USING (user_id, server_id)
+    LEFT JOIN periods pw
+        ON pw.user_id = l.user_id AND pw.server_id = l.server_id
+       AND pw.period = 'week' AND pw.period_start = date_trunc('week', l.date::timestamp)::date
+    LEFT JOIN periods pm
+        ON pm.user_id = l.user_id AND pm.server_id = l.server_id
+       AND pm.period = 'month' AND pm.period_start = date_trunc('month', l.date::timestamp)::date;
+END;
+$$;
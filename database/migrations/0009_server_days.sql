@@ -0,0 +1,12 @@
+-- Часовой пояс сервера (имя IANA): день для дневного лимита, стриков и недель/месяцев
+-- рейтингов начинается в местную полночь. NULL = DEFAULT_TIMEZONE из окружения бота.
+ALTER TABLE server_settings ADD COLUMN IF NOT EXISTS timezone TEXT;
+
+-- Текущий день каждого сервера. Смена дня (queries.roll_over_days) переводит его
+-- и одним запросом обнуляет прерванные стрики; если бот был выключен в полночь,
+-- пропущенная смена выполняется при старте.
+CREATE TABLE IF NOT EXISTS server_days (
+    server_id BIGINT PRIMARY KEY REFERENCES servers(server_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    rolled_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,9 @@
+-- До какой позиции локального журнала активности (utils/journal.py) начисления уже в базе.
+-- Позиция двигается в одной транзакции с credit_activity, поэтому повторное
+-- применение сегментов после падения ничего не начисляет дважды.
+CREATE TABLE IF NOT EXISTS journal_offsets (
+    journal_id TEXT PRIMARY KEY,
+    segment BIGINT NOT NULL DEFAULT 0,
+    position BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,602 @@
+from datetime import date
+
+from psycopg import sql
+
+from database.db import connection, execute, fetchone, fetchall
+
+# --------------------------------------
+# Слой доступа к данным.
+# Все коги и обработчики ходят в базу только через эти функции.
+# --------------------------------------
+
+# --------------------------------------
+# Серверы и пользователи
+# --------------------------------------
+async def ensure_server(server_id: int, name: str):
+    await execute("""
+        INSERT INTO servers(server_id, name, created_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT(server_id) DO NOTHING
+    """, (server_id, name))
+
+async def add_user(user_id: int, server_id: int):
+    await execute("""
+        INSERT INTO users(user_id, server_id, join_date)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT(user_id, server_id) DO NOTHING
+    """, (user_id, server_id))
+
+async def sync_guild_members(server_id: int, name: str, user_ids) -> int:
+    """
+    Массовая синхронизация участников сервера: COPY во временную таблицу
+    и один INSERT ... SELECT ... ON CONFLICT DO NOTHING. Возвращает число новых пользователей.
+    """
+    async with connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("""
+            INSERT INTO servers(server_id, name, created_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT(server_id) DO NOTHING
+        """, (server_id, name))
+        await cur.execute("CREATE TEMP TABLE member_sync (user_id BIGINT) ON COMMIT DROP")
+        async with cur.copy("COPY member_sync (user_id) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(["int8"])
+            for user_id in user_ids:
+                await copy.write_row((user_id,))
+        await cur.execute("""
+            INSERT INTO users(user_id, server_id, join_date)
+            SELECT DISTINCT user_id, %s, NOW()
+            FROM member_sync
+            ORDER BY user_id
+            ON CONFLICT(user_id, server_id) DO NOTHING
+        """, (server_id,))
+        return cur.rowcount
+
+# --------------------------------------
+# Начисление активности
+# --------------------------------------
+_CREDIT_ACTIVITY = """
+        SELECT user_id, server_id, currency, balance, streak, xp, messages, voice_minutes,
+               activity_date, week_points, month_points
+        FROM credit_activity(
+            %s::bigint[], %s::bigint[], %s::date[], %s::int[], %s::int[], %s::real[], %s::real[], %s::real, %s::real
+        )
+"""
+
+def _credit_params(rows, daily_max_points: float, currency_ratio: float):
+    user_ids, server_ids, days, messages, voice_minutes, points, xp = (list(col) for col in zip(*rows))
+    return user_ids, server_ids, days, messages, voice_minutes, points, xp, daily_max_points, currency_ratio
+
+async def credit_activity_batch(rows, daily_max_points: float, currency_ratio: float):
+    """
+    Начисляет активность пачкой одним запросом (функция credit_activity из миграций).
+    rows: (user_id, server_id, date, messages, voice_minutes, points, xp), ключи (user_id, server_id, date) уникальны.
+    Возвращает строки (user_id, server_id, начисленная валюта, баланс, стрик, итоговые xp, messages, voice_minutes,
+    последний день пачки, активность за его неделю, активность за его месяц).
+    """
+    if not rows:
+        return []
+    return await fetchall(_CREDIT_ACTIVITY, _credit_params(rows, daily_max_points, currency_ratio))
+
+async def fetch_journal_position(journal_id: str) -> tuple[int, int]:
+    """(segment, position) журнала, до которой начисления уже применены; (0, 0) для нового журнала."""
+    row = await fetchone("SELECT segment, position FROM journal_offsets WHERE journal_id = %s", (journal_id,))
+    return tuple(row) if row else (0, 0)
+
+async def credit_journal_batch(journal_id: str, start, end, rows, daily_max_points: float, currency_ratio: float):
+    """
+    Применяет записи журнала между позициями start и end: credit_activity и сдвиг
+    journal_offsets в одной транзакции. Если позиция в базе уже не start (записи применил
+    другой процесс с тем же журналом), ничего не меняет и возвращает None.
+    Иначе — строки credit_activity, как credit_activity_batch.
+    """
+    async with connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("""
+            INSERT INTO journal_offsets (journal_id) VALUES (%s)
+            ON CONFLICT (journal_id) DO NOTHING
+        """, (journal_id,))
+        await cur.execute(
+            "SELECT segment, position FROM journal_offsets WHERE journal_id = %s FOR UPDATE", (journal_id,)
+        )
+        if tuple(await cur.fetchone()) != tuple(start):
+            return None
+        credited = []
+        if rows:
+            await cur.execute(_CREDIT_ACTIVITY, _credit_params(rows, daily_max_points, currency_ratio))
+            credited = await cur.fetchall()
+        await cur.execute("""
+            UPDATE journal_offsets
+            SET segment = %s, position = %s, updated_at = NOW()
+            WHERE journal_id = %s
+        """, (*end, journal_id))
+        return credited
+
+# --------------------------------------
+# Голосовые сессии
+# --------------------------------------
+async def fetch_voice_sessions(server_ids):
+    """Строки (user_id, server_id, channel_id, started_at, last_credited_at), время — unix timestamp."""
+    return await fetchall("""
+        SELECT user_id, server_id, channel_id,
+               EXTRACT(EPOCH FROM started_at)::float8, EXTRACT(EPOCH FROM last_credited_at)::float8
+        FROM voice_sessions
+        WHERE server_id = ANY(%s::bigint[])
+    """, (list(server_ids),))
+
+async def save_voice_sessions(upserts, deletes):
+    """
+    upserts: (user_id, server_id, channel_id, started_at, last_credited_at), время — unix timestamp.
+    deletes: (user_id, server_id).
+    """
+    if not upserts and not deletes:
+        return
+    async with connection() as conn:
+        cur = conn.cursor()
+        if upserts:
+            user_ids, server_ids, channel_ids, started, credited = (list(col) for col in zip(*upserts))
+            await cur.execute("""
+                INSERT INTO voice_sessions(user_id, server_id, channel_id, started_at, last_credited_at)
+                SELECT t.user_id, t.server_id, t.channel_id, to_timestamp(t.started_at), to_timestamp(t.credited)
+                FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[], %s::float8[], %s::float8[])
+                    AS t(user_id, server_id, channel_id, started_at, credited)
+                ON CONFLICT(user_id, server_id) DO UPDATE SET
+                    channel_id = EXCLUDED.channel_id,
+                    started_at = EXCLUDED.started_at,
+                    last_credited_at = EXCLUDED.last_credited_at
+            """, (user_ids, server_ids, channel_ids, started, credited))
+        if deletes:
+            user_ids, server_ids = (list(col) for col in zip(*deletes))
+            await cur.execute("""
+                DELETE FROM voice_sessions v
+                USING unnest(%s::bigint[], %s::bigint[]) AS t(user_id, server_id)
+                WHERE v.user_id = t.user_id AND v.server_id = t.server_id
+            """, (user_ids, server_ids))
+
+# --------------------------------------
+# Чтение: лидерборд, профиль, ачивки
+# --------------------------------------
+async def fetch_leaderboard_snapshot(server_id: int, scope: str, period_start: date | None = None, limit: int = 1000):
+    """
+    Первые limit мест рейтинга сервера для кэша лидерборда: строки (user_id, streak, points, всего в рейтинге)
+    в порядке scope (при равенстве — по user_id). Пользователи с нулевым значением в рейтинг не попадают.
+    Для scope week/month points — активность за период, начинающийся с period_start.
+    """
+    if scope in ("week", "month"):
+        return await fetchall("""
+            SELECT p.user_id, COALESCE(t.streak, 0), p.points, count(*) OVER ()
+            FROM user_activity_periods p
+            LEFT JOIN user_activity_totals t
+                ON p.user_id = t.user_id AND p.server_id = t.server_id
+            WHERE p.server_id = %s AND p.period = %s AND p.period_start = %s AND p.points > 0
+            ORDER BY p.points DESC, p.user_id
+            LIMIT %s
+        """, (server_id, scope, period_start, limit))
+    if scope == "streak":
+        return await fetchall("""
+            SELECT t.user_id, t.streak, u.points, count(*) OVER ()
+            FROM user_activity_totals t
+            JOIN users u ON u.user_id = t.user_id AND u.server_id = t.server_id
+            WHERE t.server_id = %s AND t.streak > 0
+            ORDER BY t.streak DESC, t.user_id
+            LIMIT %s
+        """, (server_id, limit))
+    if scope == "points":
+        return await fetchall("""
+            SELECT u.user_id, COALESCE(t.streak, 0), u.points, count(*) OVER ()
+            FROM users u
+            LEFT JOIN user_activity_totals t
+                ON u.user_id = t.user_id AND u.server_id = t.server_id
+            WHERE u.server_id = %s AND u.points > 0
+            ORDER BY u.points DESC, u.user_id
+            LIMIT %s
+        """, (server_id, limit))
+    raise ValueError(f"Неизвестный scope лидерборда: {scope}")
+
+async def fetch_profile(user_id: int, server_id: int):
+    """(points, streak, xp) или None, если пользователя нет."""
+    return await fetchone("""
+        SELECT u.points, COALESCE(t.streak, 0), COALESCE(t.xp, 0)
+        FROM users u
+        LEFT JOIN user_activity_totals t
+            ON u.user_id = t.user_id AND u.server_id = t.server_id
+        WHERE u.user_id = %s AND u.server_id = %s
+    """, (user_id, server_id))
+
+# --------------------------------------
+# Чтение для HTTP API: страницы по курсору
+# --------------------------------------
+# scope -> (FROM ... WHERE с параметрами server_id[, period, period_start], колонки: очки для сортировки, user_id, streak, points)
+_LEADERBOARD_PAGES = {
+    "points": ("""
+        FROM users u
+        LEFT JOIN user_activity_totals t ON u.user_id = t.user_id AND u.server_id = t.server_id
+        WHERE u.server_id = %s AND u.points > 0
+    """, "u.points", "u.user_id", "COALESCE(t.streak, 0)", "u.points"),
+    "streak": ("""
+        FROM user_activity_totals t
+        JOIN users u ON u.user_id = t.user_id AND u.server_id = t.server_id
+        WHERE t.server_id = %s AND t.streak > 0
+    """, "t.streak", "t.user_id", "t.streak", "u.points"),
+    "period": ("""
+        FROM user_activity_periods p
+        LEFT JOIN user_activity_totals t ON p.user_id = t.user_id AND p.server_id = t.server_id
+        WHERE p.server_id = %s AND p.period = %s AND p.period_start = %s AND p.points > 0
+    """, "p.points", "p.user_id", "COALESCE(t.streak, 0)", "p.points"),
+}
+
+async def fetch_leaderboard_page(server_id: int, scope: str, period_start: date | None, after, limit: int):
+    """
+    Страница рейтинга в порядке (очки DESC, user_id): строки (user_id, streak, points).
+    after — (очки, user_id) последней строки предыдущей страницы или None; по индексам
+    (server_id, points/streak DESC) это keyset-чтение без OFFSET.
+    """
+    if scope in ("week", "month"):
+        source, score, user_id, streak, points = _LEADERBOARD_PAGES["period"]
+        params = [server_id, scope, period_start]
+    elif scope in _LEADERBOARD_PAGES:
+        source, score, user_id, streak, points = _LEADERBOARD_PAGES[scope]
+        params = [server_id]
+    else:
+        raise ValueError(f"Неизвестный scope лидерборда: {scope}")
+    keyset = ""
+    if after is not None:
+        keyset = f"AND ({score} < %s OR ({score} = %s AND {user_id} > %s))"
+        params += [after[0], after[0], after[1]]
+    return await fetchall(f"""
+        SELECT {user_id}, {streak}, {points}, {score}
+        {source}
+        {keyset}
+        ORDER BY {score} DESC, {user_id}
+        LIMIT %s
+    """, (*params, limit))
+
+async def fetch_user_stats(user_id: int, server_id: int):
+    """(points, level, streak, xp, messages, voice_minutes, last_activity_date) или None."""
+    return await fetchone("""
+        SELECT u.points, COALESCE(u.level, 1), COALESCE(t.streak, 0), COALESCE(t.xp, 0),
+               COALESCE(t.messages, 0), COALESCE(t.voice_minutes, 0), t.last_activity_date
+        FROM users u
+        LEFT JOIN user_activity_totals t
+            ON u.user_id = t.user_id AND u.server_id = t.server_id
+        WHERE u.user_id = %s AND u.server_id = %s
+    """, (user_id, server_id))
+
+async def fetch_activity_history(user_id: int, server_id: int, before: date | None, limit: int):
+    """Дни активности (date, messages, voice_minutes, points, xp) от новых к старым, строго раньше before."""
+    return await fetchall("""
+        SELECT date, messages, voice_minutes, points, COALESCE(xp, 0)
+        FROM user_activity_daily
+        WHERE user_id = %s AND server_id = %s AND (%s::date IS NULL OR date < %s::date)
+        ORDER BY date DESC
+        LIMIT %s
+    """, (user_id, server_id, before, before, limit))
+
+async def fetch_server_day(server_id: int) -> date | None:
+    """Текущий местный день сервера по последней смене дня (server_days)."""
+    row = await fetchone("SELECT day FROM server_days WHERE server_id = %s", (server_id,))
+    return row[0] if row else None
+
+# --------------------------------------
+# Выгрузка истории сервера
+# --------------------------------------
+# вид выгрузки -> (колонки, запрос с параметрами server_id, начало, конец не включая)
+EXPORT_SOURCES = {
+    "daily": (
+        ("date", "user_id", "messages", "voice_minutes", "points", "xp"),
+        """
+            SELECT date, user_id, messages, voice_minutes, points, COALESCE(xp, 0)
+            FROM user_activity_daily
+            WHERE server_id = %s AND date >= %s AND date < %s
+            ORDER BY date, user_id
+        """,
+    ),
+    "logs": (
+        ("created_at", "user_id", "type", "value", "context"),
+        """
+            SELECT created_at, user_id, type, value, context
+            FROM activity_logs
+            WHERE server_id = %s AND created_at >= %s AND created_at < %s
+            ORDER BY created_at
+        """,
+    ),
+}
+
+async def stream_activity(kind: str, server_id: int, start: date, end: date, batch_size: int):
+    """
+    Асинхронный генератор пачек строк (не больше batch_size) из EXPORT_SOURCES[kind]
+    за [start, end). Читает именованным (серверным) курсором, поэтому в памяти
+    всегда одна пачка, сколько бы строк ни было. Соединение из пула занято до конца выгрузки.
+    """
+    _, query = EXPORT_SOURCES[kind]
+    async with connection() as conn:
+        await conn.execute("SET LOCAL statement_timeout = 0")
+        async with conn.cursor(name=f"export_{kind}_{server_id}") as cur:
+            await cur.execute(query, (server_id, start, end))
+            while rows := await cur.fetchmany(batch_size):
+                yield rows
+
+# --------------------------------------
+# Ачивки
+# --------------------------------------
+# Вставка кандидатов с начислением xp_reward только за действительно новые ачивки.
+# Ожидает CTE candidates(user_id, server_id, achievement_id).
+_UNLOCK_ACHIEVEMENTS = """
+    unlocked AS (
+        INSERT INTO user_achievements (user_id, server_id, achievement_id)
+        SELECT DISTINCT user_id, server_id, achievement_id
+        FROM candidates
+        ORDER BY server_id, user_id, achievement_id
+        ON CONFLICT DO NOTHING
+        RETURNING user_id, server_id, achievement_id
+    ),
+    rewards AS (
+        SELECT u.user_id, u.server_id, SUM(a.xp_reward) AS xp
+        FROM unlocked u
+        JOIN achievements a USING (achievement_id)
+        GROUP BY u.user_id, u.server_id
+        HAVING SUM(a.xp_reward) > 0
+    ),
+    -- строки блокируются в том же порядке, что и в credit_activity: без дедлоков между процессами
+    locked AS (
+        SELECT t.user_id, t.server_id
+        FROM user_activity_totals t
+        JOIN rewards r USING (user_id, server_id)
+        ORDER BY t.server_id, t.user_id
+        FOR UPDATE OF t
+    ),
+    rewarded AS (
+        UPDATE user_activity_totals t
+        SET xp = t.xp + r.xp
+        FROM rewards r
+        JOIN locked l USING (user_id, server_id)
+        WHERE t.user_id = r.user_id AND t.server_id = r.server_id
+        RETURNING t.user_id
+    )
+"""
+
+async def fetch_achievement_rules():
+    """(achievement_id, metric, threshold) всех ачивок с правилом."""
+    return await fetchall("""
+        SELECT achievement_id, metric, threshold
+        FROM achievements
+        WHERE metric IS NOT NULL AND threshold IS NOT NULL
+    """)
+
+async def unlock_achievements(candidates):
+    """
+    candidates: (user_id, server_id, achievement_id); уже полученные пропускаются.
+    Возвращает только новые (user_id, server_id, achievement_id).
+    """
+    if not candidates:
+        return []
+    user_ids, server_ids, achievement_ids = (list(col) for col in zip(*candidates))
+    return await fetchall(f"""
+        WITH candidates AS (
+            SELECT *
+            FROM unnest(%s::bigint[], %s::bigint[], %s::int[]) AS c(user_id, server_id, achievement_id)
+        ),
+        {_UNLOCK_ACHIEVEMENTS}
+        SELECT user_id, server_id, achievement_id FROM unlocked
+    """, (user_ids, server_ids, achievement_ids))
+
+async def backfill_achievements(server_id: int | None = None) -> int:
+    """Проверяет правила для всех пользователей (или одного сервера) одним запросом. Возвращает число выданных ачивок."""
+    async with connection() as conn:
+        cur = conn.cursor()
+        # на больших серверах это дольше обычного statement_timeout
+        await cur.execute("SET LOCAL statement_timeout = 0")
+        await cur.execute(f"""
+            WITH stats AS (
+                SELECT u.user_id, u.server_id, u.points,
+                       COALESCE(t.messages, 0) AS messages, COALESCE(t.voice_minutes, 0) AS voice_minutes,
+                       COALESCE(t.streak, 0) AS streak, COALESCE(t.xp, 0) AS xp
+                FROM users u
+                LEFT JOIN user_activity_totals t USING (user_id, server_id)
+                WHERE %(server_id)s::bigint IS NULL OR u.server_id = %(server_id)s::bigint
+            ),
+            candidates AS (
+                SELECT s.user_id, s.server_id, a.achievement_id
+                FROM stats s
+                JOIN achievements a ON a.threshold <= CASE a.metric
+                    WHEN 'messages' THEN s.messages
+                    WHEN 'voice_minutes' THEN s.voice_minutes
+                    WHEN 'streak' THEN s.streak
+                    WHEN 'points' THEN s.points
+                    WHEN 'xp' THEN s.xp
+                END
+            ),
+            {_UNLOCK_ACHIEVEMENTS}
+            SELECT COUNT(*) FROM unlocked
+        """, {"server_id": server_id})
+        return (await cur.fetchone())[0]
+
+async def fetch_achievements(user_id: int, server_id: int):
+    return await fetchall("""
+        SELECT a.name, a.description, ua.date_unlocked
+        FROM achievements a
+        LEFT JOIN user_achievements ua
+            ON a.achievement_id = ua.achievement_id
+            AND ua.user_id = %s
+            AND ua.server_id = %s
+    """, (user_id, server_id))
+
+# --------------------------------------
+# Роли за активность
+# --------------------------------------
+async def fetch_role_rules():
+    """(server_id, role_id, required_points, required_level) всех серверов."""
+    return await fetchall("SELECT server_id, role_id, required_points, required_level FROM server_roles")
+
+async def fetch_role_stats(server_id: int):
+    """(user_id, points, level) всех пользователей сервера — для сверки ролей."""
+    return await fetchall("SELECT user_id, points, level FROM users WHERE server_id = %s", (server_id,))
+
+# --------------------------------------
+# Уровни
+# --------------------------------------
+async def fetch_level_curves():
+    """(server_id, base, exponent, max_level) серверов со своей кривой."""
+    return await fetchall("SELECT server_id, base, exponent, max_level FROM server_level_curves")
+
+async def save_level_curve(server_id: int, base: float, exponent: float, max_level: int):
+    await execute("""
+        INSERT INTO server_level_curves (server_id, base, exponent, max_level)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (server_id) DO UPDATE SET
+            base = EXCLUDED.base,
+            exponent = EXCLUDED.exponent,
+            max_level = EXCLUDED.max_level,
+            updated_at = NOW()
+    """, (server_id, base, exponent, max_level))
+
+async def raise_levels(rows):
+    """
+    rows: (user_id, server_id, level). Уровень только повышается.
+    Возвращает реально изменённые строки (user_id, server_id, level).
+    """
+    if not rows:
+        return []
+    user_ids, server_ids, levels = (list(col) for col in zip(*rows))
+    return await fetchall("""
+        WITH new AS (
+            SELECT *
+            FROM unnest(%s::bigint[], %s::bigint[], %s::int[]) AS n(user_id, server_id, level)
+        ),
+        -- порядок блокировок как в credit_activity: без дедлоков между процессами
+        locked AS (
+            SELECT u.user_id, u.server_id
+            FROM users u
+            JOIN new USING (user_id, server_id)
+            ORDER BY u.server_id, u.user_id
+            FOR UPDATE OF u
+        )
+        UPDATE users u
+        SET level = new.level
+        FROM new
+        JOIN locked USING (user_id, server_id)
+        WHERE u.user_id = new.user_id AND u.server_id = new.server_id
+          AND COALESCE(u.level, 1) < new.level
+        RETURNING u.user_id, u.server_id, u.level
+    """, (user_ids, server_ids, levels))
+
+async def recompute_levels(server_id: int, thresholds) -> int:
+    """
+    Пересчитывает users.level всего сервера по массиву порогов кривой
+    (width_bucket = число порогов не больше XP). Возвращает число изменённых строк.
+    """
+    async with connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("SET LOCAL statement_timeout = 0")
+        await cur.execute("""
+            UPDATE users u
+            SET level = n.level
+            FROM (
+                SELECT u2.user_id, 1 + width_bucket(COALESCE(t.xp, 0)::float8, %s::float8[]) AS level
+                FROM users u2
+                LEFT JOIN user_activity_totals t USING (user_id, server_id)
+                WHERE u2.server_id = %s
+            ) n
+            WHERE u.server_id = %s AND u.user_id = n.user_id
+              AND u.level IS DISTINCT FROM n.level
+        """, (list(thresholds), server_id, server_id))
+        return cur.rowcount
+
+# --------------------------------------
+# Настройки серверов
+# --------------------------------------
+SERVER_SETTINGS_COLUMNS = (
+    "msg_points", "voice_points_per_min", "xp_per_msg", "xp_per_voice_min",
+    "daily_max_points", "currency_ratio", "msg_cooldown", "min_msg_length", "max_msgs_per_minute",
+    "timezone",
+)
+
+async def fetch_server_settings(server_id: int | None = None):
+    """(server_id, *SERVER_SETTINGS_COLUMNS) всех серверов или одного; NULL = по умолчанию."""
+    query = sql.SQL("SELECT server_id, {} FROM server_settings WHERE %s::bigint IS NULL OR server_id = %s::bigint").format(
+        sql.SQL(", ").join(map(sql.Identifier, SERVER_SETTINGS_COLUMNS)),
+    )
+    return await fetchall(query, (server_id, server_id))
+
+async def save_server_settings(server_id: int, values: dict):
+    """Меняет только переданные колонки; остальные остаются как были."""
+    columns = [column for column in SERVER_SETTINGS_COLUMNS if column in values]
+    if not columns:
+        return
+    query = sql.SQL("""
+        INSERT INTO server_settings (server_id, {columns}) VALUES (%s, {placeholders})
+        ON CONFLICT (server_id) DO UPDATE SET {updates}, updated_at = NOW()
+    """).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+        placeholders=sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+        updates=sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column)) for column in columns
+        ),
+    )
+    await execute(query, (server_id, *(values[column] for column in columns)))
+
+async def delete_server_settings(server_id: int):
+    await execute("DELETE FROM server_settings WHERE server_id = %s", (server_id,))
+
+# --------------------------------------
+# Смена дня
+# --------------------------------------
+async def roll_over_days(days):
+    """
+    days: (server_id, новый местный день сервера).
+    Одним запросом переводит server_days на новый день и обнуляет стрики тех,
+    кто не был активен вчера. Серверы, у которых этот день уже наступил, пропускаются.
+    Возвращает (server_id, сколько стриков обнулено) для реально переведённых серверов.
+
+    Пустые строки user_activity_daily на новый день для всех участников сознательно не создаются:
+    credit_activity и так делает upsert дневной строки при первой активности, так что заготовка
+    не убирает работу из пути сообщения, зато добавляла бы строку на каждого участника каждого
+    сервера в день — в том числе неактивных, — раздувая таблицу, историю в API и выгрузки.
+    Путь сообщения не читает стрики и без неё: их продолжение считает credit_activity.
+    """
+    if not days:
+        return []
+    server_ids, new_days = (list(col) for col in zip(*days))
+    async with connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("SET LOCAL statement_timeout = 0")
+        await cur.execute("""
+            WITH due AS (
+                SELECT *
+                FROM unnest(%s::bigint[], %s::date[]) AS d(server_id, day)
+            ),
+            advanced AS (
+                INSERT INTO server_days AS s (server_id, day)
+                SELECT due.server_id, due.day
+                FROM due
+                JOIN servers USING (server_id)
+                ORDER BY due.server_id
+                ON CONFLICT (server_id) DO UPDATE SET
+                    day = EXCLUDED.day,
+                    rolled_at = NOW()
+                WHERE s.day < EXCLUDED.day
+                RETURNING s.server_id, s.day
+            ),
+            -- порядок блокировок как в credit_activity: без дедлоков между процессами
+            locked AS (
+                SELECT t.user_id, t.server_id, a.day
+                FROM user_activity_totals t
+                JOIN advanced a USING (server_id)
+                WHERE t.streak > 0 AND t.last_activity_date < a.day - 1
+                ORDER BY t.server_id, t.user_id
+                FOR UPDATE OF t
+            ),
+            reset AS (
+                UPDATE user_activity_totals t
+                SET streak = 0
+                FROM locked l
+                WHERE t.user_id = l.user_id AND t.server_id = l.server_id
+                  AND t.last_activity_date < l.day - 1
+                RETURNING t.server_id
+            )
+            SELECT a.server_id, COUNT(r.server_id)
+            FROM advanced a
+            LEFT JOIN reset r USING (server_id)
+            GROUP BY a.server_id
+        """, (server_ids, new_days))
+        return await cur.fetchall()
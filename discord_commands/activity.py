@@ -2,10 +2,27 @@ from discord import app_commands
 from discord.ext import commands, tasks
 from discord.ui import View, button, Button
 import discord
-import time
+from zoneinfo import available_timezones
 from datetime import date
-from database.db import get_connection
+from typing import Literal, Optional
+import asyncio
+import os
+import tempfile
+from database import queries
+from database.activity_buffer import ActivityBuffer
+from database.activity_periods import compact_periods, ACTIVITY_PERIODS_COMPACT_INTERVAL
+from database.export import export_activity, ExportTooLarge, EXPORT_CONCURRENCY, EXPORT_MAX_FILES, EXPORT_PART_MARGIN
 from utils.logger import setup_logger, log_user_activity
+from utils import metrics
+from utils.achievements import AchievementEngine
+from utils.antispam import MessageGate
+from utils.leaderboard import leaderboards
+from utils.profile_cache import profile_cache
+from utils.role_rewards import RoleRewards, ROLE_RECONCILE_INTERVAL
+from utils.levels import LevelEngine
+from utils.server_settings import server_settings, DEFAULTS
+from utils.user_resolver import user_resolver
+from utils.voice_tracker import VoiceTracker
 
 logger = setup_logger()
 
@@ -13,248 +30,453 @@ logger = setup_logger()
 # VIEW ДЛЯ ЛИДЕРБОРДА
 # --------------------------------------
 class LeaderboardView(View):
+    PAGE_SIZE = 10
+
     def __init__(self, bot, server_id):
         super().__init__(timeout=None)
         self.bot = bot
         self.server_id = server_id
         self.current_scope = "streak"
+        self.page = 0
 
+    @metrics.instrumented("component", "leaderboard_page")
     async def update_leaderboard(self, interaction: discord.Interaction):
-        embed = await Activity.generate_leaderboard_embed(self.bot, self.server_id, self.current_scope)
-        await interaction.response.edit_message(embed=embed, view=self)
+        await interaction.response.defer()
+        board = await leaderboards.get(self.server_id, self.current_scope)
+        self.page = min(self.page, max(0, (len(board) - 1) // self.PAGE_SIZE))
+        embed = await Activity.generate_leaderboard_embed(self.bot, self.server_id, self.current_scope, self.page)
+        await interaction.edit_original_response(embed=embed, view=self)
 
     @button(label="Стрики", style=discord.ButtonStyle.primary)
     async def streak_button(self, interaction: discord.Interaction, button: Button):
         self.current_scope = "streak"
+        self.page = 0
         await self.update_leaderboard(interaction)
 
     @button(label="Поинты", style=discord.ButtonStyle.secondary)
     async def points_button(self, interaction: discord.Interaction, button: Button):
         self.current_scope = "points"
+        self.page = 0
+        await self.update_leaderboard(interaction)
+
+    @button(label="Неделя", style=discord.ButtonStyle.secondary)
+    async def week_button(self, interaction: discord.Interaction, button: Button):
+        self.current_scope = "week"
+        self.page = 0
+        await self.update_leaderboard(interaction)
+
+    @button(label="Месяц", style=discord.ButtonStyle.secondary)
+    async def month_button(self, interaction: discord.Interaction, button: Button):
+        self.current_scope = "month"
+        self.page = 0
+        await self.update_leaderboard(interaction)
+
+    @button(label="⬅️", style=discord.ButtonStyle.secondary)
+    async def prev_button(self, interaction: discord.Interaction, button: Button):
+        self.page = max(0, self.page - 1)
+        await self.update_leaderboard(interaction)
+
+    @button(label="➡️", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        self.page += 1
         await self.update_leaderboard(interaction)
 
+    @button(label="Моё место", style=discord.ButtonStyle.success)
+    async def rank_button(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        with metrics.track("component", "leaderboard_rank"):
+            board = await leaderboards.get(self.server_id, self.current_scope)
+        rank = board.rank(interaction.user.id)
+        if rank is not None:
+            text = f"Твоё место: {rank} из {board.total}"
+        elif len(board) >= board.size:
+            text = f"Ты пока не в топ-{board.size} этого рейтинга"
+        else:
+            text = "Тебя пока нет в этом рейтинге"
+        await interaction.followup.send(text, ephemeral=True)
+
 # --------------------------------------
 # КОГ ДЛЯ АКТИВНОСТИ
 # --------------------------------------
 class Activity(commands.Cog):
-    DAILY_MAX_POINTS = 50  # максимум валюты в день
-    MSG_POINTS = 0.1
-    VOICE_POINTS_PER_MIN = 0.05  # 0.5 за 10 минут
-
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.voice_sessions = {}  # server_id -> {user_id: start_time}
+        self.voice_sessions = VoiceTracker()
+        # антиспам: решает до любой работы с базой, засчитывать ли сообщение
+        self.message_gate = MessageGate()
+        # лимит и курс по умолчанию; свои значения серверов credit_activity берёт из server_settings
+        self.buffer = ActivityBuffer(DEFAULTS.daily_max_points, DEFAULTS.currency_ratio)
+        # лидерборды и профили обновляются прямо из результатов начисления
+        self.buffer.add_listener(leaderboards.apply_credits)
+        self.buffer.add_listener(profile_cache.apply_credits)
+        # ачивки проверяются по тем же результатам; xp_reward меняет профиль
+        self.achievements = AchievementEngine()
+        self.buffer.add_listener(self.achievements.apply_credits)
+        self.achievements.add_listener(self._on_achievements_unlocked)
+        # уровни по итоговому XP
+        self.levels = LevelEngine(bot)
+        self.buffer.add_listener(self.levels.apply_credits)
+        # роли за активность: переходы порогов из начислений + периодическая сверка
+        self.roles = RoleRewards(bot, self.levels.level_of)
+        self.buffer.add_listener(self.roles.apply_credits)
+        self._server_days = {}  # server_id -> местный день, для которого уже выполнена смена дня
+        self._export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
         self.update_voice_activity.start()
+        self.reconcile_roles.start()
+        self.compact_activity_periods.start()
+        self.day_rollover.start()
+
+    async def cog_load(self):
+        await server_settings.load()
+        server_settings.start()
+        await self.achievements.load()
+        self.achievements.start()
+        await self.levels.load()
+        self.levels.start()
+        await self.roles.load()
+        self.roles.start()
+        await self.buffer.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.update_voice_activity.cancel()
+        self.reconcile_roles.cancel()
+        self.compact_activity_periods.cancel()
+        self.day_rollover.cancel()
+        await self.roles.stop()
+        server_settings.stop()
+        # при штатной остановке применяем журнал; если база недоступна, он дождётся следующего запуска
+        try:
+            await self.buffer.stop()
+        except Exception:
+            logger.exception("Журнал активности не применён до конца, остаток применится при следующем запуске")
+        await self.achievements.stop()
+        await self.levels.stop()
 
-    def _today_str(self) -> str:
-        return date.today().isoformat()
+    def _on_achievements_unlocked(self, unlocked):
+        for user_id, server_id, _ in unlocked:
+            profile_cache.invalidate(user_id, server_id)
 
-    # --------------------------------------
-    # Добавление пользователя
-    # --------------------------------------
-    def add_user(self, user_id: int, server_id: int):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO users(user_id, server_id, join_date)
-            VALUES (%s, %s, NOW())
-            ON CONFLICT(user_id, server_id) DO NOTHING
-        """, (user_id, server_id))
-        conn.commit()
-        conn.close()
+    def _today_str(self, server_id: int) -> str:
+        # местный день сервера; кэшируется до полуночи его часового пояса
+        return server_settings.get(server_id).today().isoformat()
 
     # --------------------------------------
-    # Подготовка для сегодняшней активности
+    # Добавление пользователя
     # --------------------------------------
-    def _rollover_and_prepare_today(self, user_id: int, server_id: int, conn):
-        cur = conn.cursor()
-        today = self._today_str()
-        cur.execute("""
-            INSERT INTO user_activity_daily(user_id, server_id, date)
-            VALUES (%s, %s, %s)
-            ON CONFLICT(user_id, server_id, date) DO NOTHING
-        """, (user_id, server_id, today))
+    async def add_user(self, user_id: int, server_id: int):
+        await queries.add_user(user_id, server_id)
 
-    # --------------------------------------
-    # Начисление очков
-    # --------------------------------------
     # --------------------------------------
     # Универсальная функция начисления активности
     # --------------------------------------
 
-    def _add_activity(self, user_id: int, server_id: int, msg_inc: int = 0, voice_minutes_inc: int = 0):
+    async def _add_activity(self, user_id: int, server_id: int, msg_inc: int = 0, voice_minutes_inc: int = 0):
         """
-        Начисляет:
+        Ставит в буфер начисление:
         - activity points (user_activity_totals/daily)
-        - streak
         - ограниченные points (валюта) в таблице users
+        Коэффициенты — из настроек сервера (в памяти, без запроса).
+        В базу попадает при очередном сбросе буфера (ACTIVITY_FLUSH_INTERVAL).
         """
-        self.add_user(user_id, server_id)
-        today = self._today_str()
-
-        # базовые коэффициенты
-        ACTIVITY_PER_MSG = 0.1
-        ACTIVITY_PER_VOICE_MIN = 0.05
-        XP_PER_MSG = 5
-        XP_PER_VOICE_MIN = 1
-        CURRENCY_RATIO = 1.0  # 1 активность = 1 валюта (до лимита)
+        today = self._today_str(server_id)
+        rules = server_settings.get(server_id)
 
         # начисления
-        activity_points = msg_inc * ACTIVITY_PER_MSG + voice_minutes_inc * ACTIVITY_PER_VOICE_MIN
-        xp = msg_inc * XP_PER_MSG + voice_minutes_inc * XP_PER_VOICE_MIN
-
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # --- totals (активность) ---
-        cur.execute("""
-            INSERT INTO user_activity_totals(user_id, server_id, messages, voice_minutes, points, xp, last_activity_date)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT(user_id, server_id) DO UPDATE SET
-                messages = user_activity_totals.messages + EXCLUDED.messages,
-                voice_minutes = user_activity_totals.voice_minutes + EXCLUDED.voice_minutes,
-                points = user_activity_totals.points + EXCLUDED.points,
-                xp = user_activity_totals.xp + EXCLUDED.xp,
-                last_activity_date = EXCLUDED.last_activity_date
-        """, (user_id, server_id, msg_inc, voice_minutes_inc, activity_points, xp, today))
-
-        # --- daily (активность) ---
-        cur.execute("""
-            INSERT INTO user_activity_daily(user_id, server_id, date, messages, voice_minutes, points, xp)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT(user_id, server_id, date) DO UPDATE SET
-                messages = user_activity_daily.messages + EXCLUDED.messages,
-                voice_minutes = user_activity_daily.voice_minutes + EXCLUDED.voice_minutes,
-                points = user_activity_daily.points + EXCLUDED.points,
-                xp = user_activity_daily.xp + EXCLUDED.xp
-        """, (user_id, server_id, today, msg_inc, voice_minutes_inc, activity_points, xp))
-
-        # --- ограниченное начисление валюты ---
-        cur.execute("""
-            SELECT COALESCE(SUM(points), 0)
-            FROM user_activity_daily
-            WHERE user_id = %s AND server_id = %s AND date = %s
-        """, (user_id, server_id, today))
-        today_activity = cur.fetchone()[0]
-
-        # сколько валюты можно начислить (лимит в день)
-        if today_activity <= self.DAILY_MAX_POINTS:
-            allowed_points = min(activity_points, self.DAILY_MAX_POINTS - today_activity)
-            if allowed_points > 0:
-                cur.execute("""
-                    UPDATE users
-                    SET points = points + %s
-                    WHERE user_id = %s AND server_id = %s
-                """, (allowed_points * CURRENCY_RATIO, user_id, server_id))
-
-        # --- стрики ---
-        cur.execute("""
-            SELECT last_activity_date, streak FROM user_activity_totals
-            WHERE user_id = %s AND server_id = %s
-        """, (user_id, server_id))
-        row = cur.fetchone()
-        streak = 1
-        if row and row[0]:
-            last_date = row[0]
-            streak = row[1] or 0
-            if (date.fromisoformat(today) - last_date).days == 1:
-                streak += 1
-            elif (date.fromisoformat(today) - last_date).days > 1:
-                streak = 1
-        cur.execute("""
-            UPDATE user_activity_totals
-            SET streak = %s
-            WHERE user_id = %s AND server_id = %s
-        """, (streak, user_id, server_id))
-
-        conn.commit()
-        conn.close()
-        return activity_points, xp, streak
+        activity_points = msg_inc * rules.msg_points + voice_minutes_inc * rules.voice_points_per_min
+        xp = msg_inc * rules.xp_per_msg + voice_minutes_inc * rules.xp_per_voice_min
+
+        await self.buffer.add(user_id, server_id, today, msg_inc, voice_minutes_inc, activity_points, xp)
+        return activity_points, xp
 
     # --------------------------------------
     # Слушатели сообщений
     # --------------------------------------
 
     @commands.Cog.listener()
+    @metrics.instrumented("listener")
     async def on_message(self, message: discord.Message):
         if message.author.bot or not message.guild:
             return
-        points, xp, streak = self._add_activity(message.author.id, message.guild.id, msg_inc=1)
+        rules = server_settings.get(message.guild.id)
+        if not self.message_gate.allow(message.author.id, message.guild.id, message.content, rules):
+            return
+        points, xp = await self._add_activity(message.author.id, message.guild.id, msg_inc=1)
         log_user_activity(message.author, message.guild.id, "Message", points, context=message.content)
-        logger.info(f"{message.author}: +{points:.2f} pts | +{xp} XP | стрик {streak}")
+        logger.debug("%s: +%.2f pts | +%s XP", message.author, points, xp)
+
+    # --------------------------------------
+    # Голос
+    # --------------------------------------
+    async def _credit_voice(self, credits):
+        for member, server_id, minutes in credits:
+            points, xp = await self._add_activity(member.id, server_id, voice_minutes_inc=minutes)
+            log_user_activity(member, server_id, "VoiceCall", points, context=f"{minutes} мин")
 
     @commands.Cog.listener()
+    @metrics.instrumented("listener")
+    async def on_ready(self):
+        # восстанавливаем сессии тех, кто уже сидит в голосе
+        credits = await self.voice_sessions.rebuild(self.bot.guilds)
+        await self._credit_voice(credits)
+        await self.voice_sessions.persist()
+        logger.info(f"Голосовых сессий после старта: {len(self.voice_sessions)}")
+
+    @commands.Cog.listener()
+    @metrics.instrumented("listener")
     async def on_voice_state_update(self, member, before, after):
-        if not member.guild:
+        if member.bot or not member.guild:
             return
-        server_id = member.guild.id
-        if server_id not in self.voice_sessions:
-            self.voice_sessions[server_id] = {}
-        user_sessions = self.voice_sessions[server_id]
-
-        # пользователь зашел
-        if before.channel is None and after.channel is not None:
-            user_sessions[member.id] = time.time()
-
-        # пользователь вышел
-        elif before.channel is not None and after.channel is None and member.id in user_sessions:
-            start = user_sessions.pop(member.id)
-            minutes = int((time.time() - start) / 60)
-            if minutes > 0:
-                points, xp, streak = self._add_activity(member.id, server_id, voice_minutes_inc=minutes)
-                log_user_activity(member, server_id, "VoiceCall", points, context=f"{minutes} мин")
-                logger.info(f"{member}: +{points:.2f} pts | +{xp} XP | стрик {streak}")
+        minutes = self.voice_sessions.on_state_update(member, before, after)
+        if minutes > 0:
+            await self._credit_voice([(member, member.guild.id, minutes)])
+
+    @commands.Cog.listener()
+    @metrics.instrumented("listener")
+    async def on_guild_remove(self, guild):
+        self.voice_sessions.forget_guild(guild.id)
+        self._server_days.pop(guild.id, None)
+        leaderboards.invalidate(guild.id)
+        profile_cache.invalidate(server_id=guild.id)
+        self.roles.forget_guild(guild.id)
+        self.message_gate.forget_guild(guild.id)
 
     @tasks.loop(minutes=1)
+    @metrics.instrumented("task")
     async def update_voice_activity(self):
-        now = time.time()
-        for server_id, sessions in self.voice_sessions.items():
-            for user_id, start in list(sessions.items()):
-                minutes = int((now - start) / 60)
-                if minutes > 0:
-                    points, xp, streak = self._add_activity(user_id, server_id, voice_minutes_inc=minutes)
-                    log_user_activity(user_id, server_id, "VoiceCall", points, context=f"{minutes} мин")
-                    sessions[user_id] = now
-                    logger.info(f"user_id={user_id} | server_id={server_id} | +{points:.2f} pts | +{xp} XP | стрик {streak}")
+        # все начисления тика уходят в буфер и пишутся одним сбросом
+        credits = self.voice_sessions.tick({guild.id: guild for guild in self.bot.guilds})
+        await self._credit_voice(credits)
+        try:
+            await self.voice_sessions.persist()
+        except Exception:
+            logger.exception("Не удалось сохранить голосовые сессии")
+
+    @update_voice_activity.before_loop
+    async def before_update_voice_activity(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=ROLE_RECONCILE_INTERVAL)
+    @metrics.instrumented("task")
+    async def reconcile_roles(self):
+        # правила могли поменяться в server_roles
+        await self.roles.load()
+        for guild in self.bot.guilds:
+            try:
+                queued = await self.roles.reconcile(guild)
+            except Exception:
+                logger.exception(f"Не удалось сверить роли на {guild.name}")
+                continue
+            if queued:
+                logger.info(f"Сверка ролей {guild.name}: изменений в очереди {queued}")
+
+    @reconcile_roles.before_loop
+    async def before_reconcile_roles(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=ACTIVITY_PERIODS_COMPACT_INTERVAL)
+    @metrics.instrumented("task")
+    async def compact_activity_periods(self):
+        # недельные и месячные итоги старше срока хранения
+        try:
+            await compact_periods()
+        except Exception:
+            logger.exception("Не удалось почистить user_activity_periods")
+
+    @compact_activity_periods.before_loop
+    async def before_compact_activity_periods(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=1)
+    @metrics.instrumented("task")
+    async def day_rollover(self):
+        # серверы, у которых наступила местная полночь (после старта — все: база пропустит уже переведённые)
+        due = []
+        for guild in self.bot.guilds:
+            today = server_settings.get(guild.id).today()
+            if self._server_days.get(guild.id) != today:
+                due.append((guild.id, today))
+        if not due:
+            return
+        try:
+            rolled = await queries.roll_over_days(due)
+        except Exception:
+            logger.exception("Не удалось выполнить смену дня, повторим через минуту")
+            return
+        self._server_days.update(due)
+        for server_id, reset in rolled:
+            leaderboards.invalidate(server_id)
+            if reset:
+                profile_cache.invalidate(server_id=server_id)
+        if rolled:
+            logger.info(f"Смена дня: серверов {len(rolled)}, обнулено стриков {sum(reset for _, reset in rolled)}")
+
+    @day_rollover.before_loop
+    async def before_day_rollover(self):
+        await self.bot.wait_until_ready()
 
         # --------------------------------------
         # Команды
         # --------------------------------------
     @app_commands.command(name="leaderboard", description="Лидерборд сервера")
+    @metrics.instrumented("command")
     async def leaderboard(self, interaction: discord.Interaction):
+        await interaction.response.defer()
         view = LeaderboardView(self.bot, interaction.guild.id)
         embed = await self.generate_leaderboard_embed(self.bot, interaction.guild.id, "streak")
-        await interaction.response.send_message(embed=embed, view=view)
+        await interaction.followup.send(embed=embed, view=view)
+
+    @app_commands.command(name="achievements_backfill", description="Выдать ачивки по текущей статистике всем участникам")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @metrics.instrumented("command")
+    async def achievements_backfill(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        # правила могли поменяться в базе
+        await self.achievements.load()
+        count = await self.achievements.backfill(interaction.guild.id)
+        profile_cache.invalidate(server_id=interaction.guild.id)
+        await interaction.followup.send(f"Выдано ачивок: {count}", ephemeral=True)
+
+    @app_commands.command(name="level_curve", description="Задать кривую уровней сервера и пересчитать уровни")
+    @app_commands.describe(
+        base="XP для второго уровня",
+        exponent="Крутизна кривой: XP уровня L = base * (L - 1) ^ exponent",
+        max_level="Максимальный уровень",
+    )
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @metrics.instrumented("command")
+    async def level_curve(
+        self,
+        interaction: discord.Interaction,
+        base: app_commands.Range[float, 1, 1_000_000],
+        exponent: app_commands.Range[float, 0.1, 5.0],
+        max_level: app_commands.Range[int, 2, 10_000],
+    ):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        await queries.ensure_server(interaction.guild.id, interaction.guild.name)
+        changed = await self.levels.set_curve(interaction.guild.id, base, exponent, max_level)
+        await interaction.followup.send(f"Кривая сохранена, уровень изменился у {changed} участников", ephemeral=True)
+
+    @app_commands.command(name="settings", description="Настройки начисления сервера (без параметров — показать)")
+    @app_commands.describe(
+        msg_points="Активность за сообщение",
+        voice_points_per_min="Активность за минуту в голосе",
+        xp_per_msg="XP за сообщение",
+        xp_per_voice_min="XP за минуту в голосе",
+        daily_max_points="Максимум валюты в день",
+        currency_ratio="Валюты за единицу активности",
+        msg_cooldown="Секунд между засчитанными сообщениями",
+        min_msg_length="Минимальная длина засчитанного сообщения",
+        max_msgs_per_minute="Засчитанных сообщений в минуту (0 — без ограничения)",
+        timezone="Часовой пояс IANA, например Europe/Moscow: от него считаются дни",
+        reset="Вернуть значения по умолчанию",
+    )
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @metrics.instrumented("command")
+    async def settings(
+        self,
+        interaction: discord.Interaction,
+        msg_points: Optional[app_commands.Range[float, 0, 100]] = None,
+        voice_points_per_min: Optional[app_commands.Range[float, 0, 100]] = None,
+        xp_per_msg: Optional[app_commands.Range[float, 0, 10_000]] = None,
+        xp_per_voice_min: Optional[app_commands.Range[float, 0, 10_000]] = None,
+        daily_max_points: Optional[app_commands.Range[float, 0, 1_000_000]] = None,
+        currency_ratio: Optional[app_commands.Range[float, 0, 1000]] = None,
+        msg_cooldown: Optional[app_commands.Range[float, 0, 3600]] = None,
+        min_msg_length: Optional[app_commands.Range[int, 0, 2000]] = None,
+        max_msgs_per_minute: Optional[app_commands.Range[int, 0, 1000]] = None,
+        timezone: Optional[str] = None,
+        reset: bool = False,
+    ):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        server_id = interaction.guild.id
+        if timezone is not None and timezone not in available_timezones():
+            await interaction.followup.send(f"Неизвестный часовой пояс: {timezone}", ephemeral=True)
+            return
+        if reset:
+            await server_settings.reset(server_id)
+        else:
+            await queries.ensure_server(server_id, interaction.guild.name)
+            await server_settings.update(
+                server_id,
+                msg_points=msg_points, voice_points_per_min=voice_points_per_min,
+                xp_per_msg=xp_per_msg, xp_per_voice_min=xp_per_voice_min,
+                daily_max_points=daily_max_points, currency_ratio=currency_ratio,
+                msg_cooldown=msg_cooldown, min_msg_length=min_msg_length, max_msgs_per_minute=max_msgs_per_minute,
+                timezone=timezone,
+            )
+        rules = server_settings.get(server_id)
+        embed = discord.Embed(title="⚙️ Настройки начисления", color=discord.Color.blurple())
+        for name in rules.FIELDS:
+            value = getattr(rules, name)
+            embed.add_field(name=name, value=value if isinstance(value, str) else f"{value:g}", inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="export", description="Выгрузить историю активности сервера файлами")
+    @app_commands.describe(
+        kind="daily — дневные итоги участников, logs — лог событий",
+        start="Первый день, YYYY-MM-DD",
+        end="Последний день включительно, YYYY-MM-DD (по умолчанию сегодня)",
+        fmt="Формат файлов",
+    )
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @metrics.instrumented("command")
+    async def export(
+        self,
+        interaction: discord.Interaction,
+        start: str,
+        end: Optional[str] = None,
+        kind: Literal["daily", "logs"] = "daily",
+        fmt: Literal["csv", "jsonl"] = "csv",
+    ):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        guild = interaction.guild
+        try:
+            first = date.fromisoformat(start)
+            last = date.fromisoformat(end) if end else server_settings.get(guild.id).today()
+        except ValueError:
+            await interaction.followup.send("Даты — в формате YYYY-MM-DD", ephemeral=True)
+            return
+        if first > last:
+            await interaction.followup.send("Первый день позже последнего", ephemeral=True)
+            return
+        if self._export_slots.locked():
+            await interaction.followup.send("Уже идёт другая выгрузка, дождись её окончания", ephemeral=True)
+            return
+
+        async with self._export_slots:
+            with tempfile.TemporaryDirectory(prefix="playpal-export-") as directory:
+                try:
+                    paths, rows = await export_activity(
+                        guild.id, kind, first, last, fmt, directory,
+                        chunk_bytes=guild.filesize_limit - EXPORT_PART_MARGIN, max_parts=EXPORT_MAX_FILES,
+                    )
+                except ExportTooLarge:
+                    await interaction.followup.send(
+                        f"Выгрузка больше {EXPORT_MAX_FILES} файлов — сократи период или используй python -m database.export",
+                        ephemeral=True,
+                    )
+                    return
+                await interaction.followup.send(f"Выгружено строк: {rows}, файлов: {len(paths)}", ephemeral=True)
+                # не больше 10 вложений в одном сообщении
+                for i in range(0, len(paths), 10):
+                    files = [discord.File(path, filename=os.path.basename(path)) for path in paths[i:i + 10]]
+                    await interaction.followup.send(files=files, ephemeral=True)
 
     @staticmethod
-    async def generate_leaderboard_embed(bot, server_id: int, scope: str):
-        conn = get_connection()
-        cur = conn.cursor()
-        if scope == "streak":
-            cur.execute("""
-                SELECT user_id, streak, points
-                FROM user_activity_totals
-                WHERE server_id = %s
-                ORDER BY streak DESC
-                LIMIT 10
-            """, (server_id,))
-        elif scope == "points":
-            cur.execute("""
-                SELECT user_id, points, streak
-                FROM users
-                WHERE server_id = %s
-                ORDER BY points DESC
-                LIMIT 10
-            """, (server_id,))
-        rows = cur.fetchall()
-        conn.close()
+    async def generate_leaderboard_embed(bot, server_id: int, scope: str, page: int = 0):
+        board = await leaderboards.get(server_id, scope)
+        offset = page * LeaderboardView.PAGE_SIZE
+        rows = board.page(offset, LeaderboardView.PAGE_SIZE)
+        names = await user_resolver.display_names(bot, bot.get_guild(server_id), [row[0] for row in rows])
 
         embed = discord.Embed(title=f"🏆 Лидерборд сервера ({scope})", color=discord.Color.gold())
-        for i, row in enumerate(rows, start=1):
-            user = await bot.fetch_user(row[0])
-            streak, points = (row[1], row[2]) if scope == "streak" else (row[2], row[1])
-            embed.add_field(name=f"{i}. {user.display_name}", value=f"Стрик: {streak} — Поинты: {points:.2f}", inline=False)
-        return embed
\ No newline at end of file
+        label = {"week": "Активность за неделю", "month": "Активность за месяц"}.get(scope, "Поинты")
+        for i, (user_id, streak, points) in enumerate(rows, start=offset + 1):
+            embed.add_field(name=f"{i}. {names[user_id]}", value=f"Стрик: {streak} — {label}: {points:.2f}", inline=False)
+        pages = max(1, -(-len(board) // LeaderboardView.PAGE_SIZE))
+        embed.set_footer(text=f"Страница {page + 1} из {pages}")
+        return embed
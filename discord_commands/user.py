@@ -1,7 +1,10 @@
 import discord
 from discord.ext import commands
 from discord import app_commands, ui
-from database.db import get_connection
+from database import queries
+from utils import metrics
+from utils.leaderboard import leaderboards
+from utils.profile_cache import profile_cache
 
 
 class ShopView(ui.View):
@@ -29,18 +32,13 @@ class User(commands.Cog):
 
     # --- ПРОФИЛЬ ---
     @app_commands.command(name="me", description="Показать твой профиль")
+    @metrics.instrumented("command", "me")
     async def profile(self, interaction: discord.Interaction):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT u.points, COALESCE(t.streak, 0), COALESCE(t.xp, 0)
-            FROM users u
-            LEFT JOIN user_activity_totals t
-                ON u.user_id = t.user_id AND u.server_id = t.server_id
-            WHERE u.user_id = %s AND u.server_id = %s
-        """, (interaction.user.id, interaction.guild.id))
-        row = cur.fetchone()
-        conn.close()
+        await interaction.response.defer()
+        # профиль и место берутся из кэшей, которые обновляются при начислении
+        row = await profile_cache.get(interaction.user.id, interaction.guild.id)
+        board = await leaderboards.get(interaction.guild.id, "points")
+        rank = board.rank(interaction.user.id)
 
         points = row[0] if row else 0
         streak = row[1] if row else 0
@@ -54,11 +52,20 @@ class User(commands.Cog):
         embed.add_field(name="🔥 Стрик", value=str(streak), inline=True)
         embed.add_field(name="💰 Поинты", value=str(points), inline=True)
         embed.add_field(name="⭐ Опыт", value=str(xp), inline=True)
+        activity = self.bot.get_cog("Activity")
+        if activity is not None:
+            curve = activity.levels.curve(interaction.guild.id)
+            level = curve.level(xp)
+            progress = f"{level}" if level >= curve.max_level else f"{level} (до {level + 1}: {curve.xp_for(level + 1) - xp:g} XP)"
+            embed.add_field(name="📈 Уровень", value=progress, inline=True)
+        if rank is not None:
+            embed.add_field(name="🏆 Место", value=f"{rank} из {board.total}", inline=True)
 
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     # --- МАГАЗИН ---
     @app_commands.command(name="shop", description="Открыть магазин")
+    @metrics.instrumented("command", "shop")
     async def shop(self, interaction: discord.Interaction):
         items = [
             {"name": "Роль VIP", "price": 100},
@@ -93,19 +100,10 @@ class User(commands.Cog):
 
     # --- АЧИВКИ ---
     @app_commands.command(name="achievements", description="Показать твои ачивки")
+    @metrics.instrumented("command", "achievements")
     async def achievements(self, interaction: discord.Interaction):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT a.name, a.description, ua.date_unlocked
-            FROM achievements a
-            LEFT JOIN user_achievements ua
-                ON a.achievement_id = ua.achievement_id
-                AND ua.user_id = %s
-                AND ua.server_id = %s
-        """, (interaction.user.id, interaction.guild.id))
-        rows = cur.fetchall()
-        conn.close()
+        await interaction.response.defer()
+        rows = await queries.fetch_achievements(interaction.user.id, interaction.guild.id)
 
         embed = discord.Embed(
             title=f"🏆 Ачивки {interaction.user.display_name}",
@@ -123,7 +121,7 @@ class User(commands.Cog):
                     inline=False
                 )
 
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
 
 async def setup(bot):
@@ -1,9 +1,21 @@
+import asyncio
 import logging
+import signal
+import time
 from discord.ext import commands
 import discord
 
-from utils.logger import setup_logger
-from database.db import init_db, get_connection
+from utils.logger import setup_logger, shutdown_logger
+from database.db import init_db, open_pool, close_pool, pool_stats
+from database import queries
+from database.activity_log import activity_log_writer, maintain_partitions
+from utils import metrics
+from utils.loop_monitor import loop_monitor
+from utils.leaderboard import leaderboards
+from utils.profile_cache import profile_cache
+from utils.user_resolver import user_resolver
+from utils.sharding import parse_shard_ids
+from api.endpoints import start_http_server
 from discord_commands import activity, user
 
 # Загружаем токен (лучше через .env)
@@ -11,6 +23,17 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
+# Сколько серверов синхронизировать с базой одновременно
+MEMBER_SYNC_CONCURRENCY = int(os.getenv("MEMBER_SYNC_CONCURRENCY", "4"))
+# Локальный HTTP для /metrics; METRICS_PORT=0 — не поднимать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Шардинг: SHARD_COUNT — всего шардов ("auto" — сколько советует Discord, 0 — без шардинга),
+# SHARD_IDS — какие шарды ведёт этот процесс ("0-3" или "0,2"; пусто — все). Обычно их задаёт supervisor.py
+SHARD_COUNT = os.getenv("SHARD_COUNT", "0")
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS", ""))
+# Глобальные слеш-команды синхронизирует только процесс с шардом 0, а не каждый
+IS_PRIMARY = not SHARD_IDS or 0 in SHARD_IDS
 
 # Логгер
 logger = setup_logger()
@@ -21,81 +44,167 @@ intents.message_content = True
 intents.members = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# Инициализация базы
-init_db()
+if SHARD_COUNT == "auto":
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents)
+elif int(SHARD_COUNT) > 0:
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents, shard_count=int(SHARD_COUNT), shard_ids=SHARD_IDS or None,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Подключаем команды
 async def load_extensions():
     await bot.add_cog(activity.Activity(bot))
     await bot.add_cog(user.User(bot))
 
+# --------------------------------------
+# Синхронизация участников
+# --------------------------------------
+async def sync_guild(guild, semaphore: asyncio.Semaphore) -> int:
+    async with semaphore:
+        started = time.perf_counter()
+        member_ids = [member.id for member in guild.members if not member.bot]
+        inserted = await queries.sync_guild_members(guild.id, guild.name, member_ids)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Синхронизация {guild.name}: {len(member_ids)} участников, новых {inserted}, "
+            f"{elapsed:.2f} с ({len(member_ids) / max(elapsed, 1e-6):.0f} строк/с)"
+        )
+        return len(member_ids)
+
+async def sync_guilds(guilds):
+    semaphore = asyncio.Semaphore(MEMBER_SYNC_CONCURRENCY)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(sync_guild(guild, semaphore) for guild in guilds), return_exceptions=True)
+    total = 0
+    for guild, result in zip(guilds, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Не удалось синхронизировать {guild.name}: {result!r}")
+        else:
+            total += result
+    elapsed = time.perf_counter() - started
+    logger.info(f"Синхронизировано серверов: {len(guilds)}, участников: {total}, {total / max(elapsed, 1e-6):.0f} строк/с")
+
 @bot.event
+@metrics.instrumented("listener")
 async def on_ready():
-    for guild in bot.guilds:
-        # Добавляем сервер
-        conn = get_connection()
-        cur = conn.cursor()
-        # Добавляем сервер
-        cur.execute("""
-            INSERT INTO servers(server_id, name, created_at)
-            VALUES (%s, %s, NOW())
-            ON CONFLICT(server_id) DO NOTHING
-        """, (guild.id, guild.name))
-
-        # Добавляем пользователей
-        for member in guild.members:
-            if not member.bot:
-                cur.execute("""
-                    INSERT INTO users(user_id, server_id, join_date)
-                    VALUES (%s, %s, NOW())
-                    ON CONFLICT(user_id, server_id) DO NOTHING
-                """, (member.id, guild.id))
-        conn.commit()
-        conn.close()
-    await bot.tree.sync()
-    logger.info(f"Бот запущен как {bot.user}")
+    # Добавляем серверы и пользователей
+    await sync_guilds(bot.guilds)
+    if IS_PRIMARY:
+        await bot.tree.sync()
+    shards = f", шарды {SHARD_IDS or 'все'} из {bot.shard_count}" if bot.shard_count else ""
+    logger.info(f"Бот запущен как {bot.user}: серверов {len(bot.guilds)}{shards}")
 
 @bot.event
+@metrics.instrumented("listener")
 async def on_member_join(member):
     if member.bot:
         return
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-            INSERT INTO users(user_id, server_id, join_date)
-        VALUES (%s, %s, NOW())
-        ON CONFLICT(user_id, server_id) DO NOTHING
-    """, (member.id, member.guild.id))
-    conn.commit()
-    conn.close()
+    await queries.add_user(member.id, member.guild.id)
 
 @bot.event
+@metrics.instrumented("listener")
 async def on_guild_join(guild):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-            INSERT INTO servers(server_id, name, created_at)
-            VALUES (%s, %s, NOW())
-            ON CONFLICT(server_id) DO NOTHING
-        """, (guild.id, guild.name))
-    for member in guild.members:
-        if not member.bot:
-            cur.execute("""
-                INSERT INTO users(user_id, server_id, join_date)
-                VALUES (%s, %s, NOW())
-                ON CONFLICT(user_id, server_id) DO NOTHING
-            """, (member.id, guild.id))
-    conn.commit()
-    conn.close()
+    await sync_guilds([guild])
+
+# --------------------------------------
+# Метрики состояния (снимаются при каждом скрейпе)
+# --------------------------------------
+def _activity_cog():
+    return bot.get_cog("Activity")
+
+def register_gauges():
+    metrics.gauge(
+        "playpal_db_pool", "Статистика пула соединений psycopg_pool", ("stat",),
+        callback=lambda: {(name,): value for name, value in pool_stats().items()},
+    )
+    metrics.gauge(
+        "playpal_activity_buffer_pending", "Активность, ещё не применённая к базе", ("unit",),
+        callback=lambda: {
+            ("events",): cog.buffer.pending_events, ("unsynced",): cog.buffer.journal.pending_records,
+        } if (cog := _activity_cog()) else {},
+    )
+    metrics.gauge(
+        "playpal_achievements_unlocked", "Выдано ачивок с момента запуска",
+        callback=lambda: cog.achievements.unlocked if (cog := _activity_cog()) else None,
+    )
+    metrics.gauge(
+        "playpal_role_sync", "Очередь и итоги выдачи ролей за активность", ("stat",),
+        callback=lambda: {
+            ("queued",): cog.roles.queue_depth, ("applied",): cog.roles.applied, ("errors",): cog.roles.errors,
+        } if (cog := _activity_cog()) else {},
+    )
+    metrics.gauge(
+        "playpal_level_ups", "Повышений уровня с момента запуска",
+        callback=lambda: cog.levels.level_ups if (cog := _activity_cog()) else None,
+    )
+    metrics.gauge(
+        "playpal_voice_sessions", "Активные голосовые сессии",
+        callback=lambda: len(cog.voice_sessions) if (cog := _activity_cog()) else None,
+    )
+    metrics.gauge(
+        "playpal_activity_log_queue_depth", "Логи активности в очереди на запись",
+        callback=lambda: activity_log_writer.queue_depth,
+    )
+    metrics.gauge(
+        "playpal_activity_log_events", "Логи активности: записано, отброшено, отсеяно сэмплированием", ("state",),
+        callback=lambda: {
+            ("written",): activity_log_writer.written,
+            ("dropped",): activity_log_writer.dropped,
+            ("sampled_out",): activity_log_writer.sampled_out,
+        },
+    )
+    metrics.gauge(
+        "playpal_cache", "Попадания/промахи и размер кэшей", ("cache", "stat"),
+        callback=lambda: {
+            **{("profile", name): value for name, value in profile_cache.stats().items()},
+            **{("user_resolver", name): value for name, value in user_resolver.stats().items()},
+            ("leaderboard", "hits"): leaderboards.hits,
+            ("leaderboard", "misses"): leaderboards.misses,
+        },
+    )
+    metrics.gauge(
+        "playpal_gateway_latency_seconds", "Задержка heartbeat гейтвея Discord по шардам", ("shard",),
+        callback=lambda: {
+            (shard_id,): latency for shard_id, latency in getattr(bot, "latencies", [(bot.shard_id or 0, bot.latency)])
+        },
+    )
+    metrics.gauge(
+        "playpal_event_loop_lag_ms", "Лаг event loop (LoopLagMonitor)", ("stat",),
+        callback=lambda: {(name,): value for name, value in loop_monitor.stats().items()},
+    )
 
 
 async def main():
-    async with bot:
-        await load_extensions()
-        await bot.start(TOKEN)
+    # Общий пул соединений и инициализация базы
+    await open_pool()
+    # Следим, не блокирует ли что-то event loop
+    loop_monitor.start()
+    register_gauges()
+    metrics_runner = await start_http_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        await init_db()
+        # партиции activity_logs должны существовать до первой записи логов
+        await maintain_partitions()
+        activity_log_writer.start()
+        async with bot:
+            # SIGTERM/SIGINT закрывают бота штатно: коги успевают сбросить буферы в базу
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(sig, lambda: asyncio.create_task(bot.close()))
+                except NotImplementedError:  # Windows
+                    pass
+            await load_extensions()
+            await bot.start(TOKEN)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await activity_log_writer.stop()
+        loop_monitor.stop()
+        await close_pool()
+        shutdown_logger()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Запуск бота несколькими процессами: каждый ведёт свой диапазон шардов
+(SHARD_COUNT/SHARD_IDS для main.py), упавший процесс перезапускается.
+
+Пример:
+    python supervisor.py --processes 4 --shards 16
+    python supervisor.py --processes 4 --shards auto
+
+Каждому процессу выдаётся свой METRICS_PORT (--metrics-port + номер процесса).
+Пулы соединений у процессов свои: DB_POOL_MAX_SIZE * processes не должен превышать max_connections.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+from utils.sharding import format_shard_ids, split_shards
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | supervisor | %(levelname)s | %(message)s")
+logger = logging.getLogger("PlayPal.supervisor")
+
+# Discord разрешает один IDENTIFY на бакет раз в 5 секунд
+IDENTIFY_INTERVAL = 5.0
+RESTART_BACKOFF_MAX = 60.0
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def gateway_info(token: str) -> dict:
+    """GET /gateway/bot: рекомендуемое число шардов и max_concurrency для IDENTIFY."""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "PlayPal supervisor"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+class ShardProcess:
+    def __init__(self, index: int, shard_ids, shard_count: int, env: dict):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.env = {**env, "SHARD_COUNT": str(shard_count), "SHARD_IDS": format_shard_ids(shard_ids)}
+        self.process: asyncio.subprocess.Process | None = None
+
+    async def run(self, stopping: asyncio.Event, start_delay: float):
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=start_delay)
+        except asyncio.TimeoutError:
+            pass
+        backoff = 1.0
+        while not stopping.is_set():
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=self.env)
+            logger.info(f"Процесс {self.index} (шарды {format_shard_ids(self.shard_ids)}) запущен, pid {self.process.pid}")
+            code = await self.process.wait()
+            if stopping.is_set():
+                break
+            # долго проработавший процесс перезапускаем сразу, падающий на старте — с растущей паузой
+            backoff = 1.0 if time.monotonic() - started > RESTART_BACKOFF_MAX else min(backoff * 2, RESTART_BACKOFF_MAX)
+            logger.warning(f"Процесс {self.index} завершился с кодом {code}, перезапуск через {backoff:.0f} с")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+
+    def terminate(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signal.SIGTERM)
+
+
+async def supervise(args):
+    token = os.getenv("DISCORD_TOKEN")
+    max_concurrency = 1
+    if args.shards == "auto":
+        info = gateway_info(token)
+        shard_count = info["shards"]
+        max_concurrency = info.get("session_start_limit", {}).get("max_concurrency", 1)
+    else:
+        shard_count = int(args.shards)
+    ranges = split_shards(shard_count, args.processes)
+    logger.info(f"Шардов: {shard_count}, процессов: {len(ranges)}")
+
+    env = dict(os.environ)
+    processes = []
+    for index, shard_ids in enumerate(ranges):
+        process_env = {**env, "METRICS_PORT": str(args.metrics_port + index) if args.metrics_port else "0"}
+        processes.append(ShardProcess(index, shard_ids, shard_count, process_env))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def stop():
+        stopping.set()
+        for process in processes:
+            process.terminate()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except NotImplementedError:  # Windows
+            pass
+
+    # процессы стартуют по очереди, чтобы их IDENTIFY не упирались в общий лимит
+    delay, tasks = 0.0, []
+    for process in processes:
+        tasks.append(asyncio.create_task(process.run(stopping, delay)))
+        delay += len(process.shard_ids) * IDENTIFY_INTERVAL / max_concurrency
+    await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск PlayPal несколькими процессами по шардам")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", default="auto", help="всего шардов или auto (рекомендация Discord)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "9100")),
+                        help="порт /metrics первого процесса; следующие получают +1, +2…; 0 — не поднимать")
+    args = parser.parse_args()
+    asyncio.run(supervise(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import pytest
+
+from database import activity_buffer, queries
+from utils.journal import CAN_LOCK, Journal
+
+DAY = "2026-10-18"
+
+
+class FakeOffsets:
+    """journal_offsets и credit_activity в памяти: та же проверка позиции, что в credit_journal_batch."""
+
+    def __init__(self):
+        self.positions = {}
+        self.credited = []
+        self.down = False
+
+    async def fetch_journal_position(self, journal_id):
+        return self.positions.get(journal_id, (0, 0))
+
+    async def credit_journal_batch(self, journal_id, start, end, rows, daily_max_points, currency_ratio):
+        if self.down:
+            raise ConnectionError("база недоступна")
+        if self.positions.get(journal_id, (0, 0)) != tuple(start):
+            return None
+        self.positions[journal_id] = tuple(end)
+        self.credited.extend(rows)
+        return list(rows)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeOffsets()
+    monkeypatch.setattr(queries, "fetch_journal_position", fake.fetch_journal_position)
+    monkeypatch.setattr(queries, "credit_journal_batch", fake.credit_journal_batch)
+    return fake
+
+
+def _buffer(tmp_path, journal_id="me", **kwargs):
+    return activity_buffer.ActivityBuffer(50, 1.0, journal_dir=str(tmp_path), journal_id=journal_id, **kwargs)
+
+
+def test_flush_sums_events_per_day(tmp_path, db):
+    async def scenario():
+        buffer = _buffer(tmp_path, flush_interval=3600)
+        seen = []
+        buffer.add_listener(seen.append)
+        await buffer.start()
+        await buffer.add(1, 10, DAY, msg_inc=1, activity_points=0.5, xp=5)
+        await buffer.add(1, 10, DAY, msg_inc=1, activity_points=0.5, xp=5)
+        await buffer.add(2, 10, DAY, voice_minutes_inc=3)
+        await buffer.flush()
+        assert sorted(db.credited) == [(1, 10, DAY, 2, 0, 1.0, 10), (2, 10, DAY, 0, 3, 0.0, 0.0)]
+        assert buffer.pending_events == 0 and len(seen) == 1
+        await buffer.stop()
+        assert os.listdir(os.path.join(tmp_path, "me")) == [".lock"] or not CAN_LOCK
+    asyncio.run(scenario())
+
+
+def test_write_through_survives_outage(tmp_path, db):
+    async def scenario():
+        buffer = _buffer(tmp_path, flush_interval=0)
+        await buffer.start()
+        db.down = True
+        await buffer.add(1, 10, DAY, msg_inc=1)  # не бросает в on_message
+        assert buffer.pending_events == 1 and not db.credited
+        db.down = False
+        await buffer.add(1, 10, DAY, msg_inc=1)
+        assert db.credited == [(1, 10, DAY, 2, 0, 0.0, 0.0)]
+        await buffer.stop()
+    asyncio.run(scenario())
+
+
+def test_restart_replays_without_double_credit(tmp_path, db):
+    async def scenario():
+        buffer = _buffer(tmp_path, flush_interval=3600)
+        await buffer.start()
+        await buffer.add(1, 10, DAY, msg_inc=1)
+        await buffer.flush()
+        db.down = True
+        await buffer.add(1, 10, DAY, msg_inc=1)
+        with pytest.raises(ConnectionError):
+            await buffer.stop()
+        db.down = False
+
+        restarted = _buffer(tmp_path, flush_interval=3600)
+        await restarted.start()
+        await restarted.flush()
+        assert db.credited == [(1, 10, DAY, 1, 0, 0.0, 0.0), (1, 10, DAY, 1, 0, 0.0, 0.0)]
+        await restarted.stop()
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not CAN_LOCK, reason="нет flock")
+def test_adopts_abandoned_journals_only(tmp_path, db):
+    async def scenario():
+        old = Journal(os.path.join(tmp_path, "oldhost-all"), fsync=False)
+        old.open(min_segment=1)
+        for _ in range(3):
+            old.append((1, 10, DAY, 1, 0, 0.0, 0.0))
+        await old.sync()
+        await old.close()
+        old.unlock()
+
+        live = Journal(os.path.join(tmp_path, "otherhost-all"), fsync=False)
+        live.open(min_segment=1)
+        live.append((2, 10, DAY, 1, 0, 0.0, 0.0))
+        await live.sync()
+
+        buffer = _buffer(tmp_path, flush_interval=3600)
+        await buffer.start()
+        assert await buffer.adopt_orphans() == 3
+        assert db.credited == [(1, 10, DAY, 3, 0, 0.0, 0.0)]
+        assert sorted(os.listdir(tmp_path)) == ["me", "otherhost-all"]
+        await buffer.stop()
+        await live.close()
+        live.unlock()
+    asyncio.run(scenario())
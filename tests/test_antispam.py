@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from utils.antispam import ANTISPAM_DUPLICATE_WINDOW, MessageGate
+
+
+def _rules(min_msg_length=0, msg_cooldown=0, max_msgs_per_minute=0):
+    return SimpleNamespace(min_msg_length=min_msg_length, msg_cooldown=msg_cooldown,
+                           max_msgs_per_minute=max_msgs_per_minute)
+
+
+def test_too_short():
+    gate = MessageGate()
+    assert not gate.allow(1, 10, "  hi ", _rules(min_msg_length=3), now=100)
+    assert gate.allow(1, 10, "hello", _rules(min_msg_length=3), now=100)
+    assert gate.dropped == {"too_short": 1}
+
+
+def test_cooldown():
+    gate = MessageGate()
+    rules = _rules(msg_cooldown=5)
+    assert gate.allow(1, 10, "one", rules, now=100)
+    assert not gate.allow(1, 10, "two", rules, now=103)
+    assert gate.allow(1, 10, "three", rules, now=105)
+    # кулдаун у каждого участника свой
+    assert gate.allow(2, 10, "four", rules, now=103)
+
+
+def test_token_bucket_refills():
+    gate = MessageGate()
+    rules = _rules(max_msgs_per_minute=2)
+    assert gate.allow(1, 10, "a", rules, now=100)
+    assert gate.allow(1, 10, "b", rules, now=100.1)
+    assert not gate.allow(1, 10, "c", rules, now=100.2)
+    # за 30 секунд восстанавливается один токен
+    assert gate.allow(1, 10, "d", rules, now=130.2)
+    assert gate.dropped == {"rate_limited": 1}
+
+
+def test_duplicate_within_window():
+    gate = MessageGate()
+    rules = _rules()
+    assert gate.allow(1, 10, "Same   text", rules, now=100)
+    assert not gate.allow(1, 10, "same text", rules, now=101)
+    assert gate.allow(1, 10, "same text", rules, now=101 + ANTISPAM_DUPLICATE_WINDOW)
+
+
+def test_empty_content_is_not_a_duplicate():
+    # вложения и стикеры без текста
+    gate = MessageGate()
+    rules = _rules()
+    assert gate.allow(1, 10, "", rules, now=100)
+    assert gate.allow(1, 10, "   ", rules, now=101)
+    assert gate.allow(1, 10, "", rules, now=102)
+    assert "duplicate" not in gate.dropped
+
+
+def test_forget_guild_and_lru_bound():
+    gate = MessageGate(max_users=2)
+    rules = _rules(msg_cooldown=60)
+    assert gate.allow(1, 10, "a", rules, now=100)
+    assert gate.allow(2, 10, "a", rules, now=100)
+    assert gate.allow(3, 20, "a", rules, now=100)
+    # участник 1 вытеснен из памяти — кулдаун для него забыт
+    assert gate.allow(1, 10, "b", rules, now=101)
+    gate.forget_guild(10)
+    assert gate.allow(3, 20, "c", rules, now=101) is False
+    assert all(key[0] != 10 for key in gate._users)
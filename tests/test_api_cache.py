@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+from api.endpoints import ResponseCache
+
+
+def test_hit_after_miss_keeps_etag():
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            return {"value": 1}
+
+        first = await cache.get("/a", produce)
+        second = await cache.get("/a", produce)
+        assert second is first and len(calls) == 1
+        assert json.loads(first.body) == {"value": 1}
+    asyncio.run(scenario())
+
+
+def test_refresh_with_same_body_keeps_etag():
+    async def scenario():
+        cache = ResponseCache(ttl=0)
+
+        async def produce():
+            return {"value": 1}
+
+        first = await cache.get("/a", produce)
+        etag, last_modified = first.etag, first.last_modified
+        second = await cache.get("/a", produce)
+        assert (second.etag, second.last_modified) == (etag, last_modified)
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_coalesce():
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": len(calls)}
+
+        items = await asyncio.gather(*(cache.get("/a", produce) for _ in range(20)))
+        assert len(calls) == 1
+        assert all(item is items[0] for item in items)
+        assert not cache._locks
+    asyncio.run(scenario())
+
+
+def test_lock_survives_while_waiters_queue():
+    # первый промах падает, пока второй ждёт замок; третий, пришедший в этот момент,
+    # должен встать в очередь за вторым, а не пойти в базу параллельно с ним
+    async def scenario():
+        cache = ResponseCache(ttl=60)
+        active = 0
+        peak = 0
+        calls = 0
+
+        async def produce():
+            nonlocal active, peak, calls
+            calls += 1
+            failing = calls == 1
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            if failing:
+                raise RuntimeError("база недоступна")
+            return {"ok": True}
+
+        async def first():
+            try:
+                await cache.get("/a", produce)
+            except RuntimeError:
+                pass
+            # сразу после падения первого, до того как второй успел проснуться
+            return await cache.get("/a", produce)
+
+        results = await asyncio.gather(first(), cache.get("/a", produce))
+        assert peak == 1
+        assert calls == 2
+        assert results[0] is results[1]
+        assert not cache._locks
+    asyncio.run(scenario())
+
+
+def test_lru_bound():
+    async def scenario():
+        cache = ResponseCache(ttl=60, max_size=2)
+
+        async def produce():
+            return {}
+
+        for key in ("/a", "/b", "/c"):
+            await cache.get(key, produce)
+        assert list(cache._items) == ["/b", "/c"]
+    asyncio.run(scenario())
@@ -0,0 +1,11 @@
+import importlib
+
+import pytest
+
+COGS = ("discord_commands.activity", "discord_commands.user")
+
+
+@pytest.mark.parametrize("module", COGS)
+def test_cog_module_imports(module):
+    # декораторы app_commands проверяют аннотации при определении класса
+    importlib.import_module(module)
@@ -0,0 +1,71 @@
+import csv
+import gzip
+import json
+import os
+import random
+from datetime import date
+
+import pytest
+
+from database.export import ExportTooLarge, _ChunkWriter
+
+COLUMNS = ("user_id", "day", "context")
+
+
+def _rows(count, seed=0):
+    rng = random.Random(seed)
+    # текст с переводами строк и кавычками: CSV должен пережить его без порчи
+    return [
+        (i, date(2026, 10, 1 + i % 28), "".join(rng.choice("ab \"\n,ёж") for _ in range(40)))
+        for i in range(count)
+    ]
+
+
+def _read_csv(path):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_csv_roundtrip_and_split(tmp_path):
+    rows = _rows(3000)
+    writer = _ChunkWriter(str(tmp_path), "daily_1", "csv", COLUMNS, chunk_bytes=4096, max_parts=None)
+    for start in range(0, len(rows), 100):
+        writer.write(rows[start:start + 100])
+    writer.close()
+
+    assert len(writer.paths) > 1 and writer.rows == len(rows)
+    read = []
+    for path in writer.paths:
+        header, *body = _read_csv(path)
+        assert tuple(header) == COLUMNS
+        read.extend(body)
+    assert read == [[str(user_id), str(day), context] for user_id, day, context in rows]
+    # режется по сжатому размеру: превышение — не больше одной пачки
+    assert all(os.path.getsize(p) < 4096 * 4 for p in writer.paths)
+
+
+def test_jsonl(tmp_path):
+    rows = _rows(10)
+    writer = _ChunkWriter(str(tmp_path), "logs_1", "jsonl", COLUMNS, chunk_bytes=1 << 20, max_parts=None)
+    writer.write(rows)
+    writer.close()
+    with gzip.open(writer.paths[0], "rt", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f]
+    assert items[0] == {"user_id": 0, "day": "2026-10-01", "context": rows[0][2]}
+    assert len(items) == 10
+
+
+def test_empty_export_has_header(tmp_path):
+    writer = _ChunkWriter(str(tmp_path), "daily_1", "csv", COLUMNS, chunk_bytes=1024, max_parts=None)
+    writer.close()
+    assert len(writer.paths) == 1
+    assert _read_csv(writer.paths[0]) == [list(COLUMNS)]
+
+
+def test_max_parts(tmp_path):
+    writer = _ChunkWriter(str(tmp_path), "daily_1", "csv", COLUMNS, chunk_bytes=64, max_parts=2)
+    with pytest.raises(ExportTooLarge):
+        for start in range(0, 1000, 50):
+            writer.write(_rows(50, seed=start))
+    writer.close()
+    assert len(writer.paths) == 2
@@ -0,0 +1,124 @@
+import asyncio
+import os
+
+import pytest
+
+from utils.journal import CAN_LOCK, Journal, _decode, _encode
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _write(journal: Journal, records):
+    for record in records:
+        journal.append(record)
+    await journal.sync()
+
+
+def test_encode_decode_roundtrip():
+    line = _encode([1, 2, "2026-10-18", 1, 0, 0.5, 5.0])
+    assert _decode(line) == [1, 2, "2026-10-18", 1, 0, 0.5, 5.0]
+
+
+def test_decode_rejects_bad_crc_and_torn_line():
+    line = _encode([1, 2, 3])
+    assert _decode(line.replace(b"[1", b"[7")) is None
+    assert _decode(line[:-1]) is None
+    assert _decode(b"garbage\n") is None
+
+
+def test_read_returns_synced_records_and_position(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open(min_segment=1)
+        await _write(journal, [[i] for i in range(5)])
+        journal.append([99])  # ещё не на диске
+        records, end = await journal.read((0, 0), 3)
+        assert records == [[0], [1], [2]]
+        rest, tail = await journal.read(end, 100)
+        assert rest == [[3], [4]]
+        assert tail == journal.durable_position
+        await journal.close()
+    _run(scenario())
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open()
+        await _write(journal, [[1], [2]])
+        await journal.close()
+        journal.unlock()
+        # оборванная при падении запись в конце сегмента
+        with open(os.path.join(tmp_path, f"{journal.segments()[-1]:016d}.seg"), "ab") as f:
+            f.write(_encode([3])[:-4])
+
+        reader = Journal(str(tmp_path))
+        records, end = await reader.read((0, 0), 100)
+        assert records == [[1], [2]]
+        assert end[1] == os.path.getsize(os.path.join(tmp_path, f"{end[0]:016d}.seg"))
+    _run(scenario())
+
+
+def test_segment_rollover_and_release(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), segment_bytes=64, fsync=False)
+        journal.open(min_segment=1)
+        for i in range(6):
+            await _write(journal, [["record", i]])
+        assert len(journal.segments()) > 1
+        records, end = await journal.read((0, 0), 100)
+        assert records == [["record", i] for i in range(6)]
+
+        # открытый на запись сегмент не удаляется, даже если прочитан
+        journal.release(end)
+        assert journal.segments() == [journal.durable_position[0]]
+        await journal.close()
+        journal.release(end)
+        assert journal.segments() == []
+        journal.unlock()
+    _run(scenario())
+
+
+def test_new_segment_after_restart(tmp_path):
+    async def scenario():
+        journal = Journal(str(tmp_path), fsync=False)
+        journal.open(min_segment=5)
+        await _write(journal, [[1]])
+        await journal.close()
+        journal.unlock()
+        reopened = Journal(str(tmp_path), fsync=False)
+        reopened.open()
+        assert reopened.durable_position == (6, 0)
+        await reopened.close()
+        reopened.unlock()
+    _run(scenario())
+
+
+@pytest.mark.skipif(not CAN_LOCK, reason="нет flock")
+def test_lock_is_exclusive(tmp_path):
+    owner = Journal(str(tmp_path))
+    owner.open()
+    other = Journal(str(tmp_path))
+    assert not other.lock()
+    with pytest.raises(RuntimeError):
+        other.open()
+    owner.unlock()
+    assert other.lock()
+    other.unlock()
+
+
+def test_remove_if_empty(tmp_path):
+    async def scenario():
+        path = os.path.join(tmp_path, "orphan")
+        journal = Journal(path, fsync=False)
+        journal.open()
+        await _write(journal, [[1]])
+        await journal.close()
+        assert not journal.remove_if_empty()
+        records, end = await journal.read((0, 0), 10)
+        journal.release(end)
+        assert journal.remove_if_empty()
+        assert not os.path.exists(path)
+    _run(scenario())
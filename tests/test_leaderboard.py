@@ -0,0 +1,69 @@
+from datetime import date
+
+from utils.leaderboard import LeaderboardCache, ServerBoard, period_start
+
+
+def _board(scope="points", rows=(), size=100, start=None):
+    rows = list(rows)
+    return ServerBoard(scope, [(*row, len(rows)) for row in rows], start, size=size)
+
+
+def test_period_start():
+    day = date(2026, 10, 18)  # воскресенье
+    assert period_start("week", day) == date(2026, 10, 12)
+    assert period_start("month", day) == date(2026, 10, 1)
+    assert period_start("points", day) is None
+
+
+def test_ranking_and_paging():
+    board = _board(rows=[(1, 0, 5.0), (2, 3, 9.0), (3, 1, 7.0), (4, 0, 7.0)])
+    assert board.page(0, 2) == [(2, 3, 9.0), (3, 1, 7.0)]
+    # при равенстве выше меньший user_id
+    assert board.page(2, 10) == [(4, 0, 7.0), (1, 0, 5.0)]
+    assert [board.rank(u) for u in (2, 3, 4, 1)] == [1, 2, 3, 4]
+    assert board.rank(99) is None
+
+    streak = _board("streak", rows=[(1, 0, 5.0), (2, 3, 9.0), (3, 1, 7.0)])
+    assert [row[0] for row in streak.page(0, 10)] == [2, 3, 1]
+
+
+def test_update_moves_user():
+    board = _board(rows=[(1, 0, 5.0), (2, 0, 9.0)])
+    board.update(1, 0, 10.0)
+    assert board.rank(1) == 1 and board.rank(2) == 2
+    board.update(3, 0, 1.0)
+    assert len(board) == 3 and board.total == 3 and board.rank(3) == 3
+
+
+def test_capped_board_evicts_last():
+    board = ServerBoard("points", [(1, 0, 50.0, 10), (2, 0, 40.0, 10), (3, 0, 30.0, 10)], size=3)
+    # ниже последнего в топе — не попадает
+    board.update(9, 0, 10.0)
+    assert board.rank(9) is None and len(board) == 3
+    # обогнал последнего — вытесняет его
+    board.update(9, 0, 45.0)
+    assert board.page(0, 10) == [(1, 0, 50.0), (9, 0, 45.0), (2, 0, 40.0)]
+    assert board.rank(3) is None and 3 not in board.entries
+    assert board.total == 10
+
+
+def test_apply_credits_respects_period():
+    cache = LeaderboardCache()
+    day = date(2026, 10, 18)
+    week = _board("week", rows=[(1, 0, 1.0)], start=period_start("week", day))
+    points = _board("points", rows=[(1, 0, 1.0)])
+    cache._boards[(10, "week")] = week
+    cache._boards[(10, "points")] = points
+
+    # (user_id, server_id, currency, balance, streak, xp, messages, voice_minutes, день, неделя, месяц)
+    cache.apply_credits([(2, 10, 0, 20.0, 4, 0, 0, 0, day, 3.0, 3.0)])
+    assert points.page(0, 1) == [(2, 4, 20.0)]
+    assert week.page(0, 1) == [(2, 4, 3.0)]
+
+    # пачка за прошлую неделю не попадает в рейтинг текущей
+    cache.apply_credits([(3, 10, 0, 30.0, 1, 0, 0, 0, date(2026, 10, 11), 50.0, 50.0)])
+    assert week.rank(3) is None
+    assert points.rank(3) == 1
+
+    cache.invalidate(10)
+    assert not cache._boards
@@ -0,0 +1,25 @@
+from utils.levels import LevelCurve
+
+
+def test_thresholds_follow_curve():
+    curve = LevelCurve(base=100, exponent=1.5, max_level=10)
+    assert curve.xp_for(1) == 0
+    assert curve.xp_for(2) == 100
+    assert curve.xp_for(3) == round(100 * 2 ** 1.5)
+    assert len(curve.thresholds) == 9
+
+
+def test_level_is_inverse_of_xp_for():
+    curve = LevelCurve(base=50, exponent=2, max_level=30)
+    for level in range(1, 31):
+        xp = curve.xp_for(level)
+        assert curve.level(xp) == level
+        if level > 1:
+            assert curve.level(xp - 0.01) == level - 1
+
+
+def test_level_is_capped():
+    curve = LevelCurve(base=10, exponent=1, max_level=5)
+    assert curve.level(0) == 1
+    assert curve.level(10 ** 9) == 5
+    assert curve.xp_for(99) == curve.xp_for(5)
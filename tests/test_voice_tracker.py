@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+from database import queries
+from utils.voice_tracker import VoiceTracker, is_creditable
+
+
+def _guild(guild_id=10):
+    guild = SimpleNamespace(id=guild_id, afk_channel=None, members=[])
+    return guild
+
+
+def _member(guild, user_id, channel=None):
+    member = SimpleNamespace(id=user_id, bot=False, guild=guild, voice=None)
+    guild.members.append(member)
+    if channel is not None:
+        member.voice = _state(channel)
+        channel.members.append(member)
+    return member
+
+
+def _state(channel):
+    return SimpleNamespace(channel=channel, self_deaf=False, deaf=False, self_mute=False, mute=False)
+
+
+def test_leaving_member_counts_in_before_state():
+    guild = _guild()
+    channel = SimpleNamespace(id=1, members=[])
+    alice = _member(guild, 1, channel)
+    _member(guild, 2, channel)
+    before = alice.voice
+    # discord.py уже убрал участника из канала, когда пришло событие выхода
+    channel.members.remove(alice)
+    assert is_creditable(alice, before)
+
+
+def test_leave_settles_minutes_with_two_people():
+    guild = _guild()
+    channel = SimpleNamespace(id=1, members=[])
+    alice = _member(guild, 1, channel)
+    _member(guild, 2, channel)
+    tracker = VoiceTracker()
+    tracker.on_state_update(alice, _state(None), alice.voice, now=1000)
+    before = alice.voice
+    channel.members.remove(alice)
+    assert tracker.on_state_update(alice, before, _state(None), now=1000 + 5 * 60) == 5
+
+
+def test_rebuild_after_reconnect_keeps_live_rows(monkeypatch):
+    guild = _guild()
+    channel = SimpleNamespace(id=1, members=[])
+    alice = _member(guild, 1, channel)
+    _member(guild, 2)  # вышел, пока бот был офлайн
+
+    async def fetch_voice_sessions(server_ids):
+        # (user_id, server_id, channel_id, started_at, last_credited_at)
+        return [(1, 10, 1, 900.0, 900.0), (2, 10, 1, 900.0, 900.0)]
+
+    saved = {}
+
+    async def save_voice_sessions(upserts, deletes):
+        saved["upserts"], saved["deletes"] = upserts, deletes
+
+    monkeypatch.setattr(queries, "fetch_voice_sessions", fetch_voice_sessions)
+    monkeypatch.setattr(queries, "save_voice_sessions", save_voice_sessions)
+
+    async def scenario():
+        tracker = VoiceTracker()
+        tracker.on_state_update(alice, _state(None), alice.voice, now=1000)
+        await tracker.persist()
+        # повторный on_ready после реконнекта
+        await tracker.rebuild([guild], now=1100)
+        await tracker.persist()
+        assert saved["deletes"] == [(2, 10)]
+        assert len(tracker) == 1
+    asyncio.run(scenario())
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+
+from database import queries
+from utils import metrics
+
+logger = logging.getLogger("PlayPal")
+
+ACHIEVEMENT_FLUSH_INTERVAL = float(os.getenv("ACHIEVEMENT_FLUSH_INTERVAL", "2"))  # сек
+# Сколько пользователей держать с курсорами; вытесненные при следующем начислении проверяются заново
+ACHIEVEMENT_CURSOR_MAX = int(os.getenv("ACHIEVEMENT_CURSOR_MAX", "200000"))
+
+# метрика правила -> позиция в строке credit_activity (user_id, server_id, currency, balance, streak, xp, messages, voice_minutes)
+METRIC_COLUMNS = {"points": 3, "streak": 4, "xp": 5, "messages": 6, "voice_minutes": 7}
+METRICS = tuple(METRIC_COLUMNS)
+
+
+class AchievementEngine:
+    """
+    Выдача ачивок по результатам начисления.
+    Правила компилируются в отсортированные списки порогов по каждой метрике, а для
+    пользователя хранится курсор — индекс следующего недостигнутого порога. Поэтому
+    начисление проверяет одно сравнение на метрику, пока порог не пройден.
+    Новые ачивки пишутся пачками в фоне (unlock_achievements), xp_reward начисляется там же.
+    """
+
+    def __init__(self, flush_interval: float = ACHIEVEMENT_FLUSH_INTERVAL, max_cursors: int = ACHIEVEMENT_CURSOR_MAX):
+        self.flush_interval = flush_interval
+        self.max_cursors = max_cursors
+        self._thresholds = {metric: [] for metric in METRICS}  # metric -> отсортированные пороги
+        self._ids = {metric: [] for metric in METRICS}  # metric -> achievement_id в том же порядке
+        self._cursors = OrderedDict()  # (user_id, server_id) -> [индекс следующего порога по каждой метрике]
+        self._pending = []  # кандидаты (user_id, server_id, achievement_id)
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._listeners = []
+        self.unlocked = 0
+
+    def add_listener(self, callback):
+        """callback(unlocked) получает новые (user_id, server_id, achievement_id) после записи."""
+        self._listeners.append(callback)
+
+    async def load(self):
+        rules = {metric: [] for metric in METRICS}
+        for achievement_id, metric, threshold in await queries.fetch_achievement_rules():
+            if metric in rules:
+                rules[metric].append((threshold, achievement_id))
+        for metric, items in rules.items():
+            items.sort()
+            self._thresholds[metric] = [threshold for threshold, _ in items]
+            self._ids[metric] = [achievement_id for _, achievement_id in items]
+        # курсоры считались по старым порогам
+        self._cursors.clear()
+        logger.info(f"Правил ачивок загружено: {sum(len(v) for v in rules.values())}")
+
+    # --------------------------------------
+    # Проверка начислений
+    # --------------------------------------
+    def apply_credits(self, credited):
+        """Слушатель буфера активности: находит пройденные пороги и ставит их в очередь на запись."""
+        found = False
+        for row in credited:
+            key = (row[0], row[1])
+            cursor = self._cursors.get(key)
+            if cursor is None:
+                # пользователя видим впервые: кандидаты — все пройденные пороги,
+                # уже выданные отсеет ON CONFLICT DO NOTHING
+                cursor = [0] * len(METRICS)
+                self._cursors[key] = cursor
+                while len(self._cursors) > self.max_cursors:
+                    self._cursors.popitem(last=False)
+            else:
+                self._cursors.move_to_end(key)
+            for i, metric in enumerate(METRICS):
+                thresholds = self._thresholds[metric]
+                position = cursor[i]
+                if position >= len(thresholds):
+                    continue
+                value = row[METRIC_COLUMNS[metric]]
+                if value < thresholds[position]:
+                    continue
+                end = bisect_right(thresholds, value, lo=position)
+                ids = self._ids[metric]
+                self._pending.extend((row[0], row[1], ids[j]) for j in range(position, end))
+                cursor[i] = end
+                found = True
+        if found:
+            self._wake.set()
+
+    # --------------------------------------
+    # Фоновая запись
+    # --------------------------------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="achievement-engine")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return []
+        batch, self._pending = self._pending, []
+        try:
+            unlocked = await queries.unlock_achievements(batch)
+        except Exception:
+            # вернём кандидатов в очередь: вставка идемпотентна
+            self._pending = batch + self._pending
+            raise
+        self.unlocked += len(unlocked)
+        for callback in self._listeners:
+            try:
+                callback(unlocked)
+            except Exception:
+                logger.exception("Ошибка в обработчике выдачи ачивок")
+        return unlocked
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            # собираем кандидатов нескольких сбросов буфера в одну вставку
+            await asyncio.sleep(self.flush_interval)
+            self._wake.clear()
+            try:
+                with metrics.track("task", "achievement_unlock"):
+                    await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать ачивки, повторим позже")
+                self._wake.set()
+
+    async def backfill(self, server_id: int | None = None) -> int:
+        """Проверка всех существующих пользователей одним запросом (после добавления правил)."""
+        count = await queries.backfill_achievements(server_id)
+        self.unlocked += count
+        return count
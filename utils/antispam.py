@@ -0,0 +1,88 @@
+import os
+import time
+from collections import OrderedDict
+
+from utils import metrics
+
+# Повтор того же текста в пределах окна не засчитывается, сек; 0 = не проверять
+ANTISPAM_DUPLICATE_WINDOW = float(os.getenv("ANTISPAM_DUPLICATE_WINDOW", "60"))
+ANTISPAM_DUPLICATE_HISTORY = int(os.getenv("ANTISPAM_DUPLICATE_HISTORY", "3"))  # сколько последних текстов помнить
+ANTISPAM_MAX_USERS = int(os.getenv("ANTISPAM_MAX_USERS", "200000"))  # сколько участников держать в памяти
+
+MESSAGES = metrics.counter("playpal_messages", "Сообщения: засчитанные и отсеянные антиспамом", ("result",))
+
+
+class _UserState:
+    __slots__ = ("last_credit", "tokens", "refilled_at", "recent")
+
+    def __init__(self, now: float, tokens: float):
+        self.last_credit = float("-inf")
+        self.tokens = tokens
+        self.refilled_at = now
+        self.recent = []  # (хэш текста, время) последних засчитанных сообщений
+
+
+class MessageGate:
+    """
+    Решает в памяти, засчитывается ли сообщение, до любой работы с базой.
+    Правила берутся из настроек сервера (utils/server_settings):
+    min_msg_length, msg_cooldown, max_msgs_per_minute (token bucket) + повтор текста.
+    """
+
+    def __init__(self, max_users: int = ANTISPAM_MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()  # (server_id, user_id) -> _UserState
+        self.credited = 0
+        self.dropped = {}  # причина -> сколько
+
+    def _drop(self, reason: str) -> bool:
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        MESSAGES.inc(1, reason)
+        return False
+
+    def allow(self, user_id: int, server_id: int, content: str, rules, now: float | None = None) -> bool:
+        if rules.min_msg_length and len(content.strip()) < rules.min_msg_length:
+            return self._drop("too_short")
+
+        now = now or time.monotonic()
+        key = (server_id, user_id)
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _UserState(now, rules.max_msgs_per_minute)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+
+        if now - state.last_credit < rules.msg_cooldown:
+            return self._drop("cooldown")
+
+        if rules.max_msgs_per_minute:
+            capacity = rules.max_msgs_per_minute
+            state.tokens = min(capacity, state.tokens + (now - state.refilled_at) * capacity / 60)
+            state.refilled_at = now
+            if state.tokens < 1:
+                return self._drop("rate_limited")
+
+        digest = None
+        normalized = " ".join(content.lower().split()) if ANTISPAM_DUPLICATE_WINDOW > 0 else ""
+        # у вложений и стикеров без текста содержимое пустое — это не повтор
+        if normalized:
+            digest = hash(normalized)
+            if any(h == digest and now - at < ANTISPAM_DUPLICATE_WINDOW for h, at in state.recent):
+                return self._drop("duplicate")
+
+        if rules.max_msgs_per_minute:
+            state.tokens -= 1
+        state.last_credit = now
+        if digest is not None:
+            state.recent.append((digest, now))
+            if len(state.recent) > ANTISPAM_DUPLICATE_HISTORY:
+                del state.recent[0]
+        self.credited += 1
+        MESSAGES.inc(1, "credited")
+        return True
+
+    def forget_guild(self, server_id: int):
+        for key in [k for k in self._users if k[0] == server_id]:
+            del self._users[key]
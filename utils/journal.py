@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+
+from utils import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("PlayPal")
+
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(16 * 1024 * 1024)))  # размер сегмента до ротации
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "0.05"))  # окно группового fsync, сек
+# 0 = только write() без fsync: переживает падение процесса, но не питания
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") == "1"
+
+JOURNAL_CORRUPT = metrics.counter("playpal_journal_corrupt_records", "Повреждённые записи журнала (пропущен хвост сегмента)")
+
+_SUFFIX = ".seg"
+_LOCK_NAME = ".lock"
+# Можно ли отличить журнал живого процесса от брошенного (flock есть не везде)
+CAN_LOCK = fcntl is not None
+
+
+def _encode(record) -> bytes:
+    payload = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def _decode(line: bytes):
+    """Запись или None, если строка оборвана или не сходится контрольная сумма."""
+    if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class Journal:
+    """
+    Локальный append-only журнал: сегменты NNNNNNNNNNNNNNNN.seg из строк «crc32 json».
+    append() только кладёт запись в память; фоновая задача раз в fsync_interval дописывает
+    всё накопленное одним write + fsync (групповой коммит), и только после этого записи
+    становятся видны read(). Позиция в журнале — (номер сегмента, смещение в байтах).
+    После перезапуска запись идёт в новый сегмент, поэтому оборванный хвост старого
+    сегмента никогда не дописывается, а при чтении пропускается.
+    Пока журнал открыт, процесс держит flock на .lock в его каталоге: так другой процесс
+    отличает чужой живой журнал от брошенного (lock()).
+    """
+
+    def __init__(self, path: str, segment_bytes: int = JOURNAL_SEGMENT_BYTES,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL, fsync: bool = JOURNAL_FSYNC):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync = fsync
+        self._buffer = []
+        self._file = None
+        self._lock_file = None
+        self._segment = 0
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._dirty = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # статистика
+        self.appended = 0
+        self.synced_bytes = 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:016d}{_SUFFIX}")
+
+    def segments(self) -> list[int]:
+        return sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(self.path) if name.endswith(_SUFFIX))
+
+    @property
+    def durable_position(self) -> tuple[int, int] | None:
+        """Конец того, что уже записано на диск и доступно для read(); None — журнал не открыт на запись, читается целиком."""
+        if self._file is None:
+            return None
+        return self._segment, self._size
+
+    @property
+    def pending_records(self) -> int:
+        return len(self._buffer)
+
+    # --------------------------------------
+    # Запись
+    # --------------------------------------
+    def lock(self) -> bool:
+        """
+        Берёт эксклюзивный flock каталога журнала. False — журнал держит другой живой процесс
+        (или каталог уже удалён). Блокировку снимает unlock() или завершение процесса.
+        """
+        if self._lock_file is not None or fcntl is None:
+            return True
+        try:
+            lock_file = open(os.path.join(self.path, _LOCK_NAME), "a")
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def unlock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def remove_if_empty(self) -> bool:
+        """Удаляет каталог закрытого журнала, если в нём не осталось сегментов."""
+        if self._file is not None or self.segments():
+            return False
+        try:
+            os.remove(os.path.join(self.path, _LOCK_NAME))
+        except FileNotFoundError:
+            pass
+        self.unlock()
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            return False
+        return True
+
+    def open(self, min_segment: int = 0):
+        """Открывает новый сегмент; номер больше всех существующих и не меньше min_segment."""
+        os.makedirs(self.path, exist_ok=True)
+        if not self.lock():
+            raise RuntimeError(f"Журнал {self.path} уже открыт другим процессом")
+        existing = self.segments()
+        self._segment = max([min_segment, *(s + 1 for s in existing)])
+        self._file = open(self._segment_path(self._segment), "ab")
+        self._size = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="journal-sync")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record):
+        self._buffer.append(_encode(record))
+        self.appended += 1
+        self._dirty.set()
+
+    async def sync(self):
+        """Дописывает накопленные записи на диск; после возврата они видны read()."""
+        async with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = b"".join(self._buffer), []
+            # write и fsync блокируют — уводим с event loop
+            await asyncio.to_thread(self._write, data)
+            self._size += len(data)
+            self.synced_bytes += len(data)
+            if self._size >= self.segment_bytes:
+                self._file.close()
+                self._segment += 1
+                self._file = open(self._segment_path(self._segment), "ab")
+                self._size = 0
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            # собираем записи за окно в один fsync
+            await asyncio.sleep(self.fsync_interval)
+            self._dirty.clear()
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Не удалось записать журнал на диск, повторим")
+                self._dirty.set()
+
+    # --------------------------------------
+    # Чтение и удаление прочитанного
+    # --------------------------------------
+    async def read(self, start: tuple[int, int], limit: int):
+        """
+        До limit записей, записанных на диск после позиции start.
+        Возвращает (записи, позиция сразу за последней из них).
+        """
+        return await asyncio.to_thread(self._read, start, limit, self.durable_position)
+
+    def _read(self, start, limit, durable):
+        records = []
+        segment, offset = start
+        for current in self.segments():
+            if current < segment or (durable is not None and current > durable[0]):
+                continue
+            if current > segment:
+                segment, offset = current, 0
+            end = durable[1] if durable is not None and current == durable[0] else None
+            with open(self._segment_path(current), "rb") as f:
+                f.seek(offset)
+                while len(records) < limit and (end is None or offset < end):
+                    line = f.readline()
+                    if not line:
+                        break
+                    record = _decode(line)
+                    if record is None:
+                        # оборванная при падении запись: остаток сегмента пропускаем
+                        JOURNAL_CORRUPT.inc()
+                        logger.warning(f"Повреждённая запись журнала {self._segment_path(current)}:{offset}, хвост сегмента пропущен")
+                        offset = f.seek(0, os.SEEK_END)
+                        break
+                    records.append(record)
+                    offset += len(line)
+            if len(records) >= limit:
+                break
+        return records, (segment, offset)
+
+    def release(self, position: tuple[int, int]):
+        """
+        Удаляет сегменты, целиком лежащие до position (уже применённые).
+        После close() удаляется и последний сегмент, если он применён до конца.
+        """
+        for segment in self.segments():
+            path = self._segment_path(segment)
+            if segment < position[0] and (self._file is None or segment < self._segment):
+                os.remove(path)
+            elif segment == position[0] and self._file is None and os.path.getsize(path) <= position[1]:
+                os.remove(path)
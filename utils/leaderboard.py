@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+
+from database import queries
+from utils.server_settings import server_settings
+
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "300"))  # через сколько перечитывать рейтинг из базы, сек
+# Сколько первых мест рейтинга держать в памяти и показывать в лидерборде: обновление при начислении
+# стоит O(LEADERBOARD_SIZE), память — LEADERBOARD_SIZE записей на (сервер, scope), независимо от размера сервера
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "1000"))
+# week и month — рейтинги за текущий период (user_activity_periods), points в них — активность за период
+SCOPES = ("streak", "points", "week", "month")
+
+
+def period_start(scope: str, day: date) -> date | None:
+    """Начало периода scope, в который попадает day: понедельник ISO-недели или 1-е число; None для all-time."""
+    if scope == "week":
+        return day - timedelta(days=day.weekday())
+    if scope == "month":
+        return day.replace(day=1)
+    return None
+
+
+class ServerBoard:
+    """
+    Первые size мест рейтинга одного сервера по одному scope.
+    order — отсортированный список ключей (-score, user_id), поэтому место и страница ищутся бисекцией.
+    Участник, обогнавший последнего в топе, попадает в него при начислении, последний вытесняется.
+    Места за пределами топа не хранятся: rank() для них None, total до перечитывания может отставать.
+    """
+
+    def __init__(self, scope: str, rows, period_start: date | None = None, size: int = LEADERBOARD_SIZE):
+        self.scope = scope
+        self.period_start = period_start
+        self.size = size
+        self.total = 0  # всего участников в рейтинге, включая тех, кто не попал в топ
+        self.entries = {}  # user_id -> (streak, points)
+        self.order = []
+        self.loaded_at = time.monotonic()
+        for user_id, streak, points, total in rows:
+            self.entries[user_id] = (streak, points)
+            self.order.append(self._key(user_id, streak, points))
+            self.total = total
+        self.order.sort()
+
+    def _key(self, user_id: int, streak: int, points: float):
+        score = streak if self.scope == "streak" else points
+        return -score, user_id
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, user_id: int, streak: int, points: float):
+        key = self._key(user_id, streak, points)
+        old = self.entries.get(user_id)
+        if old is not None:
+            old_key = self._key(user_id, *old)
+            i = bisect_left(self.order, old_key)
+            if i < len(self.order) and self.order[i] == old_key:
+                del self.order[i]
+        elif len(self.order) < self.size:
+            # топ неполный — значит, в нём весь рейтинг, и участник в нём новый
+            self.total += 1
+        elif key > self.order[-1]:
+            return
+        self.entries[user_id] = (streak, points)
+        insort(self.order, key)
+        if len(self.order) > self.size:
+            _, last = self.order.pop()
+            del self.entries[last]
+
+    def page(self, offset: int, limit: int):
+        """Строки (user_id, streak, points) для страницы рейтинга."""
+        return [(user_id, *self.entries[user_id]) for _, user_id in self.order[offset:offset + limit]]
+
+    def rank(self, user_id: int) -> int | None:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        return bisect_left(self.order, self._key(user_id, *entry)) + 1
+
+
+class LeaderboardCache:
+    """
+    Кэш рейтингов по (server_id, scope) с TTL.
+    Между перечитываниями обновляется из пути начисления (apply_credits), поэтому
+    кнопки лидерборда не ходят в базу.
+    """
+
+    def __init__(self, ttl: float = LEADERBOARD_TTL):
+        self.ttl = ttl
+        self._boards = {}  # (server_id, scope) -> ServerBoard
+        self._locks = {}  # (server_id, scope) -> asyncio.Lock
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, server_id: int, scope: str) -> ServerBoard:
+        if scope not in SCOPES:
+            raise ValueError(f"Неизвестный scope лидерборда: {scope}")
+        key = (server_id, scope)
+        start = period_start(scope, server_settings.get(server_id).today())
+        board = self._boards.get(key)
+        if self._fresh(board, start):
+            self.hits += 1
+            return board
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            board = self._boards.get(key)
+            if self._fresh(board, start):
+                self.hits += 1
+                return board
+            self.misses += 1
+            rows = await queries.fetch_leaderboard_snapshot(server_id, scope, start, LEADERBOARD_SIZE)
+            board = self._boards[key] = ServerBoard(scope, rows, start)
+            return board
+
+    def _fresh(self, board: ServerBoard | None, start: date | None) -> bool:
+        # рейтинг за период устаревает и со сменой недели/месяца
+        return (
+            board is not None
+            and board.period_start == start
+            and time.monotonic() - board.loaded_at < self.ttl
+        )
+
+    def apply_credits(self, credited):
+        """
+        credited: строки credit_activity (user_id, server_id, currency, balance, streak, xp, messages,
+        voice_minutes, день, активность за неделю, активность за месяц).
+        """
+        for user_id, server_id, _, balance, streak, _, _, _, day, week_points, month_points, *_ in credited:
+            scores = {"streak": balance, "points": balance, "week": week_points, "month": month_points}
+            for scope in SCOPES:
+                board = self._boards.get((server_id, scope))
+                # итог другого периода (пачка через полночь) в этот рейтинг не попадает
+                if board is not None and board.period_start == period_start(scope, day):
+                    board.update(user_id, streak, scores[scope])
+
+    def invalidate(self, server_id: int | None = None):
+        if server_id is None:
+            self._boards.clear()
+            return
+        for scope in SCOPES:
+            self._boards.pop((server_id, scope), None)
+
+
+leaderboards = LeaderboardCache()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+
+import discord
+
+from database import queries
+from utils import metrics
+
+logger = logging.getLogger("PlayPal")
+
+# Кривая по умолчанию (для серверов без строки в server_level_curves)
+LEVEL_CURVE_BASE = float(os.getenv("LEVEL_CURVE_BASE", "100"))
+LEVEL_CURVE_EXPONENT = float(os.getenv("LEVEL_CURVE_EXPONENT", "1.5"))
+LEVEL_MAX = int(os.getenv("LEVEL_MAX", "200"))
+LEVEL_FLUSH_INTERVAL = float(os.getenv("LEVEL_FLUSH_INTERVAL", "5"))  # сек
+LEVEL_CACHE_SIZE = int(os.getenv("LEVEL_CACHE_SIZE", "200000"))
+# Писать о новых уровнях в системный канал сервера
+LEVEL_UP_NOTIFY = os.getenv("LEVEL_UP_NOTIFY", "1") == "1"
+
+
+class LevelCurve:
+    """
+    Кривая уровней, заранее развёрнутая в массив порогов:
+    thresholds[i] — XP для уровня i + 2, поэтому уровень — 1 + бисекция, без цикла по уровням.
+    """
+
+    def __init__(self, base: float = LEVEL_CURVE_BASE, exponent: float = LEVEL_CURVE_EXPONENT, max_level: int = LEVEL_MAX):
+        self.base = base
+        self.exponent = exponent
+        self.max_level = max_level
+        self.thresholds = [round(base * (level - 1) ** exponent) for level in range(2, max_level + 1)]
+
+    def level(self, xp: float) -> int:
+        return 1 + bisect_right(self.thresholds, xp)
+
+    def xp_for(self, level: int) -> float:
+        """Сколько всего XP нужно для уровня (0 для первого)."""
+        if level <= 1:
+            return 0
+        return self.thresholds[min(level, self.max_level) - 2]
+
+
+DEFAULT_CURVE = LevelCurve()
+
+
+class LevelEngine:
+    """
+    Уровни по итоговому XP из результатов начисления.
+    Повышения копятся и пишутся в users.level одной пачкой; в ответ база отдаёт только
+    реальные изменения, о которых и сообщается (по одному сообщению на сервер за сброс).
+    """
+
+    def __init__(self, bot, flush_interval: float = LEVEL_FLUSH_INTERVAL, cache_size: int = LEVEL_CACHE_SIZE):
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._curves = {}  # server_id -> LevelCurve
+        self._known = OrderedDict()  # (user_id, server_id) -> последний записанный уровень
+        self._pending = {}  # (user_id, server_id) -> новый уровень
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.level_ups = 0
+
+    def curve(self, server_id: int) -> LevelCurve:
+        return self._curves.get(server_id, DEFAULT_CURVE)
+
+    def level_of(self, server_id: int, xp: float) -> int:
+        return self.curve(server_id).level(xp)
+
+    async def load(self):
+        self._curves = {
+            server_id: LevelCurve(base, exponent, max_level)
+            for server_id, base, exponent, max_level in await queries.fetch_level_curves()
+        }
+        self._known.clear()
+
+    # --------------------------------------
+    # Проверка начислений
+    # --------------------------------------
+    def apply_credits(self, credited):
+        """Слушатель буфера активности: строки credit_activity (user_id, server_id, currency, balance, streak, xp, ...)."""
+        for row in credited:
+            key = (row[0], row[1])
+            level = self.level_of(row[1], row[5])
+            if self._known.get(key) == level:
+                self._known.move_to_end(key)
+                continue
+            # уровень неизвестен или вырос — база сама отсеет то, что уже записано
+            self._pending[key] = level
+        if self._pending:
+            self._wake.set()
+
+    def _remember(self, key, level: int):
+        self._known[key] = level
+        self._known.move_to_end(key)
+        while len(self._known) > self.cache_size:
+            self._known.popitem(last=False)
+
+    # --------------------------------------
+    # Фоновая запись и уведомления
+    # --------------------------------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="level-engine")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(notify=False)
+
+    async def flush(self, notify: bool = LEVEL_UP_NOTIFY):
+        if not self._pending:
+            return []
+        batch, self._pending = self._pending, {}
+        try:
+            raised = await queries.raise_levels([(user_id, server_id, level) for (user_id, server_id), level in batch.items()])
+        except Exception:
+            for key, level in batch.items():
+                self._pending.setdefault(key, level)
+            raise
+        for key, level in batch.items():
+            self._remember(key, level)
+        self.level_ups += len(raised)
+        if notify and raised:
+            await self._notify(raised)
+        return raised
+
+    async def _notify(self, raised):
+        by_guild = {}
+        for user_id, server_id, level in raised:
+            by_guild.setdefault(server_id, []).append((user_id, level))
+        for server_id, items in by_guild.items():
+            guild = self.bot.get_guild(server_id)
+            channel = guild.system_channel if guild is not None else None
+            if channel is None or not channel.permissions_for(guild.me).send_messages:
+                continue
+            lines = [f"<@{user_id}> — уровень {level}" for user_id, level in items[:20]]
+            if len(items) > 20:
+                lines.append(f"…и ещё {len(items) - 20}")
+            try:
+                await channel.send(
+                    "🎉 Новые уровни:\n" + "\n".join(lines),
+                    allowed_mentions=discord.AllowedMentions(users=False),
+                )
+            except discord.HTTPException as e:
+                logger.warning(f"Не удалось отправить уведомление об уровнях на {server_id}: {e}")
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            # собираем повышения нескольких сбросов буфера в одну пачку
+            await asyncio.sleep(self.flush_interval)
+            self._wake.clear()
+            try:
+                with metrics.track("task", "level_update"):
+                    await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать уровни, повторим позже")
+                self._wake.set()
+
+    # --------------------------------------
+    # Смена кривой
+    # --------------------------------------
+    async def set_curve(self, server_id: int, base: float, exponent: float, max_level: int) -> int:
+        """Сохраняет кривую сервера и пересчитывает уровни всех его участников одним запросом."""
+        curve = LevelCurve(base, exponent, max_level)
+        await queries.save_level_curve(server_id, base, exponent, max_level)
+        self._curves[server_id] = curve
+        for key in [k for k in self._known if k[1] == server_id]:
+            del self._known[key]
+        return await queries.recompute_levels(server_id, curve.thresholds)
@@ -1,36 +1,166 @@
+import atexit
+import json
 import logging
-from database.db import get_connection
+import os
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from database.activity_log import activity_log_writer
+from utils import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" или "json"
+# Сколько записей может ждать вывода; при переполнении новые отбрасываются, а не блокируют бота
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля строк активности по типам событий, например "Message=0.05,VoiceCall=1"; по умолчанию 1.0
+LOG_ACTIVITY_SAMPLE = os.getenv("LOG_ACTIVITY_SAMPLE", "")
+# Не больше стольких строк активности в секунду на тип события; 0 = без ограничения
+LOG_ACTIVITY_RATE_LIMIT = float(os.getenv("LOG_ACTIVITY_RATE_LIMIT", "20"))
+
+LOG_DROPPED = metrics.counter("playpal_log_dropped", "Записи лога, отброшенные из-за переполнения очереди")
+LOG_SUPPRESSED = metrics.counter(
+    "playpal_log_suppressed", "Строки активности, отсеянные сэмплированием или лимитом", ("action", "reason"),
+)
+
+_listener: QueueListener | None = None
+
+
+# --------------------------------------
+# Форматирование и очередь
+# --------------------------------------
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля из extra={"event": {...}} попадают в объект как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            data.update(event)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Сообщение собирается уже в потоке QueueListener, а не в обработчике события.
+        # Трейсбек рендерим сразу: кадры стека к тому времени могут измениться.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
 
 def setup_logger():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(message)s",
-        handlers=[logging.StreamHandler()]
-    )
+    """
+    Настраивает вывод один раз на процесс (повторные вызовы просто возвращают логгер).
+    Записи уходят в очередь, в stdout их пишет фоновый поток QueueListener.
+    """
+    global _listener
+    if _listener is None:
+        stream = logging.StreamHandler()
+        if LOG_FORMAT == "json":
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        root = logging.getLogger()
+        root.handlers[:] = [_NonBlockingQueueHandler(log_queue)]
+        root.setLevel(LOG_LEVEL)
+        _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logger)
     return logging.getLogger("PlayPal")
 
+
+def shutdown_logger():
+    """Дописывает очередь и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# --------------------------------------
+# Лог активности
+# --------------------------------------
+def _parse_rates(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        action, _, rate = item.partition("=")
+        rates[action.strip()] = float(rate)
+    return rates
+
+
+class _ActivityLogGate:
+    """Сэмплирование и лимит строк в секунду для каждого типа события (token bucket)."""
+
+    def __init__(self, sample_rates: dict, rate_limit: float):
+        self.sample_rates = sample_rates
+        self.rate_limit = rate_limit
+        self._buckets = {}  # action -> [токены, время пополнения]
+
+    def allow(self, action: str) -> bool:
+        rate = self.sample_rates.get(action, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            LOG_SUPPRESSED.inc(1, action, "sampled")
+            return False
+        if self.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(action)
+        if bucket is None:
+            bucket = self._buckets[action] = [self.rate_limit, now]
+        bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+        bucket[1] = now
+        if bucket[0] < 1:
+            LOG_SUPPRESSED.inc(1, action, "rate_limited")
+            return False
+        bucket[0] -= 1
+        return True
+
+
+_activity_gate = _ActivityLogGate(_parse_rates(LOG_ACTIVITY_SAMPLE), LOG_ACTIVITY_RATE_LIMIT)
+
+
 def log_user_activity(user, server_id: int, action: str, points: float = 0.0, context: str = None):
     """
-    user: discord.User или discord.Member
+    user: discord.User, discord.Member или user_id
     server_id: ID сервера
     action: тип активности ("сообщение", "голос", "реакция", "команда")
     points: начисленные поинты
     context: текст сообщения, эмоджи и т.д.
     """
-    username = f"{user.name}#{user.discriminator}" if hasattr(user, "discriminator") else str(user)
+    user_id = getattr(user, "id", user)
+
+    # Сохранение в БД — через очередь, пачками (не зависит от уровня логирования)
+    activity_log_writer.submit(user_id, server_id, action, context, points)
+
     logger = logging.getLogger("PlayPal")
-    msg = f"Активность: {username} | {action} | +{points:.2f} pts"
-    if context:
-        truncated = (context[:100] + "...") if len(context) > 100 else context
-        msg += f" | context: {truncated}"
-    logger.info(msg)
-
-    # Сохранение в БД
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO activity_logs(user_id, server_id, type, context, value)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (user.id, server_id, action, context, points))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    if not logger.isEnabledFor(logging.INFO) or not _activity_gate.allow(action):
+        return
+    truncated = ((context[:100] + "...") if len(context) > 100 else context) if context else None
+    logger.info(
+        "Активность: %s | %s | +%.2f pts%s",
+        str(user), action, points, f" | context: {truncated}" if truncated else "",
+        extra={"event": {
+            "event": "activity", "user_id": user_id, "server_id": server_id,
+            "action": action, "points": points, "context": truncated,
+        }},
+    )
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("PlayPal")
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # как часто мерить, сек
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "250"))  # порог для предупреждения
+
+
+class LoopLagMonitor:
+    """
+    Мерит, насколько event loop опаздывает с пробуждением: задача спит interval секунд,
+    а всё, что сверху, — время, когда loop был занят синхронным кодом.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn_ms: float = LOOP_LAG_WARN_MS):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.total_blocked_ms = 0.0
+        self.samples = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="loop-lag-monitor")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.interval) * 1000)
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            self.total_blocked_ms += lag_ms
+            self.samples += 1
+            if lag_ms >= self.warn_ms:
+                logger.warning(f"Event loop был заблокирован на {lag_ms:.0f} мс")
+
+    def stats(self) -> dict:
+        return {
+            "last_lag_ms": self.last_lag_ms,
+            "max_lag_ms": self.max_lag_ms,
+            "total_blocked_ms": self.total_blocked_ms,
+            "samples": self.samples,
+        }
+
+
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,176 @@
+import contextvars
+import functools
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# --------------------------------------
+# Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+# Отдаются по HTTP из api/endpoints.py.
+# --------------------------------------
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Какой обработчик сейчас выполняется — к нему привязываются запросы в базу
+_current_handler = contextvars.ContextVar("playpal_handler", default="other")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, *labels):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}_total{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), callback=None):
+        """callback() -> число или {метки(tuple): число}; вызывается при каждом скрейпе."""
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        for labels, value in values.items():
+            if value is not None:
+                yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [счётчики по корзинам..., +Inf], сумма
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + ("+Inf" if math.isinf(bound) else repr(bound)) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames=(), callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, callback))
+
+
+def histogram(name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# --------------------------------------
+# Общие метрики бота
+# --------------------------------------
+HANDLER_SECONDS = histogram(
+    "playpal_handler_seconds", "Время выполнения слушателей, команд и фоновых задач", ("kind", "handler"),
+)
+HANDLER_ERRORS = counter("playpal_handler_errors", "Исключения в обработчиках", ("kind", "handler"))
+DB_QUERY_SECONDS = histogram(
+    "playpal_db_query_seconds", "Время запросов в базу по обработчикам (count = число запросов)", ("handler",),
+)
+
+
+def observe_query(seconds: float):
+    DB_QUERY_SECONDS.observe(seconds, _current_handler.get())
+
+
+@contextmanager
+def track(kind: str, name: str):
+    """Замеряет блок кода и привязывает к нему запросы в базу."""
+    token = _current_handler.set(f"{kind}:{name}")
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        HANDLER_ERRORS.inc(1, kind, name)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(time.perf_counter() - started, kind, name)
+        _current_handler.reset(token)
+
+
+def instrumented(kind: str, name: str | None = None):
+    """Декоратор для async-обработчиков: слушателей ("listener"), слеш-команд ("command"), задач ("task")."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(kind, label):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
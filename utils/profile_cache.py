@@ -0,0 +1,74 @@
+import os
+import time
+from collections import OrderedDict
+
+from database import queries
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))  # максимум профилей в памяти
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "600"))  # сек
+
+
+class ProfileCache:
+    """
+    Профили (points, streak, xp) по (user_id, server_id) для /me.
+    Бот — единственный, кто пишет эти числа, поэтому кэш обновляется прямо из
+    результатов начисления (apply_credits), а база читается только при промахе.
+    Ручные изменения баланса/стрика должны вызывать invalidate().
+    """
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # (user_id, server_id) -> ((points, streak, xp) | None, expires_at)
+        # растёт при каждой записи; чтение из базы, во время которого были записи, не кэшируется
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _put(self, key, profile):
+        self._cache[key] = (profile, time.monotonic() + self.ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: int, server_id: int):
+        """(points, streak, xp) или None, если пользователя нет."""
+        key = (user_id, server_id)
+        item = self._cache.get(key)
+        if item is not None and item[1] >= time.monotonic():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        generation = self._generation
+        row = await queries.fetch_profile(user_id, server_id)
+        profile = tuple(row) if row else None
+        if generation == self._generation:
+            self._put(key, profile)
+        return profile
+
+    def apply_credits(self, credited):
+        """credited: строки credit_activity (user_id, server_id, currency, balance, streak, xp)."""
+        self._generation += 1
+        for user_id, server_id, _, balance, streak, xp, *_ in credited:
+            self._put((user_id, server_id), (balance, streak, xp))
+
+    def invalidate(self, user_id: int | None = None, server_id: int | None = None):
+        """Сбрасывает профиль пользователя, весь сервер (только server_id) или всё."""
+        self._generation += 1
+        if user_id is not None and server_id is not None:
+            self._cache.pop((user_id, server_id), None)
+        elif server_id is not None:
+            for key in [k for k in self._cache if k[1] == server_id]:
+                del self._cache[key]
+        else:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "cached": len(self._cache)}
+
+
+profile_cache = ProfileCache()
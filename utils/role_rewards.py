@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+
+import discord
+
+from database import queries
+from utils import metrics
+
+logger = logging.getLogger("PlayPal")
+
+ROLE_SYNC_RATE = float(os.getenv("ROLE_SYNC_RATE", "5"))  # правок ролей в секунду на процесс
+ROLE_SYNC_BACKOFF = float(os.getenv("ROLE_SYNC_BACKOFF", "10"))  # пауза после 429, сек
+ROLE_RECONCILE_INTERVAL = float(os.getenv("ROLE_RECONCILE_INTERVAL", "3600"))  # полная сверка ролей, сек
+
+
+class ServerRoleRules:
+    """
+    Роли-награды одного сервера из server_roles.
+    Пороги отсортированы, поэтому «ступень» участника — две бисекции, а набор ролей
+    пересчитывается только при переходе на другую ступень.
+    """
+
+    def __init__(self, rows):
+        self.rules = sorted(rows, key=lambda r: (r[1], r[2]))  # (role_id, required_points, required_level)
+        self.role_ids = {role_id for role_id, _, _ in self.rules}
+        self.point_steps = sorted({required_points for _, required_points, _ in self.rules})
+        self.level_steps = sorted({required_level for _, _, required_level in self.rules})
+
+    def tier(self, points: float, level: int):
+        return bisect_right(self.point_steps, points), bisect_right(self.level_steps, level)
+
+    def desired(self, points: float, level: int) -> set:
+        return {role_id for role_id, rp, rl in self.rules if rp <= points and rl <= level}
+
+
+class RoleRewards:
+    """
+    Выдача и снятие ролей по server_roles.
+    Переходы порогов ловятся из результатов начисления (apply_credits), сверка всех
+    участников — reconcile(). Изменения копятся в очереди, сворачиваются по участнику
+    (одна правка на участника, сколько бы порогов он ни прошёл) и применяются
+    фоновым воркером не чаще ROLE_SYNC_RATE в секунду.
+    """
+
+    def __init__(self, bot, level_of, rate: float = ROLE_SYNC_RATE):
+        """level_of(server_id, xp) -> уровень (LevelEngine.level_of)."""
+        self.bot = bot
+        self.level_of = level_of
+        self.rate = rate
+        self._rules = {}  # server_id -> ServerRoleRules
+        self._tiers = {}  # (server_id, user_id) -> последняя ступень
+        self._queue = OrderedDict()  # (server_id, user_id) -> нужный набор управляемых ролей
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._forbidden = set()  # серверы, где не хватает прав, — предупреждаем один раз
+        # статистика
+        self.applied = 0
+        self.errors = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    async def load(self):
+        rows = {}
+        for server_id, role_id, required_points, required_level in await queries.fetch_role_rules():
+            rows.setdefault(server_id, []).append((role_id, required_points or 0, required_level or 0))
+        self._rules = {server_id: ServerRoleRules(items) for server_id, items in rows.items()}
+        self._tiers.clear()
+
+    def forget_guild(self, server_id: int):
+        self._rules.pop(server_id, None)
+        for key in [k for k in self._tiers if k[0] == server_id]:
+            del self._tiers[key]
+        for key in [k for k in self._queue if k[0] == server_id]:
+            del self._queue[key]
+
+    # --------------------------------------
+    # Поиск изменений
+    # --------------------------------------
+    def _check(self, guild, rules: ServerRoleRules, user_id: int, points: float, level: int, force: bool = False):
+        key = (guild.id, user_id)
+        tier = rules.tier(points, level)
+        if not force and self._tiers.get(key) == tier:
+            return
+        self._tiers[key] = tier
+        member = guild.get_member(user_id)
+        if member is None:
+            return
+        desired = rules.desired(points, level)
+        current = {role.id for role in member.roles} & rules.role_ids
+        if current != desired:
+            self._queue[key] = desired
+            self._queue.move_to_end(key)
+            self._wake.set()
+
+    def apply_credits(self, credited):
+        """Слушатель буфера активности: строки credit_activity (user_id, server_id, currency, balance, streak, xp, ...)."""
+        for row in credited:
+            user_id, server_id, balance, xp = row[0], row[1], row[3], row[5]
+            rules = self._rules.get(server_id)
+            if rules is None:
+                continue
+            guild = self.bot.get_guild(server_id)
+            if guild is not None:
+                self._check(guild, rules, user_id, balance, self.level_of(server_id, xp))
+
+    async def reconcile(self, guild) -> int:
+        """Сверяет роли всех участников сервера с базой одним запросом. Возвращает число поставленных в очередь."""
+        rules = self._rules.get(guild.id)
+        if rules is None:
+            return 0
+        before = len(self._queue)
+        stats = {user_id: (points, level) for user_id, points, level in await queries.fetch_role_stats(guild.id)}
+        for member in guild.members:
+            if not member.bot:
+                points, level = stats.get(member.id, (0, 1))
+                self._check(guild, rules, member.id, points or 0, level or 1, force=True)
+        return len(self._queue) - before
+
+    # --------------------------------------
+    # Применение
+    # --------------------------------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="role-rewards")
+
+    async def stop(self):
+        """Останавливает воркер и дожидается его завершения, чтобы пул не закрылся под текущей правкой."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _apply(self, server_id: int, user_id: int, desired: set):
+        guild = self.bot.get_guild(server_id)
+        rules = self._rules.get(server_id)
+        member = guild.get_member(user_id) if guild is not None else None
+        if member is None or rules is None:
+            return
+        # разница считается в момент применения и отправляется только она: add_roles/remove_roles
+        # не трогают остальные роли, поэтому одновременная ручная правка модератора не откатится
+        top = guild.me.top_role
+        current = {role.id for role in member.roles}
+        grant = [role for role in (guild.get_role(role_id) for role_id in desired - current) if role is not None and role < top]
+        revoke = [role for role in member.roles if role.id in rules.role_ids and role.id not in desired and role < top]
+        if not grant and not revoke:
+            return
+        reason = "PlayPal: роли за активность"
+        if grant:
+            await member.add_roles(*grant, reason=reason)
+        if revoke:
+            await member.remove_roles(*revoke, reason=reason)
+        self.applied += 1
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._queue:
+                (server_id, user_id), desired = self._queue.popitem(last=False)
+                try:
+                    with metrics.track("task", "role_sync"):
+                        await self._apply(server_id, user_id, desired)
+                except discord.Forbidden:
+                    self.errors += 1
+                    if server_id not in self._forbidden:
+                        self._forbidden.add(server_id)
+                        logger.warning(f"Нет прав выдавать роли на сервере {server_id}")
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as e:
+                    self.errors += 1
+                    if e.status == 429:
+                        # вернём в очередь, если за это время не пришло более свежее состояние
+                        self._queue.setdefault((server_id, user_id), desired)
+                        await asyncio.sleep(ROLE_SYNC_BACKOFF)
+                    else:
+                        logger.warning(f"Не удалось обновить роли {user_id} на {server_id}: {e}")
+                except Exception:
+                    self.errors += 1
+                    logger.exception("Ошибка выдачи ролей")
+                await asyncio.sleep(1 / self.rate)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from database import queries
+from database.db import connect_listener
+
+logger = logging.getLogger("PlayPal")
+
+SETTINGS_TTL = float(os.getenv("SETTINGS_TTL", "300"))  # полная перезагрузка, если NOTIFY потерялся, сек
+SETTINGS_LISTEN_RETRY = float(os.getenv("SETTINGS_LISTEN_RETRY", "10"))  # пауза перед переподключением LISTEN, сек
+
+
+# --------------------------------------
+# Локальный день сервера
+# --------------------------------------
+_zones = {}  # имя часового пояса -> tzinfo
+_today = {}  # имя часового пояса -> (день, unix-время следующей полуночи)
+
+
+def zone(name: str):
+    """tzinfo по имени IANA; неизвестный пояс (например, вписанный в базу руками) заменяется на UTC."""
+    tz = _zones.get(name)
+    if tz is None:
+        try:
+            tz = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Неизвестный часовой пояс {name!r}, используется UTC")
+            tz = timezone.utc
+        _zones[name] = tz
+    return tz
+
+
+def local_today(name: str) -> date:
+    """
+    Текущий день в поясе name. Результат кэшируется до следующей местной полуночи,
+    поэтому на каждое сообщение это одно сравнение, а не перевод времени.
+    """
+    now = time.time()
+    cached = _today.get(name)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    tz = zone(name)
+    day = datetime.fromtimestamp(now, tz).date()
+    midnight = datetime.combine(day + timedelta(days=1), datetime.min.time(), tz)
+    _today[name] = (day, midnight.timestamp())
+    return day
+
+
+class Settings:
+    """Правила начисления одного сервера."""
+
+    __slots__ = (
+        "msg_points", "voice_points_per_min", "xp_per_msg", "xp_per_voice_min",
+        "daily_max_points", "currency_ratio", "msg_cooldown", "min_msg_length", "max_msgs_per_minute",
+        "timezone",
+    )
+    FIELDS = __slots__
+
+    def __init__(self, *values):
+        for name, value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+
+    def merged(self, values) -> "Settings":
+        """Копия, где не-NULL значения (в порядке FIELDS) заменяют текущие."""
+        return Settings(*(own if value is None else value for own, value in zip(self.as_tuple(), values)))
+
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def today(self) -> date:
+        """Текущий день сервера: от него считаются дневной лимит, стрики и периоды рейтингов."""
+        return local_today(self.timezone)
+
+
+# Значения по умолчанию для серверов без своих настроек
+DEFAULTS = Settings(
+    float(os.getenv("MSG_POINTS", "0.1")),
+    float(os.getenv("VOICE_POINTS_PER_MIN", "0.05")),  # 0.5 за 10 минут
+    float(os.getenv("XP_PER_MSG", "5")),
+    float(os.getenv("XP_PER_VOICE_MIN", "1")),
+    float(os.getenv("DAILY_MAX_POINTS", "50")),  # максимум валюты в день
+    float(os.getenv("CURRENCY_RATIO", "1.0")),  # 1 активность = 1 валюта (до лимита)
+    float(os.getenv("MSG_COOLDOWN", "0")),  # сек между засчитанными сообщениями
+    int(os.getenv("MIN_MSG_LENGTH", "0")),
+    int(os.getenv("MAX_MSGS_PER_MINUTE", "0")),  # 0 = без ограничения
+    os.getenv("DEFAULT_TIMEZONE", os.getenv("TZ", "UTC")),  # имя IANA, например Europe/Moscow
+)
+
+
+class SettingsCache:
+    """
+    Настройки всех серверов в памяти: get() — просто словарь, без запроса в базу.
+    Загружаются при старте, точечно обновляются по NOTIFY server_settings
+    (триггер в базе) и раз в SETTINGS_TTL перечитываются целиком на случай потерянных уведомлений.
+    """
+
+    def __init__(self, ttl: float = SETTINGS_TTL):
+        self.ttl = ttl
+        self._settings = {}  # server_id -> Settings
+        self._loaded_at = 0.0
+        self._task: asyncio.Task | None = None
+        self.reloads = 0
+
+    def get(self, server_id: int) -> Settings:
+        return self._settings.get(server_id, DEFAULTS)
+
+    async def load(self):
+        rows = await queries.fetch_server_settings()
+        self._settings = {row[0]: DEFAULTS.merged(row[1:]) for row in rows}
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    async def refresh(self, server_id: int):
+        rows = await queries.fetch_server_settings(server_id)
+        if rows:
+            self._settings[server_id] = DEFAULTS.merged(rows[0][1:])
+        else:
+            self._settings.pop(server_id, None)
+
+    async def update(self, server_id: int, **values):
+        """Сохраняет изменения (None — не менять) и сразу применяет их в этом процессе."""
+        await queries.save_server_settings(server_id, {k: v for k, v in values.items() if v is not None})
+        await self.refresh(server_id)
+
+    async def reset(self, server_id: int):
+        await queries.delete_server_settings(server_id)
+        self._settings.pop(server_id, None)
+
+    # --------------------------------------
+    # Обновление по NOTIFY и TTL
+    # --------------------------------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="server-settings-listener")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _listen(self):
+        conn = await connect_listener()
+        try:
+            await conn.execute("LISTEN server_settings")
+            # уведомления до LISTEN могли потеряться
+            await self.load()
+            while True:
+                async for notify in conn.notifies(timeout=self.ttl):
+                    try:
+                        await self.refresh(int(notify.payload))
+                    except Exception:
+                        logger.exception(f"Не удалось обновить настройки сервера {notify.payload}")
+                if time.monotonic() - self._loaded_at >= self.ttl:
+                    await self.load()
+        finally:
+            await conn.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN server_settings прервался, переподключаемся")
+            await asyncio.sleep(SETTINGS_LISTEN_RETRY)
+
+
+server_settings = SettingsCache()
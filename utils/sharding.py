@@ -0,0 +1,29 @@
+# --------------------------------------
+# Шарды: разбор SHARD_IDS и раздача шардов процессам
+# --------------------------------------
+
+
+def parse_shard_ids(spec: str) -> list[int]:
+    """"0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]; пустая строка -> []."""
+    ids = set()
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        start, _, end = part.partition("-")
+        ids.update(range(int(start), int(end or start) + 1))
+    return sorted(ids)
+
+
+def format_shard_ids(ids) -> str:
+    return ",".join(str(shard_id) for shard_id in ids)
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Делит шарды 0..shard_count-1 на processes непрерывных диапазонов почти равного размера."""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
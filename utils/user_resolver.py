@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import discord
+
+logger = logging.getLogger("PlayPal")
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))  # сек
+USER_FETCH_CONCURRENCY = int(os.getenv("USER_FETCH_CONCURRENCY", "5"))
+USER_FETCH_BACKOFF = float(os.getenv("USER_FETCH_BACKOFF", "30"))  # пауза после 429, сек
+
+
+class UserResolver:
+    """
+    Отображаемые имена пользователей без лишних REST-запросов:
+    1) участник из кэша гейтвея (guild.get_member / bot.get_user),
+    2) LRU с TTL,
+    3) оставшиеся промахи — параллельно через fetch_user, не больше USER_FETCH_CONCURRENCY за раз.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL,
+                 concurrency: int = USER_FETCH_CONCURRENCY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # user_id -> (display_name, expires_at)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._backoff_until = 0.0
+        # статистика
+        self.gateway_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.fetch_errors = 0
+
+    def _get_cached(self, user_id: int) -> str | None:
+        item = self._cache.get(user_id)
+        if item is None:
+            return None
+        name, expires_at = item
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return name
+
+    def _put(self, user_id: int, name: str):
+        self._cache[user_id] = (name, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, bot, user_id: int) -> str:
+        fallback = f"Пользователь {user_id}"
+        if time.monotonic() < self._backoff_until:
+            return fallback
+        async with self._semaphore:
+            try:
+                user = await bot.fetch_user(user_id)
+            except discord.NotFound:
+                self._put(user_id, fallback)
+                return fallback
+            except discord.HTTPException as e:
+                self.fetch_errors += 1
+                if e.status == 429:
+                    # упёрлись в лимит — на время перестаём ходить в REST
+                    self._backoff_until = time.monotonic() + USER_FETCH_BACKOFF
+                    logger.warning("fetch_user упёрся в rate limit, имена временно не запрашиваются")
+                return fallback
+        self._put(user_id, user.display_name)
+        return user.display_name
+
+    async def display_names(self, bot, guild, user_ids) -> dict:
+        """user_id -> отображаемое имя для всех переданных id."""
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user = (guild.get_member(user_id) if guild is not None else None) or bot.get_user(user_id)
+            if user is not None:
+                self.gateway_hits += 1
+                names[user_id] = user.display_name
+                continue
+            name = self._get_cached(user_id)
+            if name is not None:
+                self.cache_hits += 1
+                names[user_id] = name
+                continue
+            self.misses += 1
+            missing.append(user_id)
+
+        if missing:
+            fetched = await asyncio.gather(*(self._fetch(bot, user_id) for user_id in missing))
+            names.update(zip(missing, fetched))
+        return names
+
+    def stats(self) -> dict:
+        return {
+            "gateway_hits": self.gateway_hits,
+            "cache_hits": self.cache_hits,
+            "misses": self.misses,
+            "fetch_errors": self.fetch_errors,
+            "cached": len(self._cache),
+        }
+
+
+user_resolver = UserResolver()
@@ -0,0 +1,178 @@
+import os
+import time
+
+from database import queries
+
+# Правила начисления за голос
+VOICE_MIN_MEMBERS = int(os.getenv("VOICE_MIN_MEMBERS", "2"))  # сколько людей (не ботов) должно быть в канале
+VOICE_CREDIT_DEAFENED = os.getenv("VOICE_CREDIT_DEAFENED", "0") == "1"
+VOICE_CREDIT_MUTED = os.getenv("VOICE_CREDIT_MUTED", "1") == "1"
+# Сколько минут простоя бота засчитывать тем, кто остался в голосе после перезапуска
+VOICE_RESUME_MAX_MINUTES = int(os.getenv("VOICE_RESUME_MAX_MINUTES", "10"))
+
+
+class VoiceSession:
+    __slots__ = ("user_id", "server_id", "channel_id", "started_at", "last_credited_at")
+
+    def __init__(self, user_id: int, server_id: int, channel_id: int, started_at: float, last_credited_at: float):
+        self.user_id = user_id
+        self.server_id = server_id
+        self.channel_id = channel_id
+        self.started_at = started_at
+        self.last_credited_at = last_credited_at
+
+
+def is_creditable(member, state) -> bool:
+    """Засчитывается ли время в этом голосовом состоянии: не AFK, не в заглушке, не один в канале."""
+    channel = state.channel
+    if channel is None:
+        return False
+    if member.guild.afk_channel is not None and channel.id == member.guild.afk_channel.id:
+        return False
+    if not VOICE_CREDIT_DEAFENED and (state.self_deaf or state.deaf):
+        return False
+    if not VOICE_CREDIT_MUTED and (state.self_mute or state.mute):
+        return False
+    # сам участник считается всегда: для before после выхода или перехода его уже нет в channel.members
+    humans = 1 + sum(1 for m in channel.members if not m.bot and m.id != member.id)
+    return humans >= VOICE_MIN_MEMBERS
+
+
+class VoiceTracker:
+    """
+    Голосовые сессии всех серверов процесса.
+    Состояние живёт в памяти и раз в тик одним запросом сохраняется в voice_sessions,
+    поэтому переживает перезапуск. Начисления возвращаются вызывающему пачкой.
+    """
+
+    def __init__(self):
+        self._sessions = {}  # (server_id, user_id) -> VoiceSession
+        self._dirty = set()  # ключи, которые надо сохранить
+        self._ended = set()  # ключи, которые надо удалить из базы
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # --------------------------------------
+    # Восстановление после старта/реконнекта
+    # --------------------------------------
+    async def rebuild(self, guilds, now: float | None = None):
+        """
+        Сверяет сохранённые сессии с guild.voice_states.
+        Возвращает начисления (member, server_id, minutes) за время простоя, не больше VOICE_RESUME_MAX_MINUTES.
+        """
+        now = now or time.time()
+        guilds = list(guilds)
+        saved = {(row[1], row[0]): row for row in await queries.fetch_voice_sessions([g.id for g in guilds])}
+        credits = []
+        for guild in guilds:
+            for member in guild.members:
+                state = member.voice
+                if member.bot or state is None or state.channel is None:
+                    continue
+                key = (guild.id, member.id)
+                # до проверки: после реконнекта живая сессия уже в памяти, и её строку нельзя удалять
+                row = saved.pop(key, None)
+                if key in self._sessions:
+                    continue
+                if row is None:
+                    self._start(member, state.channel.id, now)
+                    continue
+                _, _, _, started_at, last_credited_at = row
+                session = VoiceSession(member.id, guild.id, state.channel.id, started_at, last_credited_at)
+                self._sessions[key] = session
+                self._dirty.add(key)
+                if is_creditable(member, state):
+                    minutes = min(int((now - last_credited_at) / 60), VOICE_RESUME_MAX_MINUTES)
+                    if minutes > 0:
+                        credits.append((member, guild.id, minutes))
+                session.last_credited_at = now
+        # кто вышел, пока бот был офлайн, — сессия просто закрывается
+        self._ended.update(saved.keys())
+        return credits
+
+    # --------------------------------------
+    # События
+    # --------------------------------------
+    def _start(self, member, channel_id: int, now: float):
+        key = (member.guild.id, member.id)
+        self._sessions[key] = VoiceSession(member.id, member.guild.id, channel_id, now, now)
+        self._dirty.add(key)
+        self._ended.discard(key)
+
+    def _settle(self, session: VoiceSession, creditable: bool, now: float) -> int:
+        """Закрывает накопленные целые минуты; остаток секунд переносится."""
+        minutes = int((now - session.last_credited_at) / 60)
+        if not creditable:
+            session.last_credited_at = now
+            self._dirty.add((session.server_id, session.user_id))
+            return 0
+        if minutes > 0:
+            session.last_credited_at += minutes * 60
+            self._dirty.add((session.server_id, session.user_id))
+        return minutes
+
+    def on_state_update(self, member, before, after, now: float | None = None) -> int:
+        """Обрабатывает вход/выход/переход/мьют. Возвращает минуты, которые надо начислить сейчас."""
+        now = now or time.time()
+        key = (member.guild.id, member.id)
+        session = self._sessions.get(key)
+
+        # время до изменения считается по старому состоянию
+        minutes = self._settle(session, is_creditable(member, before), now) if session else 0
+
+        if after.channel is None:
+            if session is not None:
+                del self._sessions[key]
+                self._dirty.discard(key)
+                self._ended.add(key)
+        elif session is None:
+            self._start(member, after.channel.id, now)
+        elif session.channel_id != after.channel.id:
+            session.channel_id = after.channel.id
+            self._dirty.add(key)
+        return minutes
+
+    def tick(self, guilds_by_id, now: float | None = None):
+        """Начисления за прошедшие минуты для всех сессий: список (member, server_id, minutes)."""
+        now = now or time.time()
+        credits = []
+        for key, session in list(self._sessions.items()):
+            guild = guilds_by_id.get(session.server_id)
+            member = guild.get_member(session.user_id) if guild is not None else None
+            if member is None or member.voice is None or member.voice.channel is None:
+                # выход мы пропустили (например, во время реконнекта) — закрываем сессию без начисления
+                del self._sessions[key]
+                self._dirty.discard(key)
+                self._ended.add(key)
+                continue
+            minutes = self._settle(session, is_creditable(member, member.voice), now)
+            if minutes > 0:
+                credits.append((member, session.server_id, minutes))
+        return credits
+
+    def forget_guild(self, server_id: int):
+        for key in [k for k in self._sessions if k[0] == server_id]:
+            del self._sessions[key]
+            self._dirty.discard(key)
+            # строку в voice_sessions тоже удаляем, иначе после перезапуска сессия возобновится
+            self._ended.add(key)
+
+    # --------------------------------------
+    # Сохранение
+    # --------------------------------------
+    async def persist(self):
+        """Один батч: upsert изменённых сессий и удаление закрытых."""
+        dirty = [self._sessions[key] for key in self._dirty if key in self._sessions]
+        ended = list(self._ended)
+        self._dirty.clear()
+        self._ended.clear()
+        try:
+            await queries.save_voice_sessions(
+                [(s.user_id, s.server_id, s.channel_id, s.started_at, s.last_credited_at) for s in dirty],
+                [(user_id, server_id) for server_id, user_id in ended],
+            )
+        except Exception:
+            self._dirty.update((s.server_id, s.user_id) for s in dirty)
+            self._ended.update(ended)
+            raise